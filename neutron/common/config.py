@@ -55,6 +55,11 @@ core_opts = [
                help=_("The base MAC address Neutron will use for VIFs")),
     cfg.IntOpt('mac_generation_retries', default=16,
                help=_("How many times Neutron will retry MAC generation")),
+    cfg.StrOpt('ip_allocator',
+               help=_("The class used to generate the IP addresses of the "
+                      "ports, e.g. neutron.db.ip_allocator."
+                      "InMemoryIpAllocator. By default they are generated "
+                      "from the availability ranges of the subnets.")),
     cfg.BoolOpt('allow_bulk', default=True,
                 help=_("Allow the usage of the bulk API")),
     cfg.BoolOpt('allow_pagination', default=False,
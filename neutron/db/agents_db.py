@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 from eventlet import greenthread
 
 from oslo_config import cfg
@@ -26,10 +28,11 @@ from sqlalchemy import sql
 
 from neutron.api.v2 import attributes
 from neutron.common import constants
+from neutron import context as ncontext
 from neutron.db import model_base
 from neutron.db import models_v2
 from neutron.extensions import agent as ext_agent
-from neutron.i18n import _LW
+from neutron.i18n import _LE, _LW
 from neutron import manager
 from neutron.openstack.common import log as logging
 
@@ -39,6 +42,17 @@ cfg.CONF.register_opt(
                help=_("Seconds to regard the agent is down; should be at "
                       "least twice report_interval, to be sure the "
                       "agent is down for good.")))
+cfg.CONF.register_opt(
+    cfg.IntOpt('agent_cache_time', default=10,
+               help=_("Seconds to keep in memory the agent records used "
+                      "for port binding; should be well below "
+                      "agent_down_time. 0 disables the cache.")))
+cfg.CONF.register_opt(
+    cfg.IntOpt('heartbeat_flush_interval', default=5,
+               help=_("Seconds to buffer the heartbeats of the agents "
+                      "before writing them in the database, limited to a "
+                      "quarter of agent_down_time. 0 writes every state "
+                      "report immediately.")))
 
 
 class Agent(model_base.BASEV2, models_v2.HasId):
@@ -75,9 +89,129 @@ class Agent(model_base.BASEV2, models_v2.HasId):
         return not AgentDbMixin.is_agent_down(self.heartbeat_timestamp)
 
 
+class AgentCache(object):
+    """The agent records of the hosts, keyed by (agent_type, host).
+
+    The records keep the decoded configurations and the heartbeat
+    timestamp, the liveness being evaluated on every lookup. They are
+    refreshed by the state reports handled by this process and expire
+    after agent_cache_time seconds, so the reports handled by the other
+    server processes are taken into account too.
+    """
+
+    def __init__(self):
+        self._agents = {}
+
+    def __len__(self):
+        return len(self._agents)
+
+    def get(self, agent_type, host):
+        """Return a copy of the cached agent record or None."""
+        key = (agent_type, host)
+        entry = self._agents.get(key)
+        if entry is None:
+            return
+        agent, expires_at = entry
+        if time.time() >= expires_at:
+            self._agents.pop(key, None)
+            return
+        agent = dict(agent)
+        agent['alive'] = not AgentDbMixin.is_agent_down(
+            agent['heartbeat_timestamp'])
+        return agent
+
+    def set(self, agent):
+        cache_time = cfg.CONF.agent_cache_time
+        if cache_time > 0:
+            self._agents[(agent['agent_type'], agent['host'])] = (
+                dict(agent), time.time() + cache_time)
+
+    def invalidate(self, agent_type, host):
+        self._agents.pop((agent_type, host), None)
+
+    def update_heartbeat(self, agent_type, host, timestamp):
+        entry = self._agents.get((agent_type, host))
+        if entry is not None:
+            entry[0]['heartbeat_timestamp'] = timestamp
+
+    def clear(self):
+        self._agents.clear()
+
+
+class HeartbeatBuffer(object):
+    """The heartbeats of the agents waiting to be written in the database.
+
+    Only the heartbeats of the agents whose configurations were written
+    by this process, less than agent_down_time seconds ago, are buffered:
+    the reports of an agent can be handled by several server processes,
+    so its whole record is rewritten periodically.
+    """
+
+    def __init__(self):
+        # (agent_type, host) -> (configurations, time of the write)
+        self._written = {}
+        # (agent_type, host) -> heartbeat timestamp
+        self._heartbeats = {}
+        self.flush_scheduled = False
+
+    def __len__(self):
+        return len(self._heartbeats)
+
+    def written(self, agent_type, host, configurations):
+        """Record the configurations written in the database."""
+        key = (agent_type, host)
+        self._written[key] = (configurations, time.time())
+        self._heartbeats.pop(key, None)
+
+    def add(self, agent_type, host, configurations, timestamp):
+        """Buffer the heartbeat of an agent and return True, or return
+        False if the whole agent record has to be written.
+        """
+        key = (agent_type, host)
+        written = self._written.get(key)
+        if (written is None or written[0] != configurations or
+                time.time() - written[1] >= cfg.CONF.agent_down_time):
+            return False
+        self._heartbeats[key] = timestamp
+        return True
+
+    def get(self, agent_type, host):
+        """Return the buffered heartbeat of an agent or None."""
+        return self._heartbeats.get((agent_type, host))
+
+    def forget(self, agent_type, host):
+        key = (agent_type, host)
+        self._written.pop(key, None)
+        self._heartbeats.pop(key, None)
+
+    def pop_all(self):
+        """Remove the buffered heartbeats and return them as a list of
+        (agent_type, host, timestamp) tuples.
+        """
+        heartbeats, self._heartbeats = self._heartbeats, {}
+        return [key + (timestamp, ) for key, timestamp in heartbeats.items()]
+
+
 class AgentDbMixin(ext_agent.AgentPluginBase):
     """Mixin class to add agent extension to db_base_plugin_v2."""
 
+    @property
+    def agent_cache(self):
+        # NOTE: the plugins don't call the constructors of their mixins
+        try:
+            return self._agent_cache
+        except AttributeError:
+            self._agent_cache = AgentCache()
+            return self._agent_cache
+
+    @property
+    def heartbeat_buffer(self):
+        try:
+            return self._heartbeat_buffer
+        except AttributeError:
+            self._heartbeat_buffer = HeartbeatBuffer()
+            return self._heartbeat_buffer
+
     def _get_agent(self, context, id):
         try:
             agent = self._get_by_id(context, Agent, id)
@@ -123,6 +257,11 @@ class AgentDbMixin(ext_agent.AgentPluginBase):
             ext_agent.RESOURCE_NAME + 's')
         res = dict((k, agent[k]) for k in attr
                    if k not in ['alive', 'configurations'])
+        heartbeat = self.heartbeat_buffer.get(agent['agent_type'],
+                                              agent['host'])
+        if heartbeat is not None and heartbeat > res['heartbeat_timestamp']:
+            # The heartbeat was not written in the database yet
+            res['heartbeat_timestamp'] = heartbeat
         res['alive'] = not AgentDbMixin.is_agent_down(
             res['heartbeat_timestamp'])
         res['configurations'] = self.get_configuration_dict(agent)
@@ -132,12 +271,15 @@ class AgentDbMixin(ext_agent.AgentPluginBase):
         with context.session.begin(subtransactions=True):
             agent = self._get_agent(context, id)
             context.session.delete(agent)
+        self.agent_cache.invalidate(agent.agent_type, agent.host)
+        self.heartbeat_buffer.forget(agent.agent_type, agent.host)
 
     def update_agent(self, context, id, agent):
         agent_data = agent['agent']
         with context.session.begin(subtransactions=True):
             agent = self._get_agent(context, id)
             agent.update(agent_data)
+        self.agent_cache.invalidate(agent.agent_type, agent.host)
         return self._make_agent_dict(agent)
 
     def get_agents_db(self, context, filters=None):
@@ -155,6 +297,23 @@ class AgentDbMixin(ext_agent.AgentPluginBase):
             agents = [agent for agent in agents if agent['alive'] == alive]
         return agents
 
+    def get_host_agents(self, context, agent_type, host):
+        """Return the agents of agent_type on host, as returned by
+        get_agents(), using the agent cache.
+
+        The returned records should be considered read-only.
+        """
+        agent = self.agent_cache.get(agent_type, host)
+        if agent is not None:
+            return [agent]
+        agents = self.get_agents(context,
+                                 filters={'agent_type': [agent_type],
+                                          'host': [host]})
+        # (agent_type, host) is unique
+        if len(agents) == 1:
+            self.agent_cache.set(agents[0])
+        return agents
+
     def _get_agent_by_type_and_host(self, context, agent_type, host):
         query = self._model_query(context, Agent)
         try:
@@ -198,12 +357,72 @@ class AgentDbMixin(ext_agent.AgentPluginBase):
                 greenthread.sleep(0)
                 context.session.add(agent_db)
             greenthread.sleep(0)
+        return agent_db
+
+    @staticmethod
+    def _heartbeat_flush_interval():
+        # The heartbeats have to be written well before the agents are
+        # considered down by the other server processes
+        return min(cfg.CONF.heartbeat_flush_interval,
+                   cfg.CONF.agent_down_time // 4)
+
+    def _buffer_heartbeat(self, agent):
+        """Buffer the heartbeat of an agent whose configurations did not
+        change, instead of writing its whole record.
+        """
+        interval = self._heartbeat_flush_interval()
+        if interval <= 0 or agent.get('start_flag'):
+            return False
+        timestamp = timeutils.utcnow()
+        if not self.heartbeat_buffer.add(agent['agent_type'], agent['host'],
+                                         agent.get('configurations', {}),
+                                         timestamp):
+            return False
+        self.agent_cache.update_heartbeat(agent['agent_type'], agent['host'],
+                                          timestamp)
+        if not self.heartbeat_buffer.flush_scheduled:
+            self.heartbeat_buffer.flush_scheduled = True
+            greenthread.spawn_after(interval, self._flush_heartbeats)
+        return True
+
+    def _flush_heartbeats(self):
+        self.heartbeat_buffer.flush_scheduled = False
+        try:
+            self.flush_heartbeats(ncontext.get_admin_context())
+        except Exception:
+            LOG.exception(_LE("Failed to write the heartbeats of the "
+                              "agents"))
+
+    def flush_heartbeats(self, context):
+        """Write the buffered heartbeats with a single batched UPDATE and
+        return their number.
+        """
+        heartbeats = self.heartbeat_buffer.pop_all()
+        if not heartbeats:
+            return 0
+        table = Agent.__table__
+        update = table.update().where(
+            sa.and_(table.c.agent_type == sa.bindparam('b_agent_type'),
+                    table.c.host == sa.bindparam('b_host'))).values(
+            heartbeat_timestamp=sa.bindparam('b_timestamp'))
+        with context.session.begin(subtransactions=True):
+            context.session.execute(update, [
+                {'b_agent_type': agent_type, 'b_host': host,
+                 'b_timestamp': timestamp}
+                for agent_type, host, timestamp in heartbeats])
+        return len(heartbeats)
 
     def create_or_update_agent(self, context, agent):
-        """Create or update agent according to report."""
+        """Create or update agent according to report.
+
+        The heartbeats of the known agents whose configurations did not
+        change are buffered and written by flush_heartbeats().
+        """
+        if self._buffer_heartbeat(agent):
+            return
 
         try:
-            return self._create_or_update_agent(context, agent)
+            agent_db = self._create_or_update_agent(context, agent)
         except db_exc.DBDuplicateEntry:
             # It might happen that two or more concurrent transactions
             # are trying to insert new rows having the same value of
@@ -217,7 +436,10 @@ class AgentDbMixin(ext_agent.AgentPluginBase):
             # INSERTs will be issued, because
             # _get_agent_by_type_and_host() will return the existing
             # agent entry, which will be updated multiple times
-            return self._create_or_update_agent(context, agent)
+            agent_db = self._create_or_update_agent(context, agent)
+        self.heartbeat_buffer.written(agent['agent_type'], agent['host'],
+                                      agent.get('configurations', {}))
+        self.agent_cache.set(self._make_agent_dict(agent_db))
 
 
 class AgentExtRpcCallback(object):
@@ -13,10 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
 import netaddr
 from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_utils import excutils
+import six
 from sqlalchemy import and_
 from sqlalchemy import event
 from sqlalchemy import orm
@@ -29,6 +32,7 @@ from neutron.common import ipv6_utils
 from neutron.common import utils
 from neutron import context as ctx
 from neutron.db import common_db_mixin
+from neutron.db import ip_allocator
 from neutron.db import models_v2
 from neutron.db import sqlalchemyutils
 from neutron.extensions import l3
@@ -81,6 +85,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                          self.nova_notifier.send_port_status)
             event.listen(models_v2.Port.status, 'set',
                          self.nova_notifier.record_port_status_changed)
+        allocator = ip_allocator.get_allocator()
+        if allocator:
+            allocator.initialize(ctx.get_admin_context())
 
     def _get_network(self, context, id):
         try:
@@ -137,6 +144,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             network_id=network_id,
             ip_address=ip_address,
             subnet_id=subnet_id).delete()
+        allocator = ip_allocator.get_allocator()
+        if allocator:
+            allocator.release_ip(context, subnet_id, ip_address)
 
     @staticmethod
     def _store_ip_allocation(context, ip_address, network_id, subnet_id,
@@ -153,10 +163,18 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             ip_address=ip_address,
             subnet_id=subnet_id
         )
-        context.session.add(allocated)
+        if ip_allocator.get_allocator():
+            # The IP allocator may have reserved the address already
+            context.session.merge(allocated)
+        else:
+            context.session.add(allocated)
 
     @staticmethod
     def _generate_ip(context, subnets):
+        allocator = ip_allocator.get_allocator()
+        if allocator:
+            return allocator.generate_ip(context, subnets)
+
         try:
             return NeutronDbPluginV2._try_generate_ip(context, subnets)
         except n_exc.IpAddressGenerationFailure:
@@ -201,6 +219,62 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                     'subnet_id': subnet['id']}
         raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
 
+    @staticmethod
+    def _generate_ips(context, subnets, count):
+        """Generate count IP addresses from the subnets."""
+        allocator = ip_allocator.get_allocator()
+        if allocator:
+            return [allocator.generate_ip(context, subnets)
+                    for i in range(count)]
+
+        ips = NeutronDbPluginV2._try_generate_ips(context, subnets, count)
+        if len(ips) < count:
+            NeutronDbPluginV2._rebuild_availability_ranges(context, subnets)
+            # The rebuilt ranges don't know the IPs which were just taken,
+            # as they are not stored yet
+            for ip in ips:
+                NeutronDbPluginV2._allocate_specific_ip(
+                    context, ip['subnet_id'], ip['ip_address'])
+            ips.extend(NeutronDbPluginV2._try_generate_ips(
+                context, subnets, count - len(ips)))
+        if len(ips) < count:
+            raise n_exc.IpAddressGenerationFailure(
+                net_id=subnets[0]['network_id'])
+        return ips
+
+    @staticmethod
+    def _try_generate_ips(context, subnets, count):
+        """Generate up to count IP addresses.
+
+        The IP addresses are taken from the start of the availability
+        ranges of the subnets, updating every range once instead of once
+        per IP address.
+        """
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).join(
+                models_v2.IPAllocationPool).with_lockmode('update')
+        ips = []
+        for subnet in subnets:
+            for ip_range in range_qry.filter_by(subnet_id=subnet['id']):
+                first = netaddr.IPAddress(ip_range['first_ip'])
+                last = netaddr.IPAddress(ip_range['last_ip'])
+                taken = min(count - len(ips), int(last) - int(first) + 1)
+                ips.extend({'ip_address': str(first + i),
+                            'subnet_id': subnet['id']}
+                           for i in range(taken))
+                LOG.debug("Allocated IPs %(first_ip)s to %(last_ip)s from "
+                          "%(first_ip)s to %(range_last_ip)s",
+                          {'first_ip': str(first),
+                           'last_ip': str(first + taken - 1),
+                           'range_last_ip': str(last)})
+                if first + taken > last:
+                    context.session.delete(ip_range)
+                else:
+                    ip_range['first_ip'] = str(first + taken)
+                if len(ips) == count:
+                    return ips
+        return ips
+
     @staticmethod
     def _rebuild_availability_ranges(context, subnets):
         """Rebuild availability ranges.
@@ -212,51 +286,48 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         which will result in deleting the IPAvailabilityRange too.
         """
         ip_qry = context.session.query(
-            models_v2.IPAllocation).with_lockmode('update')
+            models_v2.IPAllocation.ip_address).with_lockmode('update')
         # PostgreSQL does not support select...for update with an outer join.
         # No join is needed here.
         pool_qry = context.session.query(
             models_v2.IPAllocationPool).options(
                 orm.noload('available_ranges')).with_lockmode('update')
+        available_ranges = []
         for subnet in sorted(subnets):
             LOG.debug("Rebuilding availability ranges for subnet %s",
                       subnet)
 
-            # Create a set of all currently allocated addresses
-            ip_qry_results = ip_qry.filter_by(subnet_id=subnet['id'])
-            allocations = netaddr.IPSet([netaddr.IPAddress(i['ip_address'])
-                                        for i in ip_qry_results])
+            # Sort the integer values of all currently allocated addresses
+            allocations = ip_allocator.sorted_addresses(
+                ip_address for ip_address, in ip_qry.filter_by(
+                    subnet_id=subnet['id']))
 
             for pool in pool_qry.filter_by(subnet_id=subnet['id']):
-                # Create a set of all addresses in the pool
-                poolset = netaddr.IPSet(netaddr.IPRange(pool['first_ip'],
-                                                        pool['last_ip']))
-
-                # Use set difference to find free addresses in the pool
-                available = poolset - allocations
-
-                # Generator compacts an ip set into contiguous ranges
-                def ipset_to_ranges(ipset):
-                    first, last = None, None
-                    for cidr in ipset.iter_cidrs():
-                        if last and last + 1 != cidr.first:
-                            yield netaddr.IPRange(first, last)
-                            first = None
-                        first, last = first if first else cidr.first, cidr.last
-                    if first:
-                        yield netaddr.IPRange(first, last)
-
-                # Write the ranges to the db
-                for ip_range in ipset_to_ranges(available):
-                    available_range = models_v2.IPAvailabilityRange(
-                        allocation_pool_id=pool['id'],
-                        first_ip=str(netaddr.IPAddress(ip_range.first)),
-                        last_ip=str(netaddr.IPAddress(ip_range.last)))
-                    context.session.add(available_range)
+                version = netaddr.IPAddress(pool['first_ip']).version
+                pool_range = (ip_allocator.ip_to_int(pool['first_ip']),
+                              ip_allocator.ip_to_int(pool['last_ip']))
+                # Merge the pool with the allocations to find free ranges
+                for first, last in ip_allocator.free_ranges([pool_range],
+                                                            allocations):
+                    available_ranges.append({
+                        'allocation_pool_id': pool['id'],
+                        'first_ip': str(netaddr.IPAddress(first, version)),
+                        'last_ip': str(netaddr.IPAddress(last, version))})
+
+        # Write the ranges to the db with a single bulk insert
+        if available_ranges:
+            context.session.execute(
+                models_v2.IPAvailabilityRange.__table__.insert(),
+                available_ranges)
 
     @staticmethod
     def _allocate_specific_ip(context, subnet_id, ip_address):
         """Allocate a specific IP address on the subnet."""
+        allocator = ip_allocator.get_allocator()
+        if allocator:
+            return allocator.allocate_specific_ip(context, subnet_id,
+                                                  ip_address)
+
         ip = int(netaddr.IPAddress(ip_address))
         range_qry = context.session.query(
             models_v2.IPAvailabilityRange).join(
@@ -489,6 +560,22 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             ips = self._allocate_fixed_ips(context, to_add, mac_address)
         return ips, prev_ips
 
+    @staticmethod
+    def _split_subnets(subnets):
+        """Split the subnets into v4, v6 stateful and v6 stateless ones."""
+        v4 = []
+        v6_stateful = []
+        v6_stateless = []
+        for subnet in subnets:
+            if subnet['ip_version'] == 4:
+                v4.append(subnet)
+            else:
+                if ipv6_utils.is_auto_address_subnet(subnet):
+                    v6_stateless.append(subnet)
+                else:
+                    v6_stateful.append(subnet)
+        return v4, v6_stateful, v6_stateless
+
     def _allocate_ips_for_port(self, context, port):
         """Allocate IP addresses for the port.
 
@@ -511,18 +598,7 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         else:
             filter = {'network_id': [p['network_id']]}
             subnets = self.get_subnets(context, filters=filter)
-            # Split into v4 and v6 subnets
-            v4 = []
-            v6_stateful = []
-            v6_stateless = []
-            for subnet in subnets:
-                if subnet['ip_version'] == 4:
-                    v4.append(subnet)
-                else:
-                    if ipv6_utils.is_auto_address_subnet(subnet):
-                        v6_stateless.append(subnet)
-                    else:
-                        v6_stateful.append(subnet)
+            v4, v6_stateful, v6_stateless = self._split_subnets(subnets)
 
             for subnet in v6_stateless:
                 prefix = subnet['cidr']
@@ -544,6 +620,39 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                 'subnet_id': result['subnet_id']})
         return ips
 
+    def _allocate_ips_for_ports(self, context, network_id, ports):
+        """Allocate IP addresses for ports of the network without fixed IPs.
+
+        The IP addresses of all the ports are generated together from
+        every subnet. Returns the list of the IPs of every port.
+        """
+        filter = {'network_id': [network_id]}
+        v4, v6_stateful, v6_stateless = self._split_subnets(
+            self.get_subnets(context, filters=filter))
+        ips = [[] for p in ports]
+
+        ip_qry = context.session.query(models_v2.IPAllocation.ip_address)
+        for subnet in v6_stateless:
+            ip_addresses = [ipv6_utils.get_ipv6_addr_by_EUI64(
+                subnet['cidr'], p['mac_address']).format() for p in ports]
+            in_use = ip_qry.filter(
+                models_v2.IPAllocation.subnet_id == subnet['id'],
+                models_v2.IPAllocation.ip_address.in_(ip_addresses)).first()
+            if in_use:
+                raise n_exc.IpAddressInUse(net_id=network_id,
+                                           ip_address=in_use[0])
+            for port_ips, ip_address in zip(ips, ip_addresses):
+                port_ips.append({'ip_address': ip_address,
+                                 'subnet_id': subnet['id']})
+        for subnets in [v4, v6_stateful]:
+            if subnets:
+                results = NeutronDbPluginV2._generate_ips(context, subnets,
+                                                          len(ports))
+                for port_ips, result in zip(ips, results):
+                    port_ips.append({'ip_address': result['ip_address'],
+                                     'subnet_id': result['subnet_id']})
+        return ips
+
     def _validate_subnet_cidr(self, context, network, new_subnet_cidr):
         """Validate the CIDR for a subnet.
 
@@ -837,6 +946,13 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                 attributes.PORTS, res, port)
         return self._fields(res, fields)
 
+    def _is_overridden(self, name, cls):
+        """Test whether the method of cls is overridden by a subclass or
+        replaced on this instance.
+        """
+        return (getattr(getattr(self, name), '__func__', None) is not
+                six.get_unbound_function(getattr(cls, name)))
+
     def _create_bulk(self, resource, context, request_items):
         objects = []
         collection = "%ss" % resource
@@ -1086,11 +1202,15 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                         nexthop=rt['nexthop'])
                     context.session.add(route)
 
+            # The IP allocator doesn't maintain the availability ranges
+            add_ranges = not ip_allocator.get_allocator()
             for pool in s['allocation_pools']:
                 ip_pool = models_v2.IPAllocationPool(subnet=subnet,
                                                      first_ip=pool['start'],
                                                      last_ip=pool['end'])
                 context.session.add(ip_pool)
+                if not add_ranges:
+                    continue
                 ip_range = models_v2.IPAvailabilityRange(
                     ipallocationpool=ip_pool,
                     first_ip=pool['start'],
@@ -1158,7 +1278,8 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             first_ip=p['start'], last_ip=p['end'],
             subnet_id=id) for p in s['allocation_pools']]
         context.session.add_all(new_pools)
-        NeutronDbPluginV2._rebuild_availability_ranges(context, [s])
+        if not ip_allocator.get_allocator():
+            NeutronDbPluginV2._rebuild_availability_ranges(context, [s])
         #Gather new pools for result:
         result_pools = [{'start': pool['start'],
                          'end': pool['end']}
@@ -1253,6 +1374,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                               "cannot delete", id)
                     raise n_exc.SubnetInUse(subnet_id=id)
 
+            allocator = ip_allocator.get_allocator()
+            if allocator:
+                allocator.release_subnet(context, id)
             context.session.delete(subnet)
 
     def get_subnet(self, context, id, fields=None):
@@ -1282,7 +1406,16 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                 device_owner=device_owner)
 
     def create_port_bulk(self, context, ports):
-        return self._create_bulk('port', context, ports)
+        if self._is_overridden('create_port', NeutronDbPluginV2):
+            # The plugin extends the creation of every port
+            return self._create_bulk('port', context, ports)
+        try:
+            with context.session.begin(subtransactions=True):
+                return self._create_ports_bulk(context, ports['ports'])
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE("An exception occurred while creating "
+                              "the ports:%s"), ports['ports'])
 
     def _create_port_with_mac(self, context, network_id, port_data,
                               mac_address, nested=False):
@@ -1314,6 +1447,62 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                   max_retries)
         raise n_exc.MacAddressGenerationFailure(net_id=network_id)
 
+    @staticmethod
+    def _get_macs_in_use(context, network_id, macs):
+        """Return the MAC addresses already used on the network."""
+        query = context.session.query(models_v2.Port.mac_address)
+        return set(mac for mac, in query.filter(
+            models_v2.Port.network_id == network_id,
+            models_v2.Port.mac_address.in_(macs)))
+
+    def _generate_macs(self, context, network_id, count, excluded=()):
+        """Generate count MAC addresses which are not used on the network.
+
+        Every round of generated MAC addresses is checked with a single
+        query, and only the ones found in use are generated again.
+        """
+        macs = set()
+        max_retries = cfg.CONF.mac_generation_retries
+        for i in range(max_retries):
+            candidates = set(self._generate_mac()
+                             for j in range(count - len(macs)))
+            candidates -= macs | set(excluded)
+            in_use = candidates and self._get_macs_in_use(
+                context, network_id, candidates)
+            macs |= candidates - in_use
+            if len(macs) == count:
+                return list(macs)
+            LOG.debug('Generated macs %(mac_addresses)s exist on '
+                      'network %(network_id)s',
+                      {'mac_addresses': ', '.join(in_use),
+                       'network_id': network_id})
+
+        LOG.error(_LE("Unable to generate mac address after %s attempts"),
+                  max_retries)
+        raise n_exc.MacAddressGenerationFailure(net_id=network_id)
+
+    def _set_macs_for_ports(self, context, network_id, ports):
+        """Check the requested MAC addresses of ports of the network and
+        generate the missing ones.
+        """
+        requested = [p['mac_address'] for p in ports
+                     if p['mac_address'] is not attributes.ATTR_NOT_SPECIFIED]
+        duplicates = [mac for mac, count in
+                      collections.Counter(requested).items() if count > 1]
+        in_use = duplicates or (requested and self._get_macs_in_use(
+            context, network_id, requested))
+        if in_use:
+            raise n_exc.MacAddressInUse(net_id=network_id,
+                                        mac=sorted(in_use)[0])
+
+        missing = [p for p in ports
+                   if p['mac_address'] is attributes.ATTR_NOT_SPECIFIED]
+        if missing:
+            macs = self._generate_macs(context, network_id, len(missing),
+                                       requested)
+            for p, mac in zip(missing, macs):
+                p['mac_address'] = mac
+
     def create_port(self, context, port):
         p = port['port']
         port_id = p.get('id') or uuidutils.generate_uuid()
@@ -1357,6 +1546,95 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
 
         return self._make_port_dict(db_port, process_extensions=False)
 
+    def _create_ports_bulk(self, context, ports):
+        """Create the ports of a bulk request in the current transaction.
+
+        Unlike successive create_port() calls, the MAC addresses are checked
+        with one query per network, the IP addresses are taken by blocks
+        from the availability ranges, and the IP allocations are written
+        with a bulk insert. The ports are added to the session like in
+        create_port(), so that their status changes are notified to nova.
+        The ports with fixed IPs get their IP addresses one by one, like in
+        create_port().
+
+        :returns: the dicts of the ports, without extensions
+        """
+        ports_data = []
+        for port in ports:
+            p = port['port']
+            tenant_id = self._get_tenant_id_for_create(context, p)
+            if p.get('device_owner'):
+                self._enforce_device_owner_not_router_intf_or_device_id(
+                    context, p.get('device_owner'), p.get('device_id'),
+                    tenant_id)
+            ports_data.append(dict(
+                tenant_id=tenant_id,
+                name=p['name'],
+                id=p.get('id') or uuidutils.generate_uuid(),
+                network_id=p['network_id'],
+                mac_address=p['mac_address'],
+                admin_state_up=p['admin_state_up'],
+                status=p.get('status', constants.PORT_STATUS_ACTIVE),
+                device_id=p['device_id'],
+                device_owner=p['device_owner']))
+        network_ports = collections.defaultdict(list)
+        for port_data in ports_data:
+            network_ports[port_data['network_id']].append(port_data)
+
+        with context.session.begin(subtransactions=True):
+            # Ensure that the networks exist and are visible to the tenant.
+            query = self._model_query(context, models_v2.Network).filter(
+                models_v2.Network.id.in_(network_ports)).with_entities(
+                    models_v2.Network.id)
+            networks = set(network_id for network_id, in query)
+            for network_id in network_ports:
+                if network_id not in networks:
+                    raise n_exc.NetworkNotFound(net_id=network_id)
+
+            for network_id, network_ports_data in network_ports.items():
+                self._set_macs_for_ports(context, network_id,
+                                         network_ports_data)
+            for port, port_data in zip(ports, ports_data):
+                port['port']['mac_address'] = port_data['mac_address']
+            context.session.add_all(models_v2.Port(**port_data)
+                                    for port_data in ports_data)
+            # The bulk insert of the IP allocations doesn't flush the ports
+            context.session.flush()
+
+            # The specific IPs are taken out of the availability ranges
+            # before the IPs are generated
+            allocations = []
+            generated = collections.defaultdict(list)
+            for port, port_data in zip(ports, ports_data):
+                if port['port']['fixed_ips'] is attributes.ATTR_NOT_SPECIFIED:
+                    generated[port_data['network_id']].append(port_data)
+                    continue
+                port_data['fixed_ips'] = self._allocate_ips_for_port(
+                    context, port)
+                for ip in port_data['fixed_ips']:
+                    NeutronDbPluginV2._store_ip_allocation(
+                        context, ip['ip_address'], port_data['network_id'],
+                        ip['subnet_id'], port_data['id'])
+            for network_id, network_ports_data in generated.items():
+                ips = self._allocate_ips_for_ports(context, network_id,
+                                                   network_ports_data)
+                for port_data, port_ips in zip(network_ports_data, ips):
+                    port_data['fixed_ips'] = port_ips
+                    allocations.extend(
+                        dict(ip, network_id=network_id,
+                             port_id=port_data['id']) for ip in port_ips)
+
+            if ip_allocator.get_allocator():
+                for allocation in allocations:
+                    NeutronDbPluginV2._store_ip_allocation(context,
+                                                           **allocation)
+            elif allocations:
+                context.session.execute(
+                    models_v2.IPAllocation.__table__.insert(), allocations)
+
+        return [self._make_port_dict(port_data, process_extensions=False)
+                for port_data in ports_data]
+
     def update_port(self, context, id, port):
         p = port['port']
 
@@ -1432,7 +1710,16 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                  enable_eagerloads(False).filter_by(id=id))
         if not context.is_admin:
             query = query.filter_by(tenant_id=context.tenant_id)
-        query.delete()
+        allocator = ip_allocator.get_allocator()
+        if allocator:
+            # The IP allocations are deleted with the port by the database
+            allocations = context.session.query(
+                models_v2.IPAllocation.subnet_id,
+                models_v2.IPAllocation.ip_address).filter_by(
+                    port_id=id).all()
+        if query.delete() and allocator:
+            for subnet_id, ip_address in allocations:
+                allocator.release_ip(context, subnet_id, ip_address)
 
     def get_port(self, context, id, fields=None):
         port = self._get_port(context, id)
@@ -0,0 +1,423 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import abc
+import array
+import binascii
+import bisect
+import random
+import socket
+import struct
+
+import netaddr
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_utils import importutils
+import six
+from sqlalchemy import event
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from neutron.common import exceptions as n_exc
+from neutron.db import models_v2
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+_ALLOCATORS = {}
+
+
+def get_allocator():
+    """Return the configured IP allocator, or None when the IP addresses
+    are generated from the availability ranges of the subnets.
+    """
+    class_path = cfg.CONF.ip_allocator
+    if not class_path:
+        return
+    allocator = _ALLOCATORS.get(class_path)
+    if allocator is None:
+        allocator = _ALLOCATORS[class_path] = importutils.import_object(
+            class_path)
+    return allocator
+
+
+def ip_to_int(ip_address):
+    """Return the integer value of an IP address string.
+
+    This is several times faster than netaddr for the many addresses
+    loaded from the IP allocations.
+    """
+    if ':' in ip_address:
+        return int(binascii.hexlify(
+            socket.inet_pton(socket.AF_INET6, ip_address)), 16)
+    return struct.unpack('!I', socket.inet_pton(socket.AF_INET,
+                                                ip_address))[0]
+
+
+def sorted_addresses(ip_addresses):
+    """Return the sorted integer values of IP address strings.
+
+    IPv4 addresses are returned in a numpy array, or in an array of the
+    array module when numpy is not available. IPv6 addresses are returned
+    in a list, as they don't fit in machine integers.
+    """
+    values = [ip_to_int(ip_address) for ip_address in ip_addresses]
+    if values and max(values) > 0xffffffff:
+        return sorted(values)
+    if numpy is not None:
+        return numpy.sort(numpy.array(values, dtype=numpy.int64))
+    return array.array('L', sorted(values))
+
+
+def _numpy_free_ranges(pools, allocations):
+    ranges = []
+    for first, last in pools:
+        inside = allocations[
+            numpy.searchsorted(allocations, first, side='left'):
+            numpy.searchsorted(allocations, last, side='right')]
+        # Every gap between two allocations, or between an allocation and
+        # the bounds of the pool, is a candidate range
+        firsts = numpy.concatenate(([first], inside + 1))
+        lasts = numpy.concatenate((inside - 1, [last]))
+        free = firsts <= lasts
+        ranges.extend(zip(firsts[free].tolist(), lasts[free].tolist()))
+    return ranges
+
+
+def free_ranges(pools, allocations):
+    """Return the ranges of addresses of the pools which are not allocated,
+    in a single pass over the pools and the allocations.
+
+    :param pools: sorted list of disjoint (first, last) integer ranges
+    :param allocations: sorted sequence of the allocated integer addresses,
+                        as returned by sorted_addresses()
+    :returns: sorted list of (first, last) integer ranges
+    """
+    if numpy is not None and isinstance(allocations, numpy.ndarray):
+        return _numpy_free_ranges(pools, allocations)
+
+    ranges = []
+    index = 0
+    for first, last in pools:
+        while index < len(allocations) and allocations[index] < first:
+            index += 1
+        start = first
+        while index < len(allocations) and allocations[index] <= last:
+            if allocations[index] > start:
+                ranges.append((start, allocations[index] - 1))
+            start = max(start, allocations[index] + 1)
+            index += 1
+        if start <= last:
+            ranges.append((start, last))
+    return ranges
+
+
+class IpRangeSet(object):
+    """A set of integer addresses stored as sorted disjoint ranges."""
+
+    def __init__(self, ranges=()):
+        self._firsts = [first for first, _last in ranges]
+        self._lasts = [last for _first, last in ranges]
+        self.size = sum(last - first + 1 for first, last in ranges)
+
+    def ranges(self):
+        return list(zip(self._firsts, self._lasts))
+
+    def _find(self, ip):
+        """Return the index of the last range starting at or before ip."""
+        return bisect.bisect_right(self._firsts, ip) - 1
+
+    def __contains__(self, ip):
+        index = self._find(ip)
+        return index >= 0 and ip <= self._lasts[index]
+
+    def first_from(self, ip):
+        """Return the first address of the set from ip, wrapping around
+        after the last range, or None if the set is empty.
+        """
+        if not self._firsts:
+            return
+        index = self._find(ip)
+        if index >= 0 and ip <= self._lasts[index]:
+            return ip
+        if index + 1 == len(self._firsts):
+            return self._firsts[0]
+        return self._firsts[index + 1]
+
+    def random(self):
+        """Return the first address of the set from a random point of the
+        span of the set, or None if the set is empty.
+        """
+        if not self._firsts:
+            return
+        return self.first_from(random.randint(self._firsts[0],
+                                              self._lasts[-1]))
+
+    def remove(self, ip):
+        """Remove an address and return False if it was not in the set."""
+        index = self._find(ip)
+        if index < 0 or ip > self._lasts[index]:
+            return False
+        first, last = self._firsts[index], self._lasts[index]
+        if first == last:
+            del self._firsts[index]
+            del self._lasts[index]
+        elif ip == first:
+            self._firsts[index] = ip + 1
+        elif ip == last:
+            self._lasts[index] = ip - 1
+        else:
+            self._lasts[index] = ip - 1
+            self._firsts.insert(index + 1, ip + 1)
+            self._lasts.insert(index + 1, last)
+        self.size -= 1
+        return True
+
+    def add(self, ip):
+        """Add an address and return False if it was already in the set."""
+        index = self._find(ip)
+        if index >= 0 and ip <= self._lasts[index]:
+            return False
+        after_previous = index >= 0 and self._lasts[index] == ip - 1
+        before_next = (index + 1 < len(self._firsts) and
+                       self._firsts[index + 1] == ip + 1)
+        if after_previous and before_next:
+            self._lasts[index] = self._lasts[index + 1]
+            del self._firsts[index + 1]
+            del self._lasts[index + 1]
+        elif after_previous:
+            self._lasts[index] = ip
+        elif before_next:
+            self._firsts[index + 1] = ip
+        else:
+            self._firsts.insert(index + 1, ip)
+            self._lasts.insert(index + 1, ip)
+        self.size += 1
+        return True
+
+
+@six.add_metaclass(abc.ABCMeta)
+class IpAllocator(object):
+    """Generate the IP addresses of the ports, instead of the availability
+    ranges of the subnets.
+    """
+
+    @abc.abstractmethod
+    def generate_ip(self, context, subnets):
+        """Allocate an IP address from one of the subnets.
+
+        The IP allocation may already be added in the session, without
+        port, to reserve the address.
+
+        :returns: a dict with the ip_address and the subnet_id
+        :raises: IpAddressGenerationFailure
+        """
+
+    @abc.abstractmethod
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        """Record the allocation of an IP address requested by the user."""
+
+    def initialize(self, context):
+        """Prepare the database when the plugin starts."""
+
+    def release_ip(self, context, subnet_id, ip_address):
+        """Record the deletion of the IP allocation of an address."""
+
+    def release_subnet(self, context, subnet_id):
+        """Record the deletion of a subnet."""
+
+
+class InMemoryIpAllocator(IpAllocator):
+    """Allocate random free addresses tracked in memory.
+
+    The free addresses of a subnet are loaded from its allocation pools and
+    its IP allocations. Every pick is confirmed by inserting its IP
+    allocation in a savepoint: a concurrent allocation of the same address
+    only causes another address to be tried, instead of serializing all the
+    allocations of the subnet on the lock of its first availability range.
+
+    The picked addresses are put back when the transaction which reserved
+    them is rolled back, and the released addresses are added when the
+    transaction which deleted them is committed. The free addresses of a
+    subnet are dropped when the transaction which deleted it is committed.
+    The database stays the source of truth: the subnet is reloaded when its
+    pools change or its addresses are exhausted, which also recovers the
+    addresses freed by other servers.
+
+    The availability ranges are not maintained while this allocator is
+    used. They are dropped when the plugin starts, so they are rebuilt if
+    this allocator is disabled.
+    """
+
+    # The number of addresses tried on a subnet before giving up
+    MAX_ATTEMPTS = 16
+    # The number of conflicts after which the subnet is reloaded
+    RELOAD_CONFLICTS = 4
+
+    def __init__(self):
+        # subnet_id -> (pools, IpRangeSet of the free addresses)
+        self._subnets = {}
+
+    @staticmethod
+    def _get_pools(context, subnet_id):
+        query = context.session.query(models_v2.IPAllocationPool.id,
+                                      models_v2.IPAllocationPool.first_ip,
+                                      models_v2.IPAllocationPool.last_ip)
+        return sorted(
+            (ip_to_int(first_ip), ip_to_int(last_ip), pool_id)
+            for pool_id, first_ip, last_ip in query.filter_by(
+                subnet_id=subnet_id))
+
+    def _load(self, context, subnet_id, pools):
+        LOG.debug("Loading the free IP addresses of subnet %s", subnet_id)
+        query = context.session.query(models_v2.IPAllocation.ip_address)
+        allocations = sorted_addresses(
+            ip_address for ip_address, in query.filter_by(
+                subnet_id=subnet_id))
+        free = IpRangeSet(free_ranges(
+            [(first, last) for first, last, _pool_id in pools], allocations))
+        self._subnets[subnet_id] = (pools, free)
+        return free
+
+    def _get_free_ips(self, context, subnet_id):
+        pools = self._get_pools(context, subnet_id)
+        entry = self._subnets.get(subnet_id)
+        if entry is None or entry[0] != pools:
+            return self._load(context, subnet_id, pools)
+        return entry[1]
+
+    def initialize(self, context):
+        LOG.debug("Dropping the availability ranges of the subnets")
+        with context.session.begin(subtransactions=True):
+            context.session.query(models_v2.IPAvailabilityRange).delete(
+                synchronize_session=False)
+
+    def _get_pending(self, session):
+        """Return the addresses reserved and released by the transaction of
+        the session, which are applied to the free addresses when it ends.
+        """
+        pending = session.info.get(self)
+        if pending is None:
+            pending = session.info[self] = {'reserved': [], 'released': [],
+                                            'subnets': []}
+            if not session.info.get((self, 'listening')):
+                session.info[(self, 'listening')] = True
+                event.listen(session, 'after_commit', self._after_commit)
+                event.listen(session, 'after_transaction_end',
+                             self._after_transaction_end)
+        return pending
+
+    def _add_free_ip(self, subnet_id, ip):
+        entry = self._subnets.get(subnet_id)
+        if entry is None:
+            return
+        pools, free = entry
+        # The pools may have changed since the address was allocated
+        if any(first <= ip <= last for first, last, _pool_id in pools):
+            free.add(ip)
+
+    def _after_commit(self, session):
+        # Savepoints are only committed into the enclosing transaction
+        if session.transaction.nested:
+            return
+        pending = session.info.pop(self, None)
+        if pending:
+            for subnet_id, ip in pending['released']:
+                self._add_free_ip(subnet_id, ip)
+            for subnet_id in pending['subnets']:
+                self._subnets.pop(subnet_id, None)
+
+    def _after_transaction_end(self, session, transaction):
+        if session.transaction is not None:
+            return
+        # The reservations of a committed transaction were popped on commit
+        pending = session.info.pop(self, None)
+        if pending:
+            for subnet_id, ip in pending['reserved']:
+                self._add_free_ip(subnet_id, ip)
+
+    @staticmethod
+    def _reserve(context, subnet, ip_address):
+        """Insert the IP allocation, without port, and return False if the
+        address is already allocated.
+        """
+        try:
+            with context.session.begin(subtransactions=True, nested=True):
+                context.session.add(models_v2.IPAllocation(
+                    network_id=subnet['network_id'],
+                    subnet_id=subnet['id'],
+                    ip_address=ip_address))
+        except db_exc.DBDuplicateEntry:
+            return False
+        return True
+
+    def _allocate(self, context, subnet):
+        free = self._get_free_ips(context, subnet['id'])
+        reloaded = False
+        conflicts = 0
+        for attempt in range(self.MAX_ATTEMPTS):
+            ip = free.random()
+            if ip is None or (conflicts == self.RELOAD_CONFLICTS and
+                              not reloaded):
+                if reloaded:
+                    return
+                free = self._load(context, subnet['id'],
+                                  self._subnets[subnet['id']][0])
+                reloaded = True
+                continue
+            if not free.remove(ip):
+                # Picked concurrently by another thread of this process
+                continue
+            ip_address = str(netaddr.IPAddress(ip))
+            if self._reserve(context, subnet, ip_address):
+                self._get_pending(context.session)['reserved'].append(
+                    (subnet['id'], ip))
+                return ip_address
+            conflicts += 1
+            LOG.debug("IP %(ip_address)s of subnet %(subnet_id)s was "
+                      "allocated concurrently",
+                      {'ip_address': ip_address, 'subnet_id': subnet['id']})
+
+    def generate_ip(self, context, subnets):
+        for subnet in subnets:
+            ip_address = self._allocate(context, subnet)
+            if ip_address:
+                LOG.debug("Allocated IP - %(ip_address)s from subnet "
+                          "%(subnet_id)s",
+                          {'ip_address': ip_address,
+                           'subnet_id': subnet['id']})
+                return {'ip_address': ip_address, 'subnet_id': subnet['id']}
+            LOG.debug("All IPs from subnet %(subnet_id)s (%(cidr)s) "
+                      "allocated",
+                      {'subnet_id': subnet['id'], 'cidr': subnet['cidr']})
+        raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        entry = self._subnets.get(subnet_id)
+        if entry is not None:
+            ip = int(netaddr.IPAddress(ip_address))
+            if entry[1].remove(ip):
+                self._get_pending(context.session)['reserved'].append(
+                    (subnet_id, ip))
+
+    def release_ip(self, context, subnet_id, ip_address):
+        self._get_pending(context.session)['released'].append(
+            (subnet_id, int(netaddr.IPAddress(ip_address))))
+
+    def release_subnet(self, context, subnet_id):
+        self._get_pending(context.session)['subnets'].append(subnet_id)
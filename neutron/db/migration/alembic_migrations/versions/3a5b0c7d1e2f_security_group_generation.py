@@ -0,0 +1,39 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""security group generation
+
+Revision ID: 3a5b0c7d1e2f
+Revises: 2d2a8a565438
+Create Date: 2015-03-20 10:12:43.518309
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a5b0c7d1e2f'
+down_revision = '2d2a8a565438'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('securitygroups',
+                  sa.Column('generation', sa.Integer(), nullable=False,
+                            server_default='0'))
+
+
+def downgrade():
+    op.drop_column('securitygroups', 'generation')
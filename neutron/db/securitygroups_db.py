@@ -41,6 +41,9 @@ class SecurityGroup(model_base.BASEV2, models_v2.HasId, models_v2.HasTenant):
 
     name = sa.Column(sa.String(255))
     description = sa.Column(sa.String(255))
+    # Incremented whenever the rules or the members of the group change, to
+    # invalidate the copies cached by the server processes
+    generation = sa.Column(sa.Integer, nullable=False, server_default='0')
 
 
 class DefaultSecurityGroup(model_base.BASEV2):
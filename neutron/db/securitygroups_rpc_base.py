@@ -13,7 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import itertools
+import operator
+import time
+
 import netaddr
+from oslo_config import cfg
 from sqlalchemy.orm import exc
 
 from neutron.common import constants as q_const
@@ -22,18 +27,86 @@ from neutron.common import utils
 from neutron.db import allowedaddresspairs_db as addr_pair
 from neutron.db import models_v2
 from neutron.db import securitygroups_db as sg_db
+from neutron.extensions import allowedaddresspairs as ext_addr_pair
 from neutron.extensions import securitygroup as ext_sg
 from neutron.i18n import _LW
 from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+cfg.CONF.register_opt(
+    cfg.IntOpt('security_group_cache_time', default=60,
+               help=_("Seconds to keep in memory the rules and the member "
+                      "IPs of the security groups served to the agents. "
+                      "0 disables the cache.")))
 
 DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
                        'egress': 'dest_ip_prefix'}
 
 DHCP_RULE_PORT = {4: (67, 68, q_const.IPv4), 6: (547, 546, q_const.IPv6)}
 
+# The positions of the loaded rules, to return the cached rules in the order
+# in which they were selected from the database
+_RULE_POSITIONS = itertools.count()
+
+
+class SecurityGroupCache(object):
+    """The rules and the member IPs of the security groups.
+
+    Every entry records the generation of its security group when it was
+    loaded and is only used while the generation in the database is the
+    same: the generations are incremented by the changes of the rules and
+    of the members, so the changes handled by the other server processes
+    are taken into account too. The entries also expire after
+    security_group_cache_time seconds, for the changes made without the
+    notifications of the members.
+    """
+
+    RULES = 'rules'
+    MEMBER_IPS = 'member_ips'
+
+    def __init__(self):
+        # (kind, security_group_id) -> (value, generation, expiration time)
+        self._entries = {}
+        self._prune_at = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, security_group_id, generation):
+        """Return the cached value or None."""
+        key = (kind, security_group_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        value, cached_generation, expires_at = entry
+        if cached_generation != generation or time.time() >= expires_at:
+            self._entries.pop(key, None)
+            return
+        return value
+
+    def set(self, kind, security_group_id, generation, value):
+        cache_time = cfg.CONF.security_group_cache_time
+        if cache_time <= 0 or generation is None:
+            return
+        now = time.time()
+        if now >= self._prune_at:
+            # Drop the entries of the groups which are no longer requested
+            for key, entry in list(self._entries.items()):
+                if now >= entry[2]:
+                    del self._entries[key]
+            self._prune_at = now + cache_time
+        self._entries[(kind, security_group_id)] = (value, generation,
+                                                    now + cache_time)
+
+    def invalidate(self, security_group_ids):
+        for security_group_id in security_group_ids:
+            self._entries.pop((self.RULES, security_group_id), None)
+            self._entries.pop((self.MEMBER_IPS, security_group_id), None)
+
+    def clear(self):
+        self._entries.clear()
+
 
 class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
     """Mixin class to add agent-based security group implementation."""
@@ -67,11 +140,77 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         """
         return [self.get_port_from_device(device) for device in devices]
 
+    @property
+    def security_group_cache(self):
+        # NOTE: the plugins don't call the constructors of their mixins
+        try:
+            return self._security_group_cache
+        except AttributeError:
+            self._security_group_cache = SecurityGroupCache()
+            return self._security_group_cache
+
+    def _get_security_group_generations(self, context, sg_ids):
+        """Return the generations of the security groups, None for the
+        groups which don't exist.
+        """
+        generations = dict.fromkeys(sg_ids)
+        if sg_ids:
+            query = context.session.query(sg_db.SecurityGroup.id,
+                                          sg_db.SecurityGroup.generation)
+            query = query.filter(sg_db.SecurityGroup.id.in_(sg_ids))
+            for sg_id, generation in query:
+                generations[sg_id] = generation
+        return generations
+
+    def _bump_security_group_generations(self, context, sg_ids):
+        """Invalidate the rules and the member IPs of the security groups
+        cached by all the server processes.
+
+        It must be called in the transaction which changes the security
+        groups or after it is committed, and never before.
+        """
+        sg_ids = set(sg_ids)
+        if not sg_ids:
+            return
+        self.security_group_cache.invalidate(sg_ids)
+        generation = sg_db.SecurityGroup.generation
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(sg_db.SecurityGroup)
+            query.filter(sg_db.SecurityGroup.id.in_(sg_ids)).update(
+                {generation: generation + 1}, synchronize_session=False)
+
+    def _get_cached_security_group_items(self, context, kind, sg_ids, load):
+        """Return a dict of the rules or the member IPs of the security
+        groups, the missing ones being selected with load(context, sg_ids).
+        """
+        sg_ids = list(set(sg_ids))
+        if not sg_ids or cfg.CONF.security_group_cache_time <= 0:
+            return load(context, sg_ids)
+        cache = self.security_group_cache
+        # The generations are read before the items, so the items loaded
+        # concurrently with a change are cached with the older generation
+        generations = self._get_security_group_generations(context, sg_ids)
+        items = {}
+        missing = []
+        for sg_id in sg_ids:
+            value = cache.get(kind, sg_id, generations[sg_id])
+            if value is None:
+                missing.append(sg_id)
+            else:
+                items[sg_id] = value
+        if missing:
+            loaded = load(context, missing)
+            for sg_id in missing:
+                cache.set(kind, sg_id, generations[sg_id], loaded[sg_id])
+            items.update(loaded)
+        return items
+
     def create_security_group_rule(self, context, security_group_rule):
         bulk_rule = {'security_group_rules': [security_group_rule]}
         rule = self.create_security_group_rule_bulk_native(context,
                                                            bulk_rule)[0]
         sgids = [rule['security_group_id']]
+        self._bump_security_group_generations(context, sgids)
         self.notifier.security_groups_rule_updated(context, sgids)
         return rule
 
@@ -81,6 +220,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                       self).create_security_group_rule_bulk_native(
                           context, security_group_rule)
         sgids = set([r['security_group_id'] for r in rules])
+        self._bump_security_group_generations(context, sgids)
         self.notifier.security_groups_rule_updated(context, list(sgids))
         return rules
 
@@ -88,6 +228,8 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         rule = self.get_security_group_rule(context, sgrid)
         super(SecurityGroupServerRpcMixin,
               self).delete_security_group_rule(context, sgrid)
+        self._bump_security_group_generations(context,
+                                              [rule['security_group_id']])
         self.notifier.security_groups_rule_updated(context,
                                                    [rule['security_group_id']])
 
@@ -108,6 +250,13 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
             # delete the port binding and read it with the new rules
             port_updates[ext_sg.SECURITYGROUPS] = (
                 self._get_security_groups_on_port(context, port))
+            # The generations are incremented by
+            # is_security_group_member_updated(), once the change is
+            # committed: the bindings lock the security groups in this
+            # transaction
+            self.security_group_cache.invalidate(
+                set(original_port.get(ext_sg.SECURITYGROUPS) or []) |
+                set(port_updates[ext_sg.SECURITYGROUPS] or []))
             self._delete_port_security_group_bindings(context, id)
             self._process_port_create_security_group(
                 context,
@@ -128,12 +277,21 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         It is because another changes for the port may require notification.
         """
         need_notify = False
+        security_groups_updated = not utils.compare_elements(
+            original_port.get(ext_sg.SECURITYGROUPS),
+            updated_port.get(ext_sg.SECURITYGROUPS))
         if (original_port['fixed_ips'] != updated_port['fixed_ips'] or
             original_port['mac_address'] != updated_port['mac_address'] or
-            not utils.compare_elements(
-                original_port.get(ext_sg.SECURITYGROUPS),
-                updated_port.get(ext_sg.SECURITYGROUPS))):
+            security_groups_updated):
             need_notify = True
+        if (original_port['fixed_ips'] != updated_port['fixed_ips'] or
+            original_port.get(ext_addr_pair.ADDRESS_PAIRS) !=
+            updated_port.get(ext_addr_pair.ADDRESS_PAIRS) or
+            security_groups_updated):
+            self._bump_security_group_generations(
+                context,
+                set(original_port.get(ext_sg.SECURITYGROUPS) or []) |
+                set(updated_port.get(ext_sg.SECURITYGROUPS) or []))
         return need_notify
 
     def notify_security_groups_member_updated_bulk(self, context, ports):
@@ -164,6 +322,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         if security_groups_provider_updated:
             self.notifier.security_groups_provider_updated(context)
         if sec_groups:
+            self._bump_security_group_generations(context, sec_groups)
             self.notifier.security_groups_member_updated(
                 context, list(sec_groups))
 
@@ -176,25 +335,26 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                    'sg_member_ips': {}}
         rules_in_db = self._select_rules_for_ports(context, ports)
         remote_security_group_info = {}
+        # The lists of the payload are deduplicated with hashed sets of
+        # their items, as the big security groups have many rules and the
+        # rules are repeated for every port
+        source_groups = {}
+        security_group_rules = {}
         for (port_id, rule_in_db) in rules_in_db:
             remote_gid = rule_in_db.get('remote_group_id')
             security_group_id = rule_in_db.get('security_group_id')
             ethertype = rule_in_db['ethertype']
-            if ('security_group_source_groups'
-                not in sg_info['devices'][port_id]):
-                sg_info['devices'][port_id][
-                    'security_group_source_groups'] = []
+            device = sg_info['devices'][port_id]
+            if port_id not in source_groups:
+                source_groups[port_id] = set(device.setdefault(
+                    'security_group_source_groups', []))
 
             if remote_gid:
-                if (remote_gid
-                    not in sg_info['devices'][port_id][
-                        'security_group_source_groups']):
-                    sg_info['devices'][port_id][
-                        'security_group_source_groups'].append(remote_gid)
-                if remote_gid not in remote_security_group_info:
-                    remote_security_group_info[remote_gid] = {}
-                if ethertype not in remote_security_group_info[remote_gid]:
-                    remote_security_group_info[remote_gid][ethertype] = []
+                if remote_gid not in source_groups[port_id]:
+                    source_groups[port_id].add(remote_gid)
+                    device['security_group_source_groups'].append(remote_gid)
+                remote_security_group_info.setdefault(
+                    remote_gid, {}).setdefault(ethertype, [])
 
             direction = rule_in_db['direction']
             rule_dict = {
@@ -209,9 +369,12 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                         rule_dict[direction_ip_prefix] = rule_in_db[key]
                         continue
                     rule_dict[key] = rule_in_db[key]
-            if security_group_id not in sg_info['security_groups']:
+            if security_group_id not in security_group_rules:
+                security_group_rules[security_group_id] = set()
                 sg_info['security_groups'][security_group_id] = []
-            if rule_dict not in sg_info['security_groups'][security_group_id]:
+            rule_key = tuple(sorted(rule_dict.items()))
+            if rule_key not in security_group_rules[security_group_id]:
+                security_group_rules[security_group_id].add(rule_key)
                 sg_info['security_groups'][security_group_id].append(
                     rule_dict)
 
@@ -226,29 +389,56 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         ips = self._select_ips_for_remote_group(
             context, sg_info['sg_member_ips'].keys())
         for sg_id, member_ips in ips.items():
+            member_ips_by_ethertype = sg_info['sg_member_ips'][sg_id]
+            # The member IPs are already unique, and only IPv6 addresses
+            # and prefixes contain colons
             for ip in member_ips:
-                ethertype = 'IPv%d' % netaddr.IPNetwork(ip).version
-                if (ethertype in sg_info['sg_member_ips'][sg_id]
-                    and ip not in sg_info['sg_member_ips'][sg_id][ethertype]):
-                    sg_info['sg_member_ips'][sg_id][ethertype].append(ip)
+                ethertype = q_const.IPv6 if ':' in ip else q_const.IPv4
+                if ethertype in member_ips_by_ethertype:
+                    member_ips_by_ethertype[ethertype].append(ip)
         return sg_info
 
     def _select_rules_for_ports(self, context, ports):
+        """Return the (port_id, rule dict) pairs of the rules of the
+        security groups of the ports.
+        """
         if not ports:
             return []
         sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
         sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
 
+        query = context.session.query(sg_binding_port, sg_binding_sgid)
+        bindings = query.filter(sg_binding_port.in_(ports.keys())).all()
+        rules = self._get_cached_security_group_items(
+            context, SecurityGroupCache.RULES,
+            [sg_id for _port_id, sg_id in bindings],
+            self._select_rules_for_security_groups)
+        rules_for_ports = [(position, port_id, rule)
+                           for port_id, sg_id in bindings
+                           for position, rule in rules[sg_id]]
+        rules_for_ports.sort(key=operator.itemgetter(0))
+        return [(port_id, rule)
+                for _position, port_id, rule in rules_for_ports]
+
+    def _select_rules_for_security_groups(self, context, sg_ids):
+        rules_by_group = dict((sg_id, []) for sg_id in sg_ids)
+        if not sg_ids:
+            return rules_by_group
         sgr_sgid = sg_db.SecurityGroupRule.security_group_id
-
-        query = context.session.query(sg_binding_port,
-                                      sg_db.SecurityGroupRule)
-        query = query.join(sg_db.SecurityGroupRule,
-                           sgr_sgid == sg_binding_sgid)
-        query = query.filter(sg_binding_port.in_(ports.keys()))
-        return query.all()
+        query = context.session.query(sg_db.SecurityGroupRule)
+        for rule in query.filter(sgr_sgid.in_(sg_ids)):
+            rules_by_group[rule['security_group_id']].append(
+                (next(_RULE_POSITIONS),
+                 self._make_security_group_rule_dict(rule)))
+        return dict((sg_id, tuple(rules))
+                    for sg_id, rules in rules_by_group.items())
 
     def _select_ips_for_remote_group(self, context, remote_group_ids):
+        return self._get_cached_security_group_items(
+            context, SecurityGroupCache.MEMBER_IPS, remote_group_ids,
+            self._select_ips_for_security_groups)
+
+    def _select_ips_for_security_groups(self, context, remote_group_ids):
         ips_by_group = {}
         if not remote_group_ids:
             return ips_by_group
@@ -279,7 +469,8 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
             ips_by_group[security_group_id].add(ip_address)
             if allowed_addr_ip:
                 ips_by_group[security_group_id].add(allowed_addr_ip)
-        return ips_by_group
+        return dict((sg_id, frozenset(ips))
+                    for sg_id, ips in ips_by_group.items())
 
     def _select_remote_group_ids(self, ports):
         remote_group_ids = []
@@ -77,6 +77,26 @@ def get_network_segments(session, network_id, filter_dynamic=False):
         return [_make_segment_dict(record) for record in records]
 
 
+def get_networks_segments(session, network_ids, filter_dynamic=False):
+    """Get the segments of multiple networks with a single query.
+
+    Returns a dictionary which maps each network id to its segments.
+    """
+    segments = dict((network_id, []) for network_id in network_ids)
+    if not network_ids:
+        return segments
+    with session.begin(subtransactions=True):
+        query = (session.query(models.NetworkSegment).
+                 filter(models.NetworkSegment.network_id.in_(network_ids)).
+                 order_by(models.NetworkSegment.segment_index))
+        if filter_dynamic is not None:
+            query = query.filter_by(is_dynamic=filter_dynamic)
+        for record in query:
+            segments[record.network_id].append(_make_segment_dict(record))
+
+        return segments
+
+
 def get_segment_by_id(session, segment_id):
     with session.begin(subtransactions=True):
         try:
@@ -129,6 +149,18 @@ def add_port_binding(session, port_id):
         return record
 
 
+def add_port_bindings(session, port_ids):
+    """Add the bindings of ports created together, which are flushed as a
+    single multi-row insert.
+    """
+    with session.begin(subtransactions=True):
+        records = [models.PortBinding(
+            port_id=port_id,
+            vif_type=portbindings.VIF_TYPE_UNBOUND) for port_id in port_ids]
+        session.add_all(records)
+        return records
+
+
 def get_locked_port_and_binding(session, port_id):
     """Get port and port binding records for update within transaction."""
 
@@ -179,6 +211,27 @@ def get_binding_levels(session, port_id, host):
         return result
 
 
+def get_ports_binding_levels(session, port_hosts):
+    """Get the binding levels of multiple ports with a single query.
+
+    The port_hosts dictionary maps each port id to the host whose
+    binding levels are requested. Returns a dictionary which maps each
+    port id to its binding levels.
+    """
+    levels = dict((port_id, []) for port_id in port_hosts)
+    port_ids = [port_id for port_id, host in port_hosts.items() if host]
+    if not port_ids:
+        return levels
+    with session.begin(subtransactions=True):
+        query = (session.query(models.PortBindingLevel).
+                 filter(models.PortBindingLevel.port_id.in_(port_ids)).
+                 order_by(models.PortBindingLevel.level))
+        for record in query:
+            if record.host == port_hosts[record.port_id]:
+                levels[record.port_id].append(record)
+    return levels
+
+
 def clear_binding_levels(session, port_id, host):
     if host:
         (session.query(models.PortBindingLevel).
@@ -245,6 +298,52 @@ def get_port(session, port_id):
             return
 
 
+def get_ports(session, port_ids):
+    """Get the port records matching multiple (partial) port ids.
+
+    Returns a dictionary which maps each received id to its port record.
+    The ids which match no port, or more than one, are left out.
+    """
+    # break large queries into smaller parts
+    if len(port_ids) > MAX_PORTS_PER_QUERY:
+        LOG.debug("Number of ports %(pcount)s exceeds the maximum per "
+                  "query %(maxp)s. Partitioning queries.",
+                  {'pcount': len(port_ids), 'maxp': MAX_PORTS_PER_QUERY})
+        ports = get_ports(session, port_ids[:MAX_PORTS_PER_QUERY])
+        ports.update(get_ports(session, port_ids[MAX_PORTS_PER_QUERY:]))
+        return ports
+
+    if not port_ids:
+        return {}
+
+    # partial UUIDs must be individually matched with startswith.
+    # full UUIDs may be matched directly in an IN statement
+    partial_uuids = set(port_id for port_id in port_ids
+                        if not uuidutils.is_uuid_like(port_id))
+    full_uuids = set(port_ids) - partial_uuids
+    or_criteria = [models_v2.Port.id.startswith(port_id)
+                   for port_id in partial_uuids]
+    if full_uuids:
+        or_criteria.append(models_v2.Port.id.in_(full_uuids))
+
+    with session.begin(subtransactions=True):
+        records = session.query(models_v2.Port).filter(or_(*or_criteria))
+        records = records.all()
+
+    records_by_id = dict((record.id, record) for record in records)
+    ports = dict((port_id, records_by_id[port_id])
+                 for port_id in full_uuids if port_id in records_by_id)
+    for port_id in partial_uuids:
+        matches = [record for record in records
+                   if record.id.startswith(port_id)]
+        if len(matches) == 1:
+            ports[port_id] = matches[0]
+        elif matches:
+            LOG.error(_LE("Multiple ports have port_id starting with %s"),
+                      port_id)
+    return ports
+
+
 def get_port_from_device_mac(device_mac):
     LOG.debug("get_port_from_device_mac() called for mac %s", device_mac)
     session = db_api.get_session()
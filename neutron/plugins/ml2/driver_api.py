@@ -700,6 +700,35 @@ class MechanismDriver(object):
         """
         pass
 
+    def create_ports_precommit(self, contexts):
+        """Allocate resources for new ports created by a bulk request.
+
+        :param contexts: list of PortContext instances describing the
+        ports.
+
+        Called inside transaction context on session instead of
+        create_port_precommit, so that drivers can process all the
+        ports at once. Call cannot block. Raising an exception will
+        result in a rollback of the current transaction. The default
+        implementation calls create_port_precommit for every port.
+        """
+        for context in contexts:
+            self.create_port_precommit(context)
+
+    def create_ports_postcommit(self, contexts):
+        """Create ports created by a bulk request.
+
+        :param contexts: list of PortContext instances describing the
+        ports.
+
+        Called after the transaction completes instead of
+        create_port_postcommit. Raising an exception will result in the
+        deletion of all the ports. The default implementation calls
+        create_port_postcommit for every port.
+        """
+        for context in contexts:
+            self.create_port_postcommit(context)
+
     def update_port_precommit(self, context):
         """Update resources of a port.
 
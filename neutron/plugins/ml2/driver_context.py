@@ -93,6 +93,8 @@ class PortContext(MechanismDriverContext, api.PortContext):
         else:
             self._original_binding_levels = None
         self._new_port_status = None
+        # Segments already loaded by the plugin, keyed by id
+        self._segments = {}
 
     # The following methods are for use by the ML2 plugin and are not
     # part of the driver API.
@@ -178,6 +180,8 @@ class PortContext(MechanismDriverContext, api.PortContext):
                 self._original_binding_levels[-1].segment_id)
 
     def _expand_segment(self, segment_id):
+        if segment_id in self._segments:
+            return self._segments[segment_id]
         segment = db.get_segment_by_id(self._plugin_context.session,
                                        segment_id)
         if not segment:
@@ -202,9 +206,8 @@ class PortContext(MechanismDriverContext, api.PortContext):
         return self._segments_to_bind
 
     def host_agents(self, agent_type):
-        return self._plugin.get_agents(self._plugin_context,
-                                       filters={'agent_type': [agent_type],
-                                                'host': [self._binding.host]})
+        return self._plugin.get_host_agents(self._plugin_context,
+                                            agent_type, self._binding.host)
 
     def set_binding(self, segment_id, vif_type, vif_details,
                     status=None):
@@ -12,12 +12,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import re
-
 from neutron.common import constants
 from neutron.extensions import portbindings
 from neutron.plugins.common import constants as p_constants
 from neutron.plugins.ml2.drivers import mech_agent
+from neutron.plugins.virtualbox.common import utils as vbox_utils
 
 
 class VBoxMechanismDriver(mech_agent.SimpleAgentMechanismDriverBase):
@@ -29,11 +28,15 @@ class VBoxMechanismDriver(mech_agent.SimpleAgentMechanismDriverBase):
     connectivity to at least one segment of the port's network.
     """
 
+    MAPPINGS_CACHE_SIZE = 64
+
     def __init__(self):
         super(VBoxMechanismDriver, self).__init__(
             constants.AGENT_TYPE_VBOX,
             portbindings.VIF_TYPE_BRIDGE,
             {portbindings.CAP_PORT_FILTER: False})
+        # The compiled mappings reported by the agents
+        self._mappings = vbox_utils.LRUCache(self.MAPPINGS_CACHE_SIZE)
 
     def get_allowed_network_types(self, agent=None):
         return [p_constants.TYPE_LOCAL, p_constants.TYPE_FLAT]
@@ -42,4 +45,11 @@ class VBoxMechanismDriver(mech_agent.SimpleAgentMechanismDriverBase):
         return agent['configurations'].get('network_mappings', {})
 
     def physnet_in_mappings(self, physnet, mappings):
-        return any(re.match(pattern, physnet) for pattern in mappings)
+        # Any matching pattern is enough, so the order of the patterns
+        # reported by the agent is not relevant.
+        key = tuple(sorted(mappings.items()))
+        compiled_mappings = self._mappings.get(key)
+        if compiled_mappings is None:
+            compiled_mappings = vbox_utils.PhysicalNetworkMappings(key)
+            self._mappings.set(key, compiled_mappings)
+        return physnet in compiled_mappings
@@ -138,10 +138,19 @@ class TypeManager(stevedore.named.NamedExtensionManager):
         return value
 
     def extend_network_dict_provider(self, context, network):
-        id = network['id']
-        segments = db.get_network_segments(context.session, id)
+        segments = db.get_network_segments(context.session, network['id'])
+        self._extend_network_dict_provider(network, segments)
+
+    def extend_networks_dict_provider(self, context, networks):
+        segments = db.get_networks_segments(
+            context.session, [network['id'] for network in networks])
+        for network in networks:
+            self._extend_network_dict_provider(network,
+                                               segments[network['id']])
+
+    def _extend_network_dict_provider(self, network, segments):
         if not segments:
-            LOG.error(_LE("Network %s has no segments"), id)
+            LOG.error(_LE("Network %s has no segments"), network['id'])
             for attr in provider.ATTRIBUTES:
                 network[attr] = None
         elif len(segments) > 1:
@@ -512,6 +521,34 @@ class MechanismManager(stevedore.named.NamedExtensionManager):
         """
         self._call_on_drivers("create_port_postcommit", context)
 
+    def create_ports_precommit(self, contexts):
+        """Notify all mechanism drivers during bulk port creation.
+
+        :raises: neutron.plugins.ml2.common.MechanismDriverError
+        if any mechanism driver create_ports_precommit call fails.
+
+        Called within the database transaction with the contexts of all
+        the ports. If a mechanism driver raises an exception, then a
+        MechanismDriverError is propogated to the caller, triggering a
+        rollback of all the ports. There is no guarantee that all
+        mechanism drivers are called in this case.
+        """
+        self._call_on_drivers("create_ports_precommit", contexts)
+
+    def create_ports_postcommit(self, contexts):
+        """Notify all mechanism drivers of bulk port creation.
+
+        :raises: neutron.plugins.ml2.common.MechanismDriverError
+        if any mechanism driver create_ports_postcommit call fails.
+
+        Called after the database transaction with the contexts of all
+        the ports. Errors raised by mechanism drivers are left to
+        propagate to the caller, where all the ports will be deleted,
+        triggering any required cleanup. There is no guarantee that all
+        mechanism drivers are called in this case.
+        """
+        self._call_on_drivers("create_ports_postcommit", contexts)
+
     def update_port_precommit(self, context):
         """Notify all mechanism drivers during port update.
 
@@ -46,6 +46,7 @@ from neutron.db import db_base_plugin_v2
 from neutron.db import dvr_mac_db
 from neutron.db import external_net_db
 from neutron.db import extradhcpopt_db
+from neutron.db import ip_allocator
 from neutron.db import models_v2
 from neutron.db import quota_db  # noqa
 from neutron.db import securitygroups_rpc_base as sg_db_rpc
@@ -660,8 +661,7 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
             nets = super(Ml2Plugin,
                          self).get_networks(context, filters, None, sorts,
                                             limit, marker, page_reverse)
-            for net in nets:
-                self.type_manager.extend_network_dict_provider(context, net)
+            self.type_manager.extend_networks_dict_provider(context, nets)
 
             nets = self._filter_nets_provider(context, nets, filters)
             nets = self._filter_nets_l3(context, nets, filters)
@@ -877,6 +877,9 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
                         mech_context)
 
                     LOG.debug("Deleting subnet record")
+                    allocator = ip_allocator.get_allocator()
+                    if allocator:
+                        allocator.release_subnet(context, id)
                     session.delete(record)
 
                     LOG.debug("Committing transaction")
@@ -934,6 +937,79 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
 
         return result, mech_context
 
+    def _create_ports_db(self, context, ports):
+        """Create the ports of a bulk request with the batch operations of
+        the DB plugin, calling the mechanism drivers once for all the
+        ports.
+        """
+        session = context.session
+        with session.begin(subtransactions=True):
+            sgids = []
+            dhcp_opts = []
+            for port in ports:
+                port[attributes.PORT]['status'] = const.PORT_STATUS_DOWN
+                self._ensure_default_security_group_on_port(context, port)
+                sgids.append(self._get_security_groups_on_port(context,
+                                                               port))
+                dhcp_opts.append(port['port'].get(edo_ext.EXTRADHCPOPTS, []))
+            results = self._create_ports_bulk(context, ports)
+            bindings = db.add_port_bindings(
+                session, [result['id'] for result in results])
+
+            networks = {}
+            mech_contexts = []
+            for port, result, binding, port_sgids, port_dhcp_opts in zip(
+                    ports, results, bindings, sgids, dhcp_opts):
+                attrs = port[attributes.PORT]
+                self.extension_manager.process_create_port(context, attrs,
+                                                           result)
+                self._process_port_create_security_group(context, result,
+                                                         port_sgids)
+                network_id = result['network_id']
+                if network_id not in networks:
+                    networks[network_id] = self.get_network(context,
+                                                            network_id)
+                mech_context = driver_context.PortContext(
+                    self, context, result, networks[network_id], binding,
+                    None)
+                self._process_port_binding(mech_context, attrs)
+
+                result[addr_pair.ADDRESS_PAIRS] = (
+                    self._process_create_allowed_address_pairs(
+                        context, result,
+                        attrs.get(addr_pair.ADDRESS_PAIRS)))
+                self._process_port_create_extra_dhcp_opts(context, result,
+                                                          port_dhcp_opts)
+                mech_contexts.append(mech_context)
+            self.mechanism_manager.create_ports_precommit(mech_contexts)
+
+        return results, mech_contexts
+
+    def _create_ports_bulk_ml2(self, context, request_items):
+        items = request_items['ports']
+        try:
+            results, mech_contexts = self._create_ports_db(context, items)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                LOG.exception(_LE("An exception occurred while creating "
+                                  "the ports:%s"), items)
+        objects = [{'mech_context': mech_context,
+                    'result': result,
+                    'attributes': item[attributes.PORT]}
+                   for item, result, mech_context in zip(
+                       items, results, mech_contexts)]
+
+        try:
+            self.mechanism_manager.create_ports_postcommit(mech_contexts)
+            return objects
+        except ml2_exc.MechanismDriverError:
+            with excutils.save_and_reraise_exception():
+                resource_ids = [res['id'] for res in results]
+                LOG.exception(_LE("mechanism_manager.create_ports_postcommit"
+                                  " failed. Deleting ports %s"),
+                              ', '.join(resource_ids))
+                self._delete_objects(context, attributes.PORT, objects)
+
     def create_port(self, context, port):
         attrs = port['port']
         result, mech_context = self._create_port_db(context, port)
@@ -962,7 +1038,11 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
         return bound_context._port
 
     def create_port_bulk(self, context, ports):
-        objects = self._create_bulk_ml2(attributes.PORT, context, ports)
+        if self._is_overridden('_create_port_db', Ml2Plugin):
+            # The plugin extends the creation of every port
+            objects = self._create_bulk_ml2(attributes.PORT, context, ports)
+        else:
+            objects = self._create_ports_bulk_ml2(context, ports)
 
         # REVISIT(rkukura): Is there any point in calling this before
         # a binding has been successfully established?
@@ -1238,6 +1318,72 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
 
         return self._bind_port_if_needed(port_context)
 
+    def get_bound_ports_contexts(self, plugin_context, port_ids, host=None):
+        """Get the bound port contexts of multiple ports.
+
+        The ports, their bindings, binding levels, networks and segments
+        are loaded with a few queries shared by all the ports, then the
+        unbound ports are bound. Returns a dictionary which maps each
+        received (possibly partial) port id to its port context, or to
+        None if the port or its binding could not be found.
+        """
+        port_contexts = dict((port_id, None) for port_id in port_ids)
+        session = plugin_context.session
+        with session.begin(subtransactions=True):
+            ports_db = db.get_ports(session, list(port_contexts))
+            if not ports_db:
+                return port_contexts
+            network_ids = set(port_db.network_id
+                              for port_db in ports_db.values())
+            networks = super(Ml2Plugin, self).get_networks(
+                plugin_context, filters={'id': list(network_ids)})
+            self.type_manager.extend_networks_dict_provider(plugin_context,
+                                                            networks)
+            networks = dict((network['id'], network)
+                            for network in networks)
+            segments = db.get_networks_segments(session, list(network_ids),
+                                                filter_dynamic=None)
+            segments = dict((segment[api.ID], segment)
+                            for network_segments in segments.values()
+                            for segment in network_segments)
+
+            bindings = {}
+            for port_id, port_db in ports_db.items():
+                if (port_db.device_owner ==
+                        const.DEVICE_OWNER_DVR_INTERFACE):
+                    binding = db.get_dvr_port_binding_by_host(
+                        session, port_db.id, host)
+                    if not binding:
+                        LOG.error(_LE("Binding info for DVR port %s not "
+                                      "found"), port_id)
+                        continue
+                else:
+                    binding = port_db.port_binding
+                    if not binding:
+                        LOG.info(_LI("Binding info for port %s was not "
+                                     "found, it might have been deleted "
+                                     "already."), port_id)
+                        continue
+                bindings[port_id] = binding
+            levels = db.get_ports_binding_levels(
+                session, dict((ports_db[port_id].id, binding.host)
+                              for port_id, binding in bindings.items()))
+
+            for port_id, binding in bindings.items():
+                port_db = ports_db[port_id]
+                port_context = driver_context.PortContext(
+                    self, plugin_context, self._make_port_dict(port_db),
+                    networks[port_db.network_id], binding,
+                    levels[port_db.id])
+                port_context._segments = segments
+                port_contexts[port_id] = port_context
+
+        for port_id, port_context in port_contexts.items():
+            if port_context:
+                port_contexts[port_id] = self._bind_port_if_needed(
+                    port_context)
+        return port_contexts
+
     def update_port_status(self, context, port_id, status, host=None):
         """
         Returns port_id (non-truncated uuid) if the port exists.
@@ -1307,6 +1453,70 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
 
         return port['id']
 
+    def update_port_statuses(self, context, port_ids, status, host=None):
+        """Update the status of multiple ports in a single transaction.
+
+        The ports which are not bound to the received host are ignored.
+        Returns a dictionary which maps the received ids of the existing
+        ports to their non-truncated ids, or to None if the port is bound
+        to another host.
+        """
+        found_ports = {}
+        dvr_port_ids = []
+        mech_contexts = []
+        networks = {}
+        session = context.session
+        with contextlib.nested(lockutils.lock('db-access'),
+                               session.begin(subtransactions=True)):
+            for port_id in port_ids:
+                port = db.get_port(session, port_id)
+                if not port:
+                    LOG.warning(_LW("Port %(port)s updated by agent not "
+                                    "found"), {'port': port_id})
+                    continue
+                if port['device_owner'] == const.DEVICE_OWNER_DVR_INTERFACE:
+                    # The DVR ports have a binding for each host
+                    dvr_port_ids.append(port_id)
+                    continue
+                binding_host = port.port_binding.host
+                if host and binding_host != host:
+                    LOG.debug("Port %(port)s not bound to the agent host "
+                              "%(host)s", {'port': port_id, 'host': host})
+                    found_ports[port_id] = None
+                    continue
+
+                found_ports[port_id] = port['id']
+                if port.status == status:
+                    continue
+                original_port = self._make_port_dict(port)
+                port.status = status
+                updated_port = self._make_port_dict(port)
+                network_id = original_port['network_id']
+                if network_id not in networks:
+                    networks[network_id] = self.get_network(context,
+                                                            network_id)
+                levels = db.get_binding_levels(session, port['id'],
+                                               binding_host)
+                mech_context = driver_context.PortContext(
+                    self, context, updated_port, networks[network_id],
+                    port.port_binding, levels, original_port=original_port)
+                self.mechanism_manager.update_port_precommit(mech_context)
+                mech_contexts.append(mech_context)
+
+        for mech_context in mech_contexts:
+            self.mechanism_manager.update_port_postcommit(mech_context)
+
+        for port_id in dvr_port_ids:
+            if host and not self.port_bound_to_host(context, port_id, host):
+                found_ports[port_id] = None
+                continue
+            updated_port_id = self.update_port_status(context, port_id,
+                                                      status, host)
+            if updated_port_id:
+                found_ports[port_id] = updated_port_id
+
+        return found_ports
+
     def port_bound_to_host(self, context, port_id, host):
         port = db.get_port(context.session, port_id)
         if not port:
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
 import oslo_messaging
 from sqlalchemy.orm import exc
 
@@ -46,7 +48,8 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
     #       return value to include fixed_ips and device_owner for
     #       the device port
     #   1.4 tunnel_sync rpc signature upgrade to obtain 'host'
-    target = oslo_messaging.Target(version='1.4')
+    #   1.5 Support update_devices_up and update_devices_down
+    target = oslo_messaging.Target(version='1.5')
 
     def __init__(self, notifier, type_manager):
         self.setup_tunnel_callback_mixin(notifier, type_manager)
@@ -66,11 +69,23 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
         port_context = plugin.get_bound_port_context(rpc_context,
                                                      port_id,
                                                      host)
+        entry, new_status = self._get_device_details(
+            agent_id, device, port_id, port_context)
+        if new_status:
+            plugin.update_port_status(rpc_context,
+                                      port_id,
+                                      new_status,
+                                      host)
+        LOG.debug("Returning: %s", entry)
+        return entry
+
+    def _get_device_details(self, agent_id, device, port_id, port_context):
+        """Returns the device details and the port status to be set."""
         if not port_context:
             LOG.warning(_LW("Device %(device)s requested by agent "
                             "%(agent_id)s not found in database"),
                         {'device': device, 'agent_id': agent_id})
-            return {'device': device}
+            return {'device': device}, None
 
         segment = port_context.bottom_bound_segment
         port = port_context.current
@@ -83,15 +98,12 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
                          'agent_id': agent_id,
                          'network_id': port['network_id'],
                          'vif_type': port[portbindings.VIF_TYPE]})
-            return {'device': device}
+            return {'device': device}, None
 
         new_status = (q_const.PORT_STATUS_BUILD if port['admin_state_up']
                       else q_const.PORT_STATUS_DOWN)
-        if port['status'] != new_status:
-            plugin.update_port_status(rpc_context,
-                                      port_id,
-                                      new_status,
-                                      host)
+        if port['status'] == new_status:
+            new_status = None
 
         entry = {'device': device,
                  'network_id': port['network_id'],
@@ -104,18 +116,44 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
                  'fixed_ips': port['fixed_ips'],
                  'device_owner': port['device_owner'],
                  'profile': port[portbindings.PROFILE]}
-        LOG.debug("Returning: %s", entry)
-        return entry
+        return entry, new_status
 
     def get_devices_details_list(self, rpc_context, **kwargs):
-        return [
-            self.get_device_details(
-                rpc_context,
-                device=device,
-                **kwargs
-            )
-            for device in kwargs.pop('devices', [])
-        ]
+        devices = kwargs.pop('devices', [])
+        if not devices:
+            return []
+        agent_id = kwargs.get('agent_id')
+        host = kwargs.get('host')
+        LOG.debug("Devices %(devices)s details requested by agent "
+                  "%(agent_id)s with host %(host)s",
+                  {'devices': devices, 'agent_id': agent_id, 'host': host})
+
+        plugin = manager.NeutronManager.get_plugin()
+        port_ids = [plugin._device_to_port_id(device) for device in devices]
+        port_contexts = plugin.get_bound_ports_contexts(rpc_context,
+                                                        port_ids, host)
+        entries = []
+        new_statuses = collections.defaultdict(list)
+        for device, port_id in zip(devices, port_ids):
+            port_context = port_contexts.get(port_id)
+            entry, new_status = self._get_device_details(
+                agent_id, device, port_id, port_context)
+            entries.append(entry)
+            if not new_status:
+                continue
+            if (port_context.current['device_owner'] ==
+                    q_const.DEVICE_OWNER_DVR_INTERFACE):
+                # The DVR ports have a binding for each host
+                plugin.update_port_status(rpc_context, port_id,
+                                          new_status, host)
+            else:
+                new_statuses[new_status].append(port_id)
+
+        for new_status, status_port_ids in new_statuses.items():
+            plugin.update_port_statuses(rpc_context, status_port_ids,
+                                        new_status)
+        LOG.debug("Returning: %s", entries)
+        return entries
 
     def update_device_down(self, rpc_context, **kwargs):
         """Device no longer exists on agent."""
@@ -167,16 +205,68 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
         port_id = plugin.update_port_status(rpc_context, port_id,
                                             q_const.PORT_STATUS_ACTIVE,
                                             host)
+        self._update_dvr_arp_table(rpc_context, plugin, [port_id])
+
+    def _update_dvr_arp_table(self, rpc_context, plugin, port_ids):
         l3plugin = manager.NeutronManager.get_service_plugins().get(
             service_constants.L3_ROUTER_NAT)
         if (l3plugin and
             utils.is_extension_supported(l3plugin,
                                          q_const.L3_DISTRIBUTED_EXT_ALIAS)):
-            try:
-                port = plugin._get_port(rpc_context, port_id)
-                l3plugin.dvr_vmarp_table_update(rpc_context, port, "add")
-            except exceptions.PortNotFound:
-                LOG.debug('Port %s not found during ARP update', port_id)
+            for port_id in port_ids:
+                try:
+                    port = plugin._get_port(rpc_context, port_id)
+                    l3plugin.dvr_vmarp_table_update(rpc_context, port, "add")
+                except exceptions.PortNotFound:
+                    LOG.debug('Port %s not found during ARP update', port_id)
+
+    def update_devices_up(self, rpc_context, **kwargs):
+        """Devices are up on agent.
+
+        The status of all the devices is updated in a single transaction.
+        """
+        agent_id = kwargs.get('agent_id')
+        devices = kwargs.get('devices', [])
+        host = kwargs.get('host')
+        LOG.debug("Devices %(devices)s up at agent %(agent_id)s",
+                  {'devices': devices, 'agent_id': agent_id})
+        plugin = manager.NeutronManager.get_plugin()
+        port_ids = [plugin._device_to_port_id(device) for device in devices]
+        found_ports = plugin.update_port_statuses(
+            rpc_context, port_ids, q_const.PORT_STATUS_ACTIVE, host)
+        self._update_dvr_arp_table(
+            rpc_context, plugin,
+            [port_id for port_id in found_ports.values() if port_id])
+
+    def update_devices_down(self, rpc_context, **kwargs):
+        """Devices no longer exist on agent.
+
+        The status of all the devices is updated in a single transaction.
+        Returns the same information as update_device_down for each device.
+        """
+        agent_id = kwargs.get('agent_id')
+        devices = kwargs.get('devices', [])
+        host = kwargs.get('host')
+        LOG.debug("Devices %(devices)s no longer exist at agent "
+                  "%(agent_id)s",
+                  {'devices': devices, 'agent_id': agent_id})
+        plugin = manager.NeutronManager.get_plugin()
+        port_ids = dict((device, plugin._device_to_port_id(device))
+                        for device in devices)
+        try:
+            found_ports = plugin.update_port_statuses(
+                rpc_context, list(port_ids.values()),
+                q_const.PORT_STATUS_DOWN, host)
+        except exc.StaleDataError:
+            LOG.debug("delete_port and update_devices_down are being "
+                      "executed concurrently. Updating the devices one "
+                      "by one.")
+            return [self.update_device_down(rpc_context, device=device,
+                                            agent_id=agent_id, host=host)
+                    for device in devices]
+
+        return [{'device': device, 'exists': port_ids[device] in found_ports}
+                for device in devices]
 
 
 class AgentNotifierApi(dvr_rpc.DVRAgentRpcApiMixin,
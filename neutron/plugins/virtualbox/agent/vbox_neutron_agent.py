@@ -12,8 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import platform
-import re
 import sys
 import time
 
@@ -24,6 +24,8 @@ if sys.platform == 'win32':
 else:
     eventlet.monkey_patch()
 
+from eventlet import queue
+from eventlet import semaphore
 from oslo_config import cfg
 import oslo_messaging
 
@@ -40,6 +42,8 @@ from neutron.openstack.common import loopingcall
 from neutron.plugins.common import constants as p_const
 from neutron.plugins.virtualbox.common import constants
 from neutron.plugins.virtualbox.common import exception as vbox_exc
+from neutron.plugins.virtualbox.common import metrics
+from neutron.plugins.virtualbox.common import utils as vbox_utils
 from neutron.plugins.virtualbox.common import vboxapi
 
 LOG = logging.getLogger(__name__)
@@ -57,6 +61,57 @@ AGENT_OPS = [
     cfg.IntOpt('polling_interval', default=2,
                help=i18n._('The number of seconds the agent will wait between '
                            'polling for local device changes.')),
+
+    cfg.IntOpt('max_polling_interval', default=10,
+               help=i18n._('The maximum number of seconds the agent will '
+                           'wait between polling for local device changes. '
+                           'The polling interval grows up to this value '
+                           'while no changes are found.')),
+
+    cfg.IntOpt('max_scan_duty_cycle', default=50,
+               help=i18n._('The maximum percentage of the wall time which '
+                           'the agent spends scanning the virtual machines. '
+                           'The polling interval is extended when a scan '
+                           'takes longer.')),
+
+    cfg.BoolOpt('watch_events', default=False,
+                help=i18n._('Use the VirtualBox event source in order to '
+                            'detect the changed virtual machines instead of '
+                            'inspecting all of them on every polling '
+                            'interval. Requires the VirtualBox Python API.')),
+
+    cfg.IntOpt('full_scan_interval', default=60,
+               help=i18n._('The number of seconds between two full scans '
+                           'of the virtual machines when the events are '
+                           'watched.')),
+
+    cfg.IntOpt('retry_interval', default=2,
+               help=i18n._('The number of seconds to wait before retrying '
+                           'a device which could not be processed. The '
+                           'interval is doubled after each failed attempt.')),
+
+    cfg.IntOpt('max_retry_interval', default=60,
+               help=i18n._('The maximum number of seconds to wait before '
+                           'retrying a device which could not be '
+                           'processed.')),
+
+    cfg.IntOpt('max_failed_devices', default=256,
+               help=i18n._('The maximum number of failed devices retried '
+                           'individually. When it is exceeded, all the '
+                           'devices are resynced with the plugin.')),
+
+    cfg.StrOpt('metrics_file',
+               help=i18n._('The file where the agent writes, after every '
+                           'polling interval, the JSON summary of its '
+                           'counters and latencies.')),
+
+    cfg.IntOpt('statistics_report_interval', default=300,
+               help=i18n._('The number of seconds between the updates of '
+                           'the statistics sent in the state reports. The '
+                           'configurations of the agent are only rewritten '
+                           'in the database when they change, so the '
+                           'heartbeats in between are cheaper. 0 updates '
+                           'them on every report.')),
 ]
 CONF = cfg.CONF
 CONF.register_opts(AGENT_OPS, 'AGENT')
@@ -99,6 +154,11 @@ class VBoxNeutronAgent(object):
 
     target = oslo_messaging.Target(version=constants.RPC_VERSION)
 
+    # The number of failed devices listed in the state reports: the
+    # configurations of the agents are stored in 4095 characters, so the
+    # whole retry queue is only written in the `metrics_file`
+    RETRY_QUEUE_SAMPLE = 10
+
     def __init__(self):
         super(VBoxNeutronAgent, self).__init__()
         self.agend_id = None
@@ -111,12 +171,31 @@ class VBoxNeutronAgent(object):
         self.state_rpc = None
         self._network_manager = vboxapi.VBoxNetworkManage()
         self._ignore_list = {}
+        # The ports bound on this agent, grouped by network id
         self._network_map = {}
-        self._physical_network_mappings = {}
-        self._polling_interval = CONF.AGENT.polling_interval
+        self._physical_network_mappings = collections.OrderedDict()
+        self._network_mappings = None
+        self._polling = vbox_utils.AdaptivePollingInterval(
+            CONF.AGENT.polling_interval, CONF.AGENT.max_polling_interval,
+            CONF.AGENT.max_scan_duty_cycle)
+        self._watcher = None
+        self._changed_instances = set()
+        self._full_scan_required = True
+        self._last_full_scan = 0
+        # The devices which failed to be processed, mapped to the failed
+        # action ('added' or 'removed'), the number of failed attempts
+        # and the time of the next retry
+        self._failed_devices = {}
+        self._statistics_reported_at = None
+        # The ports changed by RPC notifications, in the order in which
+        # they were notified, and the last action requested for them
+        self._work_queue = queue.LightQueue()
+        self._pending_work = {}
+        self._work_lock = semaphore.Semaphore()
 
         self._load_physical_network_mappings()
         self._setup_rpc()
+        self._setup_watcher()
 
     def _load_physical_network_mappings(self):
         for mapping in CONF.AGENT.physical_network_mappings:
@@ -124,9 +203,14 @@ class VBoxNeutronAgent(object):
             if len(parts) != 2:
                 LOG.debug('Invalid physical network mapping: %s', mapping)
                 continue
-            pattern = re.escape(parts[0].strip()).replace('\\*', '.*')
+            pattern = vbox_utils.PhysicalNetworkMappings.pattern(
+                parts[0].strip())
             network = parts[1].strip()
-            self._physical_network_mappings[pattern] = network
+            # The first mapping of a physical network wins
+            self._physical_network_mappings.setdefault(pattern, network)
+
+        self._network_mappings = vbox_utils.PhysicalNetworkMappings(
+            self._physical_network_mappings.items())
 
     def _setup_rpc(self):
         self.agent_id = 'vbox_%s' % platform.node()
@@ -165,27 +249,201 @@ class VBoxNeutronAgent(object):
             'start_flag': True
         }
 
+    def _setup_watcher(self):
+        if not CONF.AGENT.watch_events:
+            return
+
+        watcher = vboxapi.VBoxEventWatcher()
+        try:
+            watcher.start()
+        except Exception as error:
+            LOG.warning(i18n._LW("Failed to watch the VirtualBox events, "
+                                 "falling back to polling: %(error)s"),
+                        {"error": error})
+        else:
+            self._watcher = watcher
+
+    def _metrics_totals(self):
+        """Return the few totals of the metrics sent in the state reports,
+        the latency histograms being only written in the `metrics_file`.
+        """
+        return {
+            'vbox_calls': metrics.METRICS.counter('vbox.calls'),
+            'vbox_errors': (metrics.METRICS.counter('vbox.failures') +
+                            metrics.METRICS.counter('vbox.rejected')),
+            'vbox_retries': metrics.METRICS.counter('vbox.retries'),
+            'rpc_errors': metrics.METRICS.counter('rpc.errors'),
+            'loop_avg': metrics.METRICS.average('agent.loop'),
+        }
+
+    def _update_statistics(self, configurations):
+        configurations['vm_info_cache'] = (
+            self._network_manager.cache_statistics())
+        configurations['nic_setup'] = (
+            self._network_manager.setup_statistics())
+        configurations['device_index'] = (
+            self._network_manager.index_statistics())
+        configurations['polling'] = self._polling.statistics()
+        configurations['vbox_health'] = (
+            vboxapi.get_circuit_breaker().statistics())
+        configurations['metrics'] = self._metrics_totals()
+        configurations['retry_queue'] = {
+            'size': len(self._failed_devices),
+            'max_size': CONF.AGENT.max_failed_devices,
+            'sample': sorted(self._failed_devices)[:self.RETRY_QUEUE_SAMPLE]
+        }
+
     def _report_state(self):
+        # The statistics change continuously, so they are only updated
+        # periodically for the heartbeats to leave the configurations as
+        # they are
+        now = time.time()
+        if (self._statistics_reported_at is None or
+                now - self._statistics_reported_at >=
+                CONF.AGENT.statistics_report_interval):
+            self._update_statistics(self.agent_state['configurations'])
+            self._statistics_reported_at = now
         try:
-            self.state_rpc.report_state(self.context,
-                                        self.agent_state)
+            with metrics.METRICS.timer('rpc.report_state'):
+                self.state_rpc.report_state(self.context,
+                                            self.agent_state)
             self.agent_state.pop('start_flag', None)
         except Exception:
+            metrics.METRICS.increment('rpc.errors')
             LOG.exception(i18n._LE("Failed reporting state!"))
 
+    def _export_metrics(self):
+        """Write the summary of the metrics and the attempts of the
+        failed devices in the `metrics_file`.
+        """
+        if not CONF.AGENT.metrics_file:
+            return
+
+        try:
+            metrics.METRICS.dump(CONF.AGENT.metrics_file, {
+                'retry_queue': dict((device, failure['attempts'])
+                                    for device, failure in
+                                    self._failed_devices.items())})
+        except (IOError, OSError) as error:
+            LOG.warning(i18n._LW("Failed to write the metrics in "
+                                 "%(file)s: %(error)s"),
+                        {"file": CONF.AGENT.metrics_file, "error": error})
+
+    def port_update(self, context, port=None, network_type=None,
+                    segmentation_id=None, physical_network=None):
+        LOG.debug("port_update received for port %s", port['id'])
+        self._queue_work(port['id'], 'update')
+
+    def port_delete(self, context, port_id=None):
+        LOG.debug("port_delete received for port %s", port_id)
+        self._queue_work(port_id, 'delete')
+
+    def network_delete(self, context, network_id=None):
+        LOG.debug("network_delete received for network %s", network_id)
+        for port_id in self._network_map.pop(network_id, ()):
+            self._queue_work(port_id, 'delete')
+
+    def _queue_work(self, port_id, action):
+        """Schedule the action for a port handled by this agent.
+
+        A port is queued only once, a new notification replaces the
+        action which is not processed yet.
+        """
+        if not self._network_manager.device_exists(port_id):
+            LOG.debug("No port %(port_id)s defined on agent.",
+                      {"port_id": port_id})
+            return
+
+        metrics.METRICS.increment('agent.%s_notifications' % action)
+        if port_id not in self._pending_work:
+            self._work_queue.put(port_id)
+        self._pending_work[port_id] = action
+        # More changes are likely to follow
+        self._polling.reset()
+
+    def _process_work(self, port_id):
+        """Process the last action requested for a port."""
+        action = self._pending_work.pop(port_id, None)
+        if action == 'update':
+            failed_devices = self.treat_devices_added([port_id])
+            self._update_failed_devices('added', [port_id], failed_devices)
+        elif action == 'delete':
+            self._forget_port(port_id)
+            try:
+                self._network_manager.disconnect_device(port_id)
+            except vbox_exc.VBoxManageError as error:
+                LOG.warning(i18n._LW("Failed to disconnect the deleted "
+                                     "port %(port_id)s: %(error)s"),
+                            {"port_id": port_id, "error": error})
+            else:
+                LOG.info(i18n._LI("Port %s disconnected"), port_id)
+
+    def _work_loop(self):
+        """Process the ports changed by RPC notifications as soon as
+        they are received, without waiting for the next polling interval.
+        """
+        while True:
+            port_id = self._work_queue.get()
+            with self._work_lock:
+                try:
+                    self._process_work(port_id)
+                except Exception:
+                    LOG.exception(i18n._LE("Failed to process the changes "
+                                           "for port %s"), port_id)
+
+    def _forget_port(self, port_id):
+        for network_id, ports in list(self._network_map.items()):
+            ports.discard(port_id)
+            if not ports:
+                del self._network_map[network_id]
+
     def _device_info_has_changes(self, device_info):
         return (device_info.get('added') or device_info.get('removed'))
 
-    def _get_current_devices(self):
-        self._network_manager.refresh()
+    def _get_current_devices(self, full_scan=False):
+        full_scan = (full_scan or self._watcher is None or
+                     self._full_scan_required or
+                     time.time() - self._last_full_scan >=
+                     CONF.AGENT.full_scan_interval)
+
+        if full_scan:
+            self._network_manager.refresh()
+            self._last_full_scan = time.time()
+        elif self._changed_instances:
+            self._network_manager.refresh(self._changed_instances)
+
+        self._changed_instances = set()
+        self._full_scan_required = False
         return self._network_manager.devices()
 
+    def _wait_for_changes(self, timeout):
+        if self._watcher is None:
+            if timeout > 0:
+                time.sleep(timeout)
+            return
+
+        try:
+            instances, full_scan = self._watcher.wait(timeout)
+        except Exception as error:
+            LOG.warning(i18n._LW("Failed to process the VirtualBox events, "
+                                 "falling back to polling: %(error)s"),
+                        {"error": error})
+            self._watcher.stop()
+            self._watcher = None
+            self._full_scan_required = True
+            return
+
+        LOG.debug("Changed instances: %(instances)s (full scan: "
+                  "%(full_scan)s)",
+                  {"instances": instances, "full_scan": full_scan})
+        self._changed_instances.update(instances)
+        self._full_scan_required = self._full_scan_required or full_scan
+
     def _get_interface(self, phys_network_name):
-        for pattern in self._physical_network_mappings:
-            if phys_network_name is None:
-                phys_network_name = ''
-            if re.match(pattern, phys_network_name):
-                return self._physical_network_mappings[pattern]
+        if phys_network_name is None:
+            phys_network_name = ''
+        if phys_network_name in self._network_mappings:
+            return self._network_mappings.lookup(phys_network_name)
 
         # Not found in the mappings
         return phys_network_name
@@ -197,7 +455,7 @@ class VBoxNeutronAgent(object):
             interface_name = CONF.AGENT.local_network
         return interface_name
 
-    def _add_device(self, device_details):
+    def _check_device(self, device_details):
         if 'port_id' not in device_details:
             LOG.debug("The `port_id` is not provided for this device.")
             return False
@@ -212,75 +470,170 @@ class VBoxNeutronAgent(object):
                         {"port_id": device_details['port_id']})
             return False
 
-        self._network_manager.setup_device(
-            device_details['port_id'],
-            self._get_interface_name(
-                    device_details['network_type'],
-                    device_details['physical_network']))
         return True
 
+    def _add_devices(self, devices_details_list):
+        """Connect all the received devices to their physical networks.
+
+        Returns a dictionary with the errors for the devices which could
+        not be connected.
+        """
+        devices = {}
+        disconnected = set()
+        for device_details in devices_details_list:
+            LOG.debug("Treat device: %(device)s", {"device": device_details})
+            if self._check_device(device_details):
+                port_id = device_details['port_id']
+                devices[port_id] = self._get_interface_name(
+                    device_details['network_type'],
+                    device_details['physical_network'])
+                if not device_details.get('admin_state_up', True):
+                    # The cable of the administratively down ports is
+                    # disconnected
+                    disconnected.add(port_id)
+
+        errors = self._network_manager.setup_devices(devices, disconnected)
+        for device_details in devices_details_list:
+            port_id = device_details.get('port_id')
+            if port_id in devices and port_id not in errors:
+                self._network_map.setdefault(
+                    device_details.get('network_id'), set()).add(port_id)
+                LOG.info(i18n._LI(
+                    "Port %(device)s updated. Details: %(details)s"),
+                    {'device': device_details['device'],
+                     'details': device_details})
+        return errors
+
+    @metrics.METRICS.timed('agent.treat_devices_added')
     def treat_devices_added(self, devices):
+        """Returns the devices which failed to be added."""
         LOG.debug("Treat devices %(devices)s added.", {"devices": devices})
-        sync_required = False
+        failed_devices = set()
         try:
-            devices_details_list = self.plugin_rpc.get_devices_details_list(
-                self.context, devices, self.agent_id)
+            with metrics.METRICS.timer('rpc.get_devices_details_list'):
+                devices_details_list = (
+                    self.plugin_rpc.get_devices_details_list(
+                        self.context, devices, self.agent_id))
         except Exception as exc:
+            metrics.METRICS.increment('rpc.errors')
             LOG.debug(
                 "Unable to get ports details for devices %(devices)s: %(exc)s",
                 {'devices': devices, 'exc': exc})
-            return True     # resync is needed
+            return set(devices)
 
+        errors = self._add_devices(devices_details_list)
+        devices_up = []
+        devices_down = []
         for device_details in devices_details_list:
-            LOG.debug("Treat device: %(device)s", {"device": device_details})
-            device = device_details['device']
-            try:
-                if self._add_device(device_details):
-                    LOG.info(i18n._LI(
-                        "Port %(device)s updated. Details: %(details)s"),
-                        {'device': device, 'details': device_details})
-            except vbox_exc.VBoxManageError as error:
+            port_id = device_details.get('port_id')
+            if port_id in errors:
                 LOG.error(i18n._LE("Fail to bind port: %(port)s: %(error)s"),
-                          {"port": device_details['port_id'], "error": error})
-                sync_required = True
-            self.plugin_rpc.update_device_up(
-                        self.context, device, self.agent_id, cfg.CONF.host)
-        return sync_required
-
+                          {"port": port_id, "error": errors[port_id]})
+                failed_devices.add(device_details['device'])
+            elif device_details.get('admin_state_up', True):
+                devices_up.append(device_details['device'])
+            else:
+                devices_down.append(device_details['device'])
+
+        for devices_list, update_devices, name in (
+                (devices_up, self.plugin_rpc.update_devices_up,
+                 'rpc.update_devices_up'),
+                (devices_down, self.plugin_rpc.update_devices_down,
+                 'rpc.update_devices_down')):
+            if not devices_list:
+                continue
+            try:
+                with metrics.METRICS.timer(name):
+                    update_devices(self.context, devices_list,
+                                   self.agent_id, cfg.CONF.host)
+            except Exception as exc:
+                metrics.METRICS.increment('rpc.errors')
+                LOG.debug("Unable to update the status for devices "
+                          "%(devices)s: %(exc)s",
+                          {'devices': devices_list, 'exc': exc})
+                failed_devices.update(devices_list)
+
+        return failed_devices
+
+    @metrics.METRICS.timed('agent.treat_devices_removed')
     def treat_devices_removed(self, devices):
+        """Returns the devices which failed to be removed."""
         LOG.debug("Treat devices %(devices)s removed", {"devices": devices})
-        sync_required = False
         for device in devices:
             LOG.info(i18n._LI("Removing port %s"), device)
-            try:
-                self.plugin_rpc.update_device_down(
-                    self.context, device, self.agent_id,
+            self._forget_port(device)
+
+        try:
+            with metrics.METRICS.timer('rpc.update_devices_down'):
+                self.plugin_rpc.update_devices_down(
+                    self.context, list(devices), self.agent_id,
                     cfg.CONF.host)
-            except Exception as error:
-                LOG.debug("Removing port failed for device %(device)s:"
-                          " %(error)s",
-                          {"device": device, "error": error})
-                sync_required = True
-                continue
+        except Exception as error:
+            metrics.METRICS.increment('rpc.errors')
+            LOG.debug("Removing ports failed for devices %(devices)s:"
+                      " %(error)s",
+                      {"devices": devices, "error": error})
+            return set(devices)
 
-        return sync_required
+        return set()
 
-    def process_network_devices(self, device_info):
-        resync_removed = False
-        resync_added = False
+    def _update_failed_devices(self, action, devices, failed_devices):
+        """Track the devices which failed the received action.
 
-        if device_info.get('added'):
-            resync_removed = self.treat_devices_added(device_info.get('added'))
+        The failed devices are retried with an exponential backoff, while
+        the processed ones are forgotten.
+        """
+        for device in devices:
+            failure = self._failed_devices.get(device)
+            if device not in failed_devices:
+                if failure and failure['action'] == action:
+                    del self._failed_devices[device]
+                continue
 
-        if device_info.get('removed'):
-            resync_added = self.treat_devices_removed(device_info['removed'])
+            if not failure or failure['action'] != action:
+                failure = {'action': action, 'attempts': 0}
+                self._failed_devices[device] = failure
+            failure['attempts'] += 1
+            interval = min(
+                CONF.AGENT.retry_interval * 2 ** (failure['attempts'] - 1),
+                CONF.AGENT.max_retry_interval)
+            failure['retry_at'] = time.time() + interval
+            LOG.warning(i18n._LW("Failed to process the %(action)s device "
+                                 "%(device)s, retrying in %(interval)s "
+                                 "seconds (attempt %(attempts)s)"),
+                        {'action': action, 'device': device,
+                         'interval': interval,
+                         'attempts': failure['attempts']})
+
+    def _get_retry_devices(self, action):
+        """Returns the failed devices which are due to be retried."""
+        now = time.time()
+        return set(device for device, failure in self._failed_devices.items()
+                   if failure['action'] == action and
+                   failure['retry_at'] <= now)
 
-        # If one of the above operations fails => resync with plugin
-        return resync_removed or resync_added
+    def process_network_devices(self, device_info):
+        """Returns True if all the devices have to be resynced."""
+        added = device_info.get('added')
+        if added:
+            failed_devices = self.treat_devices_added(added)
+            self._update_failed_devices('added', added, failed_devices)
+
+        removed = device_info.get('removed')
+        if removed:
+            failed_devices = self.treat_devices_removed(removed)
+            self._update_failed_devices('removed', removed, failed_devices)
+
+        if len(self._failed_devices) > CONF.AGENT.max_failed_devices:
+            LOG.warning(i18n._LW("Too many failed devices (%(count)s), "
+                                 "resyncing all the devices."),
+                        {'count': len(self._failed_devices)})
+            return True
+        return False
 
     def scan_devices(self, previous, sync):
         device_info = {}
-        current_devices = self._get_current_devices()
+        current_devices = self._get_current_devices(full_scan=sync)
         device_info['current'] = current_devices
 
         if previous is None:
@@ -297,45 +650,94 @@ class VBoxNeutronAgent(object):
             device_info['removed'] = (previous['removed'] | previous['current']
                                       - current_devices)
 
+            # All the failed devices are retried by the resync.
+            self._failed_devices = {}
+
         else:
             device_info['added'] = current_devices - previous['current']
             device_info['removed'] = previous['current'] - current_devices
 
+            # Retry the failed devices whose backoff interval expired.
+            device_info['added'] |= (self._get_retry_devices('added') &
+                                     current_devices)
+            device_info['removed'] |= (self._get_retry_devices('removed') -
+                                       current_devices)
+
+            # Forget the failures made obsolete by the devices which were
+            # added or removed meanwhile.
+            for device in list(self._failed_devices):
+                action = self._failed_devices[device]['action']
+                if ((action == 'added' and device not in current_devices) or
+                        (action == 'removed' and device in current_devices)):
+                    del self._failed_devices[device]
+
         return device_info
 
+    def _process_iteration(self, device_info, sync):
+        """Scan the devices and process the changes.
+
+        Returns the scanned devices and whether the next iteration has to
+        resync all the devices. The scan is skipped while VirtualBox is
+        unavailable.
+        """
+        if vboxapi.get_circuit_breaker().is_open():
+            LOG.debug("VirtualBox is unavailable, the scan is paused.")
+            return device_info, sync
+
+        try:
+            new_device_info = self.scan_devices(previous=device_info,
+                                                sync=sync)
+        except vbox_exc.VBoxManageError as error:
+            LOG.warning(i18n._LW("Failed to scan the devices: %(error)s"),
+                        {"error": error})
+            return device_info, sync
+        device_info = new_device_info
+
+        if sync:
+            LOG.info(i18n._LI("Agent out of sync with plugin!"))
+            sync = False
+
+        if self._device_info_has_changes(device_info):
+            LOG.debug("Agent loop found changes! %s", device_info)
+            try:
+                sync = self.process_network_devices(device_info)
+            except vbox_exc.VBoxException as error:
+                LOG.exception(
+                    i18n._LE("Error: `%(error)s` in agent loop."
+                             " Devices info: %(device)s"),
+                    {"error": error, "device": device_info})
+                sync = True
+
+        return device_info, sync
+
     def daemon_loop(self):
         LOG.info(i18n._LI("VBox Agent RPC Daemon Started!"))
         device_info = None
         sync = True
+        eventlet.spawn_n(self._work_loop)
 
         while True:
             start = time.time()
-            device_info = self.scan_devices(previous=device_info, sync=sync)
+            vbox_calls = metrics.METRICS.counter('vbox.calls')
+            with self._work_lock:
+                device_info, sync = self._process_iteration(device_info,
+                                                            sync)
 
-            if sync:
-                LOG.info(i18n._LI("Agent out of sync with plugin!"))
-                sync = False
-
-            if self._device_info_has_changes(device_info):
-                LOG.debug("Agent loop found changes! %s", device_info)
-                try:
-                    sync = self.process_network_devices(device_info)
-                except vbox_exc.VBoxException as error:
-                    LOG.exception(
-                        i18n._LE("Error: `%(error)s` in agent loop."
-                                 " Devices info: %(device)s"),
-                        {"error": error, "device": device_info})
-                    sync = True
-
-            # sleep till end of polling interval
+            # wait for changes till end of polling interval
             elapsed = (time.time() - start)
-            if elapsed < self._polling_interval:
-                time.sleep(self._polling_interval - elapsed)
-            else:
+            metrics.METRICS.observe('agent.loop', elapsed)
+            metrics.METRICS.set_gauge(
+                'agent.loop_vbox_calls',
+                metrics.METRICS.counter('vbox.calls') - vbox_calls)
+            self._export_metrics()
+            if elapsed >= self._polling.interval:
                 LOG.debug("Loop iteration exceeded interval "
                           "(%(polling_interval)s vs. %(elapsed)s)!",
-                          {'polling_interval': self._polling_interval,
+                          {'polling_interval': self._polling.interval,
                            'elapsed': elapsed})
+            self._wait_for_changes(self._polling.next_wait(
+                start, elapsed,
+                sync or self._device_info_has_changes(device_info)))
 
 
 def main():
@@ -51,8 +51,13 @@ OFF = 'off'
 
 VM_STATE = 'VMState'
 VM_DESCRIPTION = 'description'
+VM_CFG_FILE = 'CfgFile'
+VM_NICS = 'nics'
 POWER_OFF = 'poweroff'
 RUNNING = 'running'
+PAUSED = 'paused'
+# The states of the virtual machines listed by `list runningvms`
+RUNNING_STATES = (RUNNING, PAUSED)
 
 VBOX_E_ACCESSDENIED = 'E_ACCESSDENIED'
 VBOX_E_INVALID_OBJECT_STATE = 'VBOX_E_INVALID_OBJECT_STATE'
@@ -60,6 +65,13 @@ VBOX_E_INVALID_VM_STATE = 'VBOX_E_INVALID_VM_STATE'
 VBOX_E_INVALID_VM_STATE_2 = 'Machine in invalid state'
 VBOX_E_OBJECT_NOT_FOUND = 'VBOX_E_OBJECT_NOT_FOUND'
 VBOX_E_INSTANCE_NOT_FOUND = 'Could not find a registered machine named'
+# The errors which are expected to go away when the command is retried
+VBOX_TRANSIENT_ERRORS = (
+    VBOX_E_ACCESSDENIED,
+    'NS_ERROR_CALL_FAILED',         # The connection to VBoxSVC was lost
+    'NS_ERROR_ABORT',
+    'RPC_S_SERVER_UNAVAILABLE',     # VBoxSVC is not running (Windows)
+)
 
 # RPC API default version
 RPC_VERSION = '1.1'
@@ -68,3 +80,4 @@ RPC_VERSION = '1.1'
 TUNNEL = 'tunnel'
 
 VMS_INFO = 'vms'
+RUNNINGVMS_INFO = 'runningvms'
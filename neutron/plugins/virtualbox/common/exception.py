@@ -29,6 +29,11 @@ class InstanceNotFound(VBoxException):
     message = i18n._("Instance %(instance)s could not be found.")
 
 
+class VBoxUnavailable(VBoxManageError):
+    message = i18n._("VirtualBox is unavailable, the command %(method)s "
+                     "failed: %(reason)s")
+
+
 class InstanceInvalidState(VBoxManageError):
     message = i18n._("Instance %(instance)s cannot %(method)s while "
                      "the instance is in this state: %(details)s")
@@ -0,0 +1,155 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Counters and latency histograms for the VirtualBox agent.
+"""
+
+import bisect
+import contextlib
+import functools
+import os
+import tempfile
+import time
+
+from oslo_serialization import jsonutils
+
+
+class Histogram(object):
+
+    """The distribution of the latencies of an operation."""
+
+    # The upper bounds of the buckets, in milliseconds
+    BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+    def __init__(self):
+        self._counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Record the duration of an operation."""
+        milliseconds = seconds * 1000
+        self._counts[bisect.bisect_left(self.BUCKETS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def summary(self):
+        """Return the number of operations and their total, average and
+        maximum duration (in milliseconds), together with the number of
+        operations from every bucket.
+        """
+        buckets = dict(("le_%d" % bound, count) for bound, count
+                       in zip(self.BUCKETS, self._counts) if count)
+        if self._counts[-1]:
+            buckets["inf"] = self._counts[-1]
+        return {
+            "count": self.count,
+            "total": round(self.total, 3),
+            "avg": round(self.total / self.count, 3) if self.count else 0,
+            "max": round(self.max, 3),
+            "buckets": buckets,
+        }
+
+
+class Metrics(object):
+
+    """A registry of named counters, gauges and latency histograms."""
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1):
+        """Increment the received counter."""
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def counter(self, name):
+        """Return the current value of a counter."""
+        return self._counters.get(name, 0)
+
+    def set_gauge(self, name, value):
+        """Record the last value of a measurement."""
+        self._gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Record the duration of an operation."""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def average(self, name):
+        """Return the average duration of an operation, in milliseconds."""
+        histogram = self._histograms.get(name)
+        if histogram is None or not histogram.count:
+            return 0
+        return round(histogram.total / histogram.count, 3)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Measure the duration of the wrapped block, even if it fails."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def timed(self, name):
+        """Decorator which measures the duration of every call."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """Return all the metrics as a JSON serializable dictionary."""
+        return {
+            "counters": dict(self._counters),
+            "gauges": dict(self._gauges),
+            "latency": dict((name, histogram.summary()) for name, histogram
+                            in self._histograms.items()),
+        }
+
+    def reset(self):
+        self._counters.clear()
+        self._gauges.clear()
+        self._histograms.clear()
+
+    def dump(self, path, extra=None):
+        """Atomically write the summary of the metrics in a JSON file,
+        together with the sections of the `extra` dictionary.
+        """
+        summary = self.summary()
+        summary.update(extra or {})
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as stats_file:
+                stats_file.write(jsonutils.dumps(summary))
+            os.rename(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+
+# The metrics shared by all the components of the agent
+METRICS = Metrics()
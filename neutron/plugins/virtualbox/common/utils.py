@@ -0,0 +1,240 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import random
+import re
+import time
+
+
+class LRUCache(object):
+
+    """A dictionary which keeps only the most recently used items."""
+
+    def __init__(self, size):
+        self._size = size
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def set(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self._size:
+            self._items.popitem(last=False)
+
+
+class PhysicalNetworkMappings(object):
+
+    """The mappings between the physical networks and the interfaces.
+
+    The wildcard patterns are compiled once into a single alternation
+    regex. The first pattern which matches a physical network wins and
+    the result of the lookup is memoized.
+    """
+
+    CACHE_SIZE = 256
+
+    def __init__(self, mappings):
+        """
+        :param mappings: a list of (pattern, interface) pairs, in the
+                         order in which they should be tried
+        """
+        self._mappings = [(re.compile(pattern), interface)
+                          for pattern, interface in mappings]
+        self._regex = re.compile('|'.join('(?:%s)' % pattern
+                                          for pattern, _ in mappings))
+        self._cache = LRUCache(self.CACHE_SIZE)
+
+    @staticmethod
+    def pattern(physical_network):
+        """Convert a physical network wildcard into a regex pattern."""
+        return re.escape(physical_network).replace('\\*', '.*')
+
+    def _match(self, physical_network):
+        """Return the index of the first mapping which matches the
+        physical network or None.
+        """
+        physical_network = physical_network or ''
+        if physical_network in self._cache:
+            return self._cache.get(physical_network)
+
+        index = None
+        if self._mappings and self._regex.match(physical_network):
+            for position, (pattern, _) in enumerate(self._mappings):
+                if pattern.match(physical_network):
+                    index = position
+                    break
+
+        self._cache.set(physical_network, index)
+        return index
+
+    def lookup(self, physical_network):
+        """Return the interface mapped to the physical network or None."""
+        index = self._match(physical_network)
+        if index is not None:
+            return self._mappings[index][1]
+
+    def __contains__(self, physical_network):
+        return self._match(physical_network) is not None
+
+
+class AdaptivePollingInterval(object):
+
+    """The time to wait between two scans of the devices.
+
+    The interval is doubled, up to `max_interval`, after `IDLE_SCANS`
+    consecutive scans without changes and it is reset to `interval` after
+    a change. The time spent scanning is kept under `max_duty_cycle`
+    percent of the wall time.
+    """
+
+    IDLE_SCANS = 3
+
+    def __init__(self, interval, max_interval, max_duty_cycle=100):
+        self._min_interval = interval
+        self._max_interval = max(interval, max_interval)
+        self._duty_cycle = min(max(max_duty_cycle, 1), 100) / 100.0
+        self._idle_scans = 0
+        self._last_start = None
+        self._stats = {"interval": interval, "loop_duration": 0,
+                       "scan_duration": 0, "scans": 0, "overruns": 0}
+        self.interval = interval
+
+    def reset(self):
+        """Use the shortest interval for the next scans."""
+        self._idle_scans = 0
+        self.interval = self._min_interval
+
+    def next_wait(self, start, scan_duration, changed):
+        """Return the number of seconds to wait before the next scan.
+
+        :param start:         the time when the scan started
+        :param scan_duration: the number of seconds spent scanning
+        :param changed:       whether the scan found changes
+        """
+        if self._last_start is not None:
+            self._stats["loop_duration"] = start - self._last_start
+        self._last_start = start
+        self._stats["scans"] += 1
+        self._stats["scan_duration"] = scan_duration
+        if scan_duration >= self.interval:
+            self._stats["overruns"] += 1
+
+        if changed:
+            self.reset()
+        else:
+            self._idle_scans += 1
+            if self._idle_scans >= self.IDLE_SCANS:
+                self._idle_scans = 0
+                self.interval = min(self.interval * 2, self._max_interval)
+        self._stats["interval"] = self.interval
+
+        # The minimum wait which keeps the duty cycle of the scans
+        duty_cycle_wait = scan_duration * (1 - self._duty_cycle) / (
+            self._duty_cycle)
+        return max(self.interval - scan_duration, duty_cycle_wait, 0)
+
+    def statistics(self):
+        """Return the current interval, the duration of the last loop
+        iteration and of the last scan, the number of scans and the number
+        of scans which exceeded the interval.
+        """
+        return dict(self._stats)
+
+
+def backoff_delay(attempt, interval, max_interval):
+    """Return the delay before the received retry attempt (starting with
+    0): the interval is doubled after every attempt, up to `max_interval`,
+    and a random jitter spreads the retries of the concurrent callers.
+    """
+    delay = min(interval * 2 ** attempt, max_interval)
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+class CircuitBreaker(object):
+
+    """Stop using a service which keeps failing.
+
+    The circuit is opened after `threshold` consecutive failures. While
+    it is open, no calls are allowed. After `timeout` seconds a single
+    probe call is allowed and its result closes or opens the circuit again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold, timeout):
+        self._threshold = threshold
+        self._timeout = timeout
+        self._opened_at = None
+        self._probing = False
+        self.failures = 0
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.time() - self._opened_at < self._timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def is_open(self):
+        """Test whether the calls are rejected until the timeout expires."""
+        return self.state == self.OPEN
+
+    def allow(self):
+        """Test whether a call is allowed."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self._opened_at is None and
+                             self.failures >= self._threshold):
+            if self._opened_at is None:
+                self.trips += 1
+            self._opened_at = time.time()
+        self._probing = False
+
+    def statistics(self):
+        """Return the state of the circuit, the number of consecutive
+        failures and the number of times it was opened.
+        """
+        return {"state": self.state, "failures": self.failures,
+                "trips": self.trips}
@@ -16,16 +16,26 @@
 A connection to VirtualBox via VBoxManage.
 """
 
+import os
 import subprocess
 import time
 
+import eventlet
+from eventlet import greenpool
 from oslo_config import cfg
 from oslo_serialization import jsonutils
+from oslo_utils import importutils
+import six
 
 from neutron.i18n import _LW
 from neutron.openstack.common import log as logging
 from neutron.plugins.virtualbox.common import constants
 from neutron.plugins.virtualbox.common import exception
+from neutron.plugins.virtualbox.common import metrics
+from neutron.plugins.virtualbox.common import utils
+
+# The VirtualBox Python API is shipped with the VirtualBox SDK
+vbox_sdk = importutils.try_import('vboxapi')
 
 LOG = logging.getLogger(__name__)
 VIRTUAL_BOX = [
@@ -34,7 +44,21 @@ VIRTUAL_BOX = [
                help='The number of times to retry to execute command.'),
     cfg.IntOpt('retry_interval',
                default=1,
-               help='Interval between execute attempts, in seconds'),
+               help='Interval between execute attempts, in seconds. It is '
+                    'doubled after every attempt.'),
+    cfg.IntOpt('max_retry_interval',
+               default=8,
+               help='The maximum interval between execute attempts, in '
+                    'seconds.'),
+    cfg.IntOpt('breaker_threshold',
+               default=5,
+               help='The number of consecutive commands which fail with a '
+                    'transient error before VirtualBox is considered '
+                    'unavailable and the commands are no longer executed.'),
+    cfg.IntOpt('breaker_timeout',
+               default=30,
+               help='The number of seconds to wait before trying again to '
+                    'use a VirtualBox which is unavailable.'),
     cfg.StrOpt('vboxmanage_cmd',
                default="VBoxManage",
                help='Path of VBoxManage command which is used comunicate'
@@ -45,12 +69,171 @@ VIRTUAL_BOX = [
                     'the guest.'),
     cfg.BoolOpt('use_local_network',
                 default=False,
-                help='Use host-only network instead of bridge.')
+                help='Use host-only network instead of bridge.'),
+    cfg.BoolOpt('cache_vm_info',
+                default=True,
+                help='Reuse the information regarding a virtual machine '
+                     'while its settings file is unchanged.'),
+    cfg.IntOpt('inspect_workers',
+               default=4,
+               help='The maximum number of virtual machines inspected '
+                    'concurrently.'),
+    cfg.StrOpt('backend',
+               default='vboxmanage',
+               choices=['vboxmanage', 'api'],
+               help='The way used to communicate with VirtualBox: '
+                    '`vboxmanage` spawns a VBoxManage process for every '
+                    'command, `api` keeps a connection to VBoxSVC using the '
+                    'VirtualBox Python API.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
 
+_VBOX_MANAGER = None
+_CIRCUIT_BREAKER = None
+
+
+def _vbox_call(command):
+    """Count a command sent to VirtualBox and measure its duration."""
+    metrics.METRICS.increment("vbox.calls")
+    return metrics.METRICS.timer("vbox.%s" % command)
+
+
+def get_circuit_breaker():
+    """Return the circuit breaker shared by all the VirtualBox commands
+    executed on this host.
+    """
+    global _CIRCUIT_BREAKER
+    if _CIRCUIT_BREAKER is None:
+        _CIRCUIT_BREAKER = utils.CircuitBreaker(
+            CONF.virtualbox.breaker_threshold,
+            CONF.virtualbox.breaker_timeout)
+    return _CIRCUIT_BREAKER
+
+
+def is_transient_error(stderr):
+    """Test whether the error is expected to go away on retry."""
+    return bool(stderr) and any(error in stderr for error in
+                                constants.VBOX_TRANSIENT_ERRORS)
+
+
+def get_vbox_manager():
+    """Return the VirtualBox Python API manager shared by the agent."""
+    global _VBOX_MANAGER
+    if vbox_sdk is None:
+        raise exception.VBoxException(
+            msg="The VirtualBox Python API is not available.")
+    if _VBOX_MANAGER is None:
+        _VBOX_MANAGER = vbox_sdk.VirtualBoxManager(None, None)
+    return _VBOX_MANAGER
+
+
+class NetworkAdapter(object):
+
+    """The compact record of a network adapter of a virtual machine.
+
+    The fields reported by `showvminfo` (see `constants.NETWORK_FIELDS`)
+    are stored as attributes, but they can also be accessed like the
+    items of a dictionary.
+    """
+
+    __slots__ = ("index", "instance", "state") + constants.NETWORK_FIELDS
+
+    def __init__(self, index, **fields):
+        self.index = index
+        self.instance = None
+        self.state = None
+        for field in constants.NETWORK_FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        try:
+            setattr(self, field, value)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __eq__(self, other):
+        return (isinstance(other, NetworkAdapter) and
+                self.items() == other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "NetworkAdapter(%s)" % ", ".join(
+            "%s=%r" % item for item in self.items())
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def update(self, fields):
+        for field, value in fields.items():
+            self[field] = value
+
+    def items(self):
+        """Return the fields which are set."""
+        return [(field, getattr(self, field)) for field in self.__slots__
+                if getattr(self, field) is not None]
+
+
+# The virtual machine fields from `showvminfo` used by the agent
+VM_INFO_FIELDS = frozenset((constants.VM_DESCRIPTION, constants.VM_STATE,
+                            constants.VM_CFG_FILE))
+# The first letters of the fields used by the agent, the other lines of
+# the `showvminfo` output are skipped without being split.
+_VM_INFO_INITIALS = frozenset(field[0] for field in
+                              VM_INFO_FIELDS.union(constants.NETWORK_FIELDS))
+
+
+def parse_vm_info(output):
+    """Parse the output of `showvminfo --machinereadable`.
+
+    The output is parsed in a single pass and only the fields required by
+    the agent are kept. The fields of the network adapters are gathered in
+    a :class:`NetworkAdapter` record for each enabled adapter, available
+    under `constants.VM_NICS`.
+    """
+    nics = {}
+    information = {constants.VM_NICS: {}}
+    for line in output.splitlines():
+        initial = line[:1]
+        if initial == '"':
+            initial = line[1:2]
+        if initial not in _VM_INFO_INITIALS:
+            continue
+
+        key, separator, value = line.partition("=")
+        if not separator:
+            continue
+        key = key.strip(' "')
+        if key in VM_INFO_FIELDS:
+            value = value.strip(' "\r')
+            information[key] = value if value != "none" else None
+            continue
+
+        field = key.rstrip("0123456789")
+        if field != key and field in constants.NETWORK_FIELDS:
+            value = value.strip(' "\r')
+            nics.setdefault(key[len(field):], {})[field] = (
+                value if value != "none" else None)
+
+    for index, fields in nics.items():
+        if fields.get(constants.NIC_MODE) is None:
+            # The network adapter is disabled
+            continue
+        information[constants.VM_NICS][index] = NetworkAdapter(index,
+                                                               **fields)
+
+    return information
+
 
 class VBoxManage(object):
 
@@ -63,35 +246,63 @@ class VBoxManage(object):
 
     @classmethod
     def _execute(cls, *args):
-        """Run received command and return the output."""
+        """Run received command and return the output.
+
+        The commands which fail with a transient error are retried with
+        an exponential backoff. When too many commands in a row fail,
+        the commands are rejected for a while with
+        :class:`exception.VBoxUnavailable`, in order to give VBoxSVC a
+        chance to recover.
+        """
+        method = args[0] if args else None
+        breaker = get_circuit_breaker()
+        if not breaker.allow():
+            metrics.METRICS.increment("vbox.rejected")
+            raise exception.VBoxUnavailable(
+                method=method, reason="too many failed commands")
+
         command = [CONF.virtualbox.vboxmanage_cmd, "--nologo"]
         command.extend(args)
         LOG.debug("Execute: %s", command)
         stdout, stderr = None, None
-        for _ in range(CONF.virtualbox.retry_count):
-            try:
-                process = subprocess.Popen(
-                    command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                    universal_newlines=True)
-            except subprocess.CalledProcessError as exc:
-                stderr = exc.output
-            else:
-                stdout, stderr = process.communicate()
+        retry_count = CONF.virtualbox.retry_count
+        with _vbox_call(method):
+            for attempt in range(retry_count):
+                try:
+                    process = subprocess.Popen(
+                        command, stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE, universal_newlines=True)
+                except subprocess.CalledProcessError as exc:
+                    stderr = exc.output
+                else:
+                    stdout, stderr = process.communicate()
 
-            if stderr and constants.VBOX_E_ACCESSDENIED in stderr:
-                LOG.warning(_LW("Something went wrong, trying again."))
-                time.sleep(CONF.virtualbox.retry_interval)
-                continue
+                if not is_transient_error(stderr):
+                    breaker.record_success()
+                    break
 
-            break
-        else:
-            LOG.warning(_LW("Failed to process command."))
+                if attempt + 1 < retry_count:
+                    delay = utils.backoff_delay(
+                        attempt, CONF.virtualbox.retry_interval,
+                        CONF.virtualbox.max_retry_interval)
+                    LOG.warning(_LW("Something went wrong, trying again "
+                                    "in %(delay).2f seconds."),
+                                {"delay": delay})
+                    metrics.METRICS.increment("vbox.retries")
+                    time.sleep(delay)
+            else:
+                LOG.warning(_LW("Failed to process command."))
+                metrics.METRICS.increment("vbox.failures")
+                breaker.record_failure()
 
         return (stdout, stderr)
 
     @classmethod
     def _check_stderr(cls, stderr, instance=None, method=None):
         # TODO(alexandrucoman): Check for another common exceptions
+        if is_transient_error(stderr):
+            raise exception.VBoxUnavailable(method=method, reason=stderr)
+
         if constants.VBOX_E_INSTANCE_NOT_FOUND in stderr:
             raise exception.InstanceNotFound(instance=instance)
 
@@ -121,8 +332,11 @@ class VBoxManage(object):
 
     @classmethod
     def show_vm_info(cls, instance):
-        """Show the configuration of a particular VM."""
-        information = {}
+        """Show the configuration of a particular VM.
+
+        Only the fields required by the agent are returned, see
+        :func:`parse_vm_info`.
+        """
         output, error = cls._execute(cls.SHOW_VM_INFO, instance,
                                      "--machinereadable")
         if error:
@@ -130,21 +344,7 @@ class VBoxManage(object):
             raise exception.VBoxManageError(method=cls.SHOW_VM_INFO,
                                             reason=error)
 
-        for line in output.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-
-            key, separator, value = line.partition("=")
-            value = value.strip(' "')
-            key = key.strip(' "')
-            if separator != "=":
-                LOG.warning("Could not parse the following line: %s", line)
-                continue
-
-            information[key] = value if value != "none" else None
-
-        return information
+        return parse_vm_info(output)
 
     @classmethod
     def modify_network(cls, instance, index, fields):
@@ -163,11 +363,23 @@ class VBoxManage(object):
                                     interface
             :FILED_MAC_ADDRESS:     MAC address of the virtual network card
         """
+        cls.modify_networks(instance, [(index, fields)])
+
+    @classmethod
+    def modify_networks(cls, instance, networks):
+        """Change the settings of multiple network adapters using a
+        single `modifyvm` command.
+
+        :param instance:
+        :param networks: a list of (index, fields) pairs, using the same
+                         fields as :meth:`modify_network`.
+        """
         command = [cls.MODIFY_VM, instance]
-        for field, value in fields:
-            command.append(field % {"index": index})
-            if value:
-                command.append(value)
+        for index, fields in networks:
+            for field, value in fields:
+                command.append(field % {"index": index})
+                if value:
+                    command.append(value)
 
         _, error = cls._execute(*command)
         if error:
@@ -195,24 +407,327 @@ class VBoxManage(object):
             raise exception.VBoxManageError(method="controlvm", reason=error)
 
 
+class VBoxAPI(object):
+
+    """Wrapper over the VirtualBox Python API.
+
+    It exposes the same interface as :class:`VBoxManage` and produces the
+    same output, but it keeps a connection to VBoxSVC instead of spawning
+    a new VBoxManage process for every command.
+    """
+
+    CONTROL_VM = VBoxManage.CONTROL_VM
+    LIST = VBoxManage.LIST
+    SHOW_VM_INFO = VBoxManage.SHOW_VM_INFO
+    MODIFY_VM = VBoxManage.MODIFY_VM
+
+    # The names used by `showvminfo --machinereadable` for the values
+    # which are not just the lowercase version of the API enum names.
+    _VM_STATES = {'PoweredOff': constants.POWER_OFF,
+                  'Stuck': 'gurumeditation'}
+    _NIC_MODES = {'Null': constants.NIC_MODE_NULL,
+                  'NAT': constants.NIC_MODE_NAT,
+                  'Bridged': constants.NIC_MODE_BRIDGED,
+                  'Internal': constants.NIC_MODE_INTNET,
+                  'HostOnly': constants.NIC_MODE_HOSTONLY,
+                  'Generic': constants.NIC_MODE_GENERIC}
+    _NIC_TYPES = {'I82540EM': constants.NIC_TYPE_82540EM,
+                  'I82543GC': constants.NIC_TYPE_82543GC,
+                  'I82545EM': constants.NIC_TYPE_82545EM,
+                  'Virtio': constants.NIC_TYPE_VIRTIO}
+
+    def __init__(self):
+        self._manager = get_vbox_manager()
+        self._virtualbox = self._manager.getVirtualBox()
+        self._constants = self._manager.constants
+
+    def _enum(self, enum, names):
+        """Return a map between the API values of the received enum and
+        the names used by VBoxManage.
+        """
+        return dict((value, names.get(name, name.lower()))
+                    for name, value in
+                    self._constants.all_values(enum).items())
+
+    def _find_machine(self, instance):
+        try:
+            return self._virtualbox.findMachine(instance)
+        except Exception:
+            raise exception.InstanceNotFound(instance=instance)
+
+    def _machines(self):
+        return self._manager.getArray(self._virtualbox, 'machines')
+
+    def list(self, information):
+        """Gives the same information as `VBoxManage list`.
+
+        Only the :VMS_INFO: and :RUNNINGVMS_INFO: are available.
+        """
+        if information == constants.VMS_INFO:
+            states = None
+        elif information == constants.RUNNINGVMS_INFO:
+            states = (self._constants.MachineState_Running,
+                      self._constants.MachineState_Paused)
+        else:
+            raise exception.VBoxManageError(
+                method=self.LIST,
+                reason="Unsupported information %s" % information)
+
+        try:
+            with _vbox_call(self.LIST):
+                output = []
+                for machine in self._machines():
+                    if states and machine.state not in states:
+                        continue
+                    output.append('"%s" {%s}' % (machine.name, machine.id))
+        except Exception as exc:
+            raise exception.VBoxManageError(method=self.LIST, reason=exc)
+
+        return "\n".join(output)
+
+    def show_vm_info(self, instance):
+        """Show the configuration of a particular VM."""
+        with _vbox_call(self.SHOW_VM_INFO):
+            return self._show_vm_info(instance)
+
+    def _show_vm_info(self, instance):
+        machine = self._find_machine(instance)
+        nic_modes = self._enum('NetworkAttachmentType', self._NIC_MODES)
+        nic_types = self._enum('NetworkAdapterType', self._NIC_TYPES)
+        vm_states = self._enum('MachineState', self._VM_STATES)
+
+        try:
+            nics = {}
+            information = {
+                constants.VM_DESCRIPTION: machine.description or None,
+                constants.VM_STATE: vm_states.get(machine.state),
+                constants.VM_CFG_FILE: machine.settingsFilePath,
+                constants.VM_NICS: nics,
+            }
+            slots = self._virtualbox.systemProperties.getMaxNetworkAdapters(
+                machine.chipsetType)
+            for slot in range(slots):
+                adapter = machine.getNetworkAdapter(slot)
+                if not adapter.enabled:
+                    continue
+
+                index = str(slot + 1)
+                nic_mode = nic_modes.get(adapter.attachmentType)
+                nic = NetworkAdapter(index)
+                nic.nic = nic_mode
+                nic.nictype = nic_types.get(adapter.adapterType)
+                nic.macaddress = adapter.MACAddress
+                nic.cableconnected = (constants.ON if adapter.cableConnected
+                                      else constants.OFF)
+                nic.nicspeed = str(adapter.lineSpeed)
+                if nic_mode == constants.NIC_MODE_BRIDGED:
+                    nic.bridgeadapter = adapter.bridgedInterface
+                elif nic_mode == constants.NIC_MODE_HOSTONLY:
+                    nic.hostonlyadapter = adapter.hostOnlyInterface
+                nics[index] = nic
+        except Exception as exc:
+            raise exception.VBoxManageError(method=self.SHOW_VM_INFO,
+                                            reason=exc)
+
+        return information
+
+    def _set_adapter_field(self, adapter, field, value):
+        """Apply a VBoxManage network field on the received adapter."""
+        if field in (constants.FIELD_NIC_MODE, constants.FIELD_NIC):
+            nic_modes = self._enum('NetworkAttachmentType', self._NIC_MODES)
+            modes = dict((name, key) for key, name in nic_modes.items())
+            adapter.enabled = True
+            adapter.attachmentType = modes[value]
+        elif field == constants.FIELD_NIC_TYPE:
+            nic_types = self._enum('NetworkAdapterType', self._NIC_TYPES)
+            types = dict((name, key) for key, name in nic_types.items())
+            adapter.adapterType = types[value]
+        elif field in (constants.FIELD_CABLE_CONNECTED,
+                       constants.FIELD_LINK_STATE):
+            adapter.cableConnected = (value == constants.ON)
+        elif field == constants.FIELD_BRIDGE_ADAPTER:
+            adapter.bridgedInterface = value
+        elif field == constants.FIELD_HOSTONLY_ADAPTER:
+            adapter.hostOnlyInterface = value
+        elif field == constants.FILED_MAC_ADDRESS:
+            adapter.MACAddress = value
+        else:
+            raise ValueError("Unsupported field %s" % field)
+
+    def _change_network(self, method, instance, lock_type, networks):
+        """Lock the machine and apply the fields on the adapters."""
+        machine = self._find_machine(instance)
+        session = self._manager.getSessionObject(self._virtualbox)
+        try:
+            machine.lockMachine(session, lock_type)
+        except Exception as exc:
+            raise exception.InstanceInvalidState(
+                instance=instance, method=method, details=exc)
+
+        try:
+            for index, fields in networks:
+                adapter = session.machine.getNetworkAdapter(int(index) - 1)
+                for field, value in fields:
+                    self._set_adapter_field(adapter, field, value)
+            session.machine.saveSettings()
+        except Exception as exc:
+            raise exception.VBoxManageError(method=method, reason=exc)
+        finally:
+            session.unlockMachine()
+
+    def modify_network(self, instance, index, fields):
+        """Change the network settings for a registered virtual machine.
+
+        The same fields as :meth:`VBoxManage.modify_network` are
+        available.
+        """
+        self.modify_networks(instance, [(index, fields)])
+
+    def modify_networks(self, instance, networks):
+        """Change the settings of multiple network adapters while the
+        virtual machine is locked only once.
+        """
+        with _vbox_call(self.MODIFY_VM):
+            self._change_network(self.MODIFY_VM, instance,
+                                 self._constants.LockType_Write, networks)
+
+    def update_network(self, instance, index, field, value):
+        """Update configuration of a virtual machine that is currently
+        running.
+
+        The same fields as :meth:`VBoxManage.update_network` are
+        available.
+        """
+        fields = [(field, value[0])]
+        if field == constants.FIELD_NIC and len(value) > 1:
+            nic_mode = value[0]
+            if nic_mode == constants.NIC_MODE_BRIDGED:
+                fields.append((constants.FIELD_BRIDGE_ADAPTER, value[1]))
+            elif nic_mode == constants.NIC_MODE_HOSTONLY:
+                fields.append((constants.FIELD_HOSTONLY_ADAPTER, value[1]))
+
+        with _vbox_call(self.CONTROL_VM):
+            self._change_network(self.CONTROL_VM, instance,
+                                 self._constants.LockType_Shared,
+                                 [(index, fields)])
+
+
+def get_backend():
+    """Return the wrapper used in order to communicate with VirtualBox."""
+    if CONF.virtualbox.backend == 'api':
+        try:
+            return VBoxAPI()
+        except Exception as error:
+            LOG.warning(_LW("Failed to connect to VirtualBox using the "
+                            "Python API, falling back to VBoxManage: "
+                            "%(error)s"), {"error": error})
+    return VBoxManage()
+
+
+class DeviceIndex(object):
+
+    """A two-way index between the ports and the NICs of the virtual
+    machines.
+
+    The index is updated one virtual machine at a time. A port or a MAC
+    address claimed by more than one virtual machine stays assigned to
+    the first one which claimed it.
+    """
+
+    def __init__(self):
+        self._ports = {}        # port id -> NetworkAdapter
+        self._macs = {}         # MAC address -> port id
+        self._instances = {}    # instance name -> set of port ids
+        self.collisions = 0
+
+    def __contains__(self, port_id):
+        return port_id in self._ports
+
+    def __len__(self):
+        return len(self._ports)
+
+    def get(self, port_id, default=None):
+        """Return the NIC used by the received port."""
+        return self._ports.get(port_id, default)
+
+    def port_by_mac(self, mac_address):
+        """Return the id of the port which uses the MAC address."""
+        return self._macs.get(mac_address)
+
+    def ports(self):
+        """Return a set with the ids of all the indexed ports."""
+        return set(self._ports)
+
+    def instances(self):
+        """Return a set with the names of the indexed instances."""
+        return set(self._instances)
+
+    def instance_ports(self, instance_name):
+        """Return a set with the ids of the ports used by an instance."""
+        return set(self._instances.get(instance_name, ()))
+
+    def remove_instance(self, instance_name):
+        """Remove all the ports which belong to the received instance."""
+        for port_id in self._instances.pop(instance_name, ()):
+            nic = self._ports.pop(port_id)
+            self._macs.pop(nic.macaddress, None)
+
+    def update_instance(self, instance_name, devices):
+        """Replace the ports which belong to the received instance.
+
+        :param devices: a dictionary which maps the port id to the NIC
+        :returns: a set with the ids of the ports which are already
+                  used by other instances
+        """
+        self.remove_instance(instance_name)
+        ports, conflicts = set(), set()
+        for port_id, nic in devices.items():
+            owner = self._ports.get(port_id)
+            if owner is None and nic.macaddress in self._macs:
+                owner = self._ports[self._macs[nic.macaddress]]
+            if owner is not None:
+                LOG.warning(_LW("The port %(port_id)s (%(mac)s) of "
+                                "`%(instance)s` is already used by "
+                                "`%(owner)s`"),
+                            {"port_id": port_id, "mac": nic.macaddress,
+                             "instance": instance_name,
+                             "owner": owner.instance})
+                self.collisions += 1
+                conflicts.add(port_id)
+                continue
+
+            self._ports[port_id] = nic
+            self._macs[nic.macaddress] = port_id
+            ports.add(port_id)
+
+        if ports:
+            self._instances[instance_name] = ports
+        return conflicts
+
+
 class VBoxNetworkManage(object):
 
     def __init__(self):
-        self._nic = {}
-        self._device_map = {}
+        self._devices = DeviceIndex()
+        self._inspected = {}
+        self._vm_info = {}
+        # The names of the running virtual machines during a full scan
+        self._running_instances = None
+        self._cache_stats = {"hits": 0, "misses": 0}
+        self._setup_stats = {"applied": 0, "skipped": 0}
         self._local_network = CONF.virtualbox.use_local_network
-        self._vbox = VBoxManage()
+        self._vbox = get_backend()
 
     @property
     def local_network(self):
         """Test whether a NIC should be Host Only."""
         return self._local_network
 
-    def _instances(self):
-        """Return the names for all virtual machines currently
-        registered with VirtualBox.
+    def _list_instances(self, information):
+        """Return the names of the virtual machines listed by
+        `VBoxManage list` for the received information.
         """
-        list_vms = self._vbox.list(constants.VMS_INFO)
+        list_vms = self._vbox.list(information)
         for virtual_machine in list_vms.splitlines():
             # Line format: "instance_name" {instance_uuid}
             try:
@@ -221,137 +736,539 @@ class VBoxNetworkManage(object):
                 continue
             yield name.strip('"')
 
+    def _instances(self):
+        """Return the names for all virtual machines currently
+        registered with VirtualBox.
+        """
+        return self._list_instances(constants.VMS_INFO)
+
     def _process_description(self, description):
         """Get information regarding network from the virtual machine
         description.
+
+        Returns a dictionary which maps the MAC addresses to the port
+        ids or None if the description is invalid.
         """
         if not description:
-            return False
+            return None
         try:
-            description = jsonutils.loads(description)["network"]
-        except (ValueError, KeyError) as error:
+            network = jsonutils.loads(description)["network"]
+        except (ValueError, KeyError, TypeError) as error:
             LOG.debug("Failed to load information from description: %(error)s",
                       {"error": error})
+            return None
+
+        if not isinstance(network, dict):
+            return None
+        return network
+
+    @staticmethod
+    def _settings_signature(instance_info):
+        """Return the size and the modification time of the settings
+        file for the received virtual machine.
+        """
+        cfg_file = instance_info.get(constants.VM_CFG_FILE)
+        if not cfg_file:
+            return None
+
+        try:
+            stat = os.stat(cfg_file)
+        except OSError:
+            return None
+
+        return (stat.st_mtime, stat.st_size)
+
+    def _state_changed(self, instance_name, instance_info):
+        """Test whether a virtual machine was started or stopped since
+        its configuration was cached: the power state changes do not
+        touch the settings file.
+        """
+        if self._running_instances is None:
             return False
+        running = (instance_info.get(constants.VM_STATE) in
+                   constants.RUNNING_STATES)
+        return running != (instance_name in self._running_instances)
 
-        for mac_address, device_id in description.items():
-            self._device_map[mac_address] = device_id
+    def _get_vm_info(self, instance_name):
+        """Return the configuration of the received virtual machine.
 
-        return True
+        The output of `showvminfo` is reused while the settings file of
+        the virtual machine is unchanged and, during the full scans, while
+        the virtual machine is still running or still stopped.
+        """
+        cached = self._vm_info.get(instance_name)
+        if cached:
+            signature, instance_info = cached
+            if (signature == self._settings_signature(instance_info) and
+                    not self._state_changed(instance_name, instance_info)):
+                self._cache_stats["hits"] += 1
+                return instance_info
+
+        self._cache_stats["misses"] += 1
+        instance_info = self._vbox.show_vm_info(instance_name)
+        signature = self._settings_signature(instance_info)
+        if CONF.virtualbox.cache_vm_info and signature:
+            self._vm_info[instance_name] = (signature, instance_info)
+        else:
+            self._vm_info.pop(instance_name, None)
+
+        return instance_info
+
+    def cache_statistics(self):
+        """Return the hit / miss counters for the virtual machines
+        information cache.
+        """
+        statistics = dict(self._cache_stats)
+        statistics["size"] = len(self._vm_info)
+        return statistics
 
-    def _inspect_instance(self, instance_name):
-        """Get the network information from an instance."""
-        network = {}
+    def _fetch_instance(self, instance_name):
+        """Get the configuration of an instance.
+
+        Returns the name of the instance and its configuration. The
+        configuration is empty if the instance no longer exists and None
+        if it could not be obtained. The errors are not propagated in
+        order to not affect the inspection of the other instances.
+        """
         try:
-            instace_info = self._vbox.show_vm_info(instance_name)
+            return instance_name, self._get_vm_info(instance_name)
         except exception.InstanceNotFound:
             LOG.warning(_LW("Failed to get specification for `%(instance)s`"),
                         {"instance": instance_name})
+            self._vm_info.pop(instance_name, None)
+            return instance_name, {}
+        except exception.VBoxManageError as error:
+            LOG.warning(_LW("Failed to inspect `%(instance)s`: %(error)s"),
+                        {"instance": instance_name, "error": error})
+            return instance_name, None
+
+    def _fetch_instances(self, instances):
+        """Get the configuration for all the received instances, using
+        at most `inspect_workers` concurrent requests.
+        """
+        workers = CONF.virtualbox.inspect_workers
+        if workers <= 1:
+            return six.moves.map(self._fetch_instance, instances)
+
+        pool = greenpool.GreenPool(workers)
+        return pool.imap(self._fetch_instance, instances)
+
+    def _inspect_instance(self, instance_name, instace_info):
+        """Get the network information from an instance.
+
+        Only the received instance is updated in the device index. The
+        description is decoded again only if it was changed.
+        """
+        inspected = self._inspected.get(instance_name)
+        if inspected and inspected[0] is instace_info:
+            # The instance was not changed since the last inspection
             return
 
         description = instace_info.get(constants.VM_DESCRIPTION)
-        if not self._process_description(description):
+        if inspected and inspected[1] == description:
+            mac_map = inspected[2]
+        else:
+            mac_map = self._process_description(description)
+        if mac_map is None:
             LOG.warning(_LW("Invalid description for `%(instance)s`: "
                             "%(description)s"),
                         {"instance": instance_name,
                          "description": description})
+            self._forget_instance(instance_name)
             return
 
-        for field, value in instace_info.items():
-            if field[:-1] in constants.NETWORK_FIELDS:
-                network.setdefault(field[-1], {})[field[:-1]] = value
-
-        for nic_index in network:
-            mac_address = network[nic_index].get(constants.MAC_ADDRESS)
-            device_id = self._device_map.get(mac_address)
-            nic_mode = network[nic_index].get(constants.NIC_MODE)
-
-            if device_id and nic_mode != constants.NIC_MODE_NONE:
-                self._nic[device_id] = network[nic_index]
-                self._nic[device_id]["index"] = nic_index
-                self._nic[device_id]["instance"] = instance_name
-                self._nic[device_id]["state"] = instace_info.get(
-                    constants.VM_STATE)
-
-    def refresh(self):
-        """Update internal database."""
-        self._nic.clear()
-        self._device_map.clear()
-        for instance_name in self._instances():
-            self._inspect_instance(instance_name)
+        devices = {}
+        for nic in instace_info.get(constants.VM_NICS, {}).values():
+            device_id = mac_map.get(nic.macaddress)
+            if device_id and nic.nic != constants.NIC_MODE_NONE:
+                nic.instance = instance_name
+                nic.state = instace_info.get(constants.VM_STATE)
+                devices[device_id] = nic
+
+        if self._devices.update_instance(instance_name, devices):
+            # Inspect the instance again after the conflicts are solved
+            self._inspected.pop(instance_name, None)
+        else:
+            self._inspected[instance_name] = (instace_info, description,
+                                              mac_map)
+
+    def _forget_instance(self, instance_name):
+        """Remove all the information regarding the received instance."""
+        self._devices.remove_instance(instance_name)
+        self._inspected.pop(instance_name, None)
+
+    @metrics.METRICS.timed("network.refresh")
+    def refresh(self, instances=None):
+        """Update internal database.
+
+        :param instances: the names of the virtual machines that should be
+                          inspected again. If it is missing, all the
+                          registered virtual machines will be inspected.
+
+        .. note:
+            The instances are inspected concurrently, but the results are
+            merged in the internal database one by one. If an instance
+            could not be inspected its last known state is kept.
+        """
+        if instances is None:
+            instances = list(self._instances())
+            # Evict the virtual machines that are no longer registered
+            for instance_name in set(self._vm_info) - set(instances):
+                del self._vm_info[instance_name]
+            known_instances = (self._devices.instances() |
+                               set(self._inspected))
+            for instance_name in known_instances - set(instances):
+                self._forget_instance(instance_name)
+            if self._vm_info:
+                # A single call tells which cached states are out of date
+                self._running_instances = set(self._list_instances(
+                    constants.RUNNINGVMS_INFO))
+        else:
+            for instance_name in instances:
+                self._vm_info.pop(instance_name, None)
+
+        try:
+            for instance_name, instance_info in self._fetch_instances(
+                    instances):
+                if instance_info is None:
+                    continue
+                if instance_info:
+                    self._inspect_instance(instance_name, instance_info)
+                else:
+                    self._forget_instance(instance_name)
+        finally:
+            self._running_instances = None
 
     def device_exists(self, device_id):
         """Test whether a device exists."""
-        return device_id in self._nic
+        return device_id in self._devices
 
     def devices(self):
         """Return a set with device id for all the devices."""
-        return set(self._nic.keys())
+        return self._devices.ports()
 
-    def _modify_network(self, device, physical_network):
-        """Changes the network properties of a registered virtual machine.
+    def get_device(self, device_id):
+        """Return the NIC used by the received device or None."""
+        return self._devices.get(device_id)
 
-        .. note:
-            The virtual machine must be powered off.
+    def instance_devices(self, instance_name):
+        """Return a set with the ids of the devices used by an instance."""
+        return self._devices.instance_ports(instance_name)
+
+    def index_statistics(self):
+        """Return the size of the device index and the number of ports
+        claimed by more than one virtual machine.
         """
+        return {"devices": len(self._devices),
+                "instances": len(self._devices.instances()),
+                "collisions": self._devices.collisions}
 
+    def _get_nic_mode(self):
+        """Return the adapter field and the NIC mode used for the devices."""
         if self.local_network:
             # Use host-only adaptor for this NIC
-            adapter = constants.FIELD_HOSTONLY_ADAPTER
-            nic_mode = constants.NIC_MODE_HOSTONLY
-        else:
-            # Use bridge adaptor for this NIC
-            adapter = constants.FIELD_BRIDGE_ADAPTER
-            nic_mode = constants.NIC_MODE_BRIDGED
-
-        # Set networking hardware
-        self._vbox.modify_network(
-            device["instance"], device["index"],
-            [
+            return (constants.FIELD_HOSTONLY_ADAPTER,
+                    constants.NIC_MODE_HOSTONLY)
+
+        # Use bridge adaptor for this NIC
+        return constants.FIELD_BRIDGE_ADAPTER, constants.NIC_MODE_BRIDGED
+
+    def _desired_state(self, device, physical_network, connected=True):
+        """Return the NIC fields, as reported by `showvminfo`, which
+        the received device should have.
+        """
+        _, nic_mode = self._get_nic_mode()
+        adapter = (constants.HOSTONLY_ADAPTER if self.local_network
+                   else constants.BRIDGE_ADAPTER)
+        state = {
+            constants.NIC_MODE: nic_mode,
+            adapter: physical_network,
+            constants.IS_CONNECTED: (constants.ON if connected
+                                     else constants.OFF),
+        }
+        if device["state"] == constants.POWER_OFF:
+            # The network hardware can be changed only while the
+            # virtual machine is powered off
+            state[constants.NIC_TYPE] = CONF.virtualbox.nic_type
+        return state
+
+    def setup_statistics(self):
+        """Return the number of devices which were configured and the
+        number of devices which already had the desired configuration.
+        """
+        return dict(self._setup_stats)
+
+    def _modify_network(self, instance, devices):
+        """Changes the network properties of a registered virtual machine.
+
+        :param instance:    the name of the virtual machine
+        :param devices:     a list of (device, physical_network, connected)
+                            tuples
+
+        .. note:
+            The virtual machine must be powered off.
+        """
+        adapter, nic_mode = self._get_nic_mode()
+        networks = []
+        for device, physical_network, connected in devices:
+            # Set networking hardware
+            networks.append((device["index"], [
                 (constants.FIELD_NIC_TYPE, CONF.virtualbox.nic_type),
                 (constants.FIELD_NIC_MODE, nic_mode),
                 (adapter, physical_network),
-                (constants.FIELD_CABLE_CONNECTED, constants.ON)
-            ])
+                (constants.FIELD_CABLE_CONNECTED,
+                 constants.ON if connected else constants.OFF)
+            ]))
+
+        self._vbox.modify_networks(instance, networks)
 
-    def _update_network(self, device, physical_network):
+    def _update_network(self, device, physical_network, connected=True):
         """Change the network settings for a virtual machine.
 
+        Only the settings which differ from the desired ones are changed.
+
         ..note:
              The virtual machine can be currently running.
         """
-        if self.local_network:
-            # Use Host Only NIC mode for this NIC
-            nic_mode = constants.NIC_MODE_HOSTONLY
-        else:
-            # Use Bridge mode for this NIC
-            nic_mode = constants.NIC_MODE_BRIDGED
+        _, nic_mode = self._get_nic_mode()
+        desired_state = self._desired_state(device, physical_network,
+                                            connected)
+        link_state = desired_state.pop(constants.IS_CONNECTED)
+        desired_state.pop(constants.NIC_TYPE, None)
+        if any(device.get(field) != value
+               for field, value in desired_state.items()):
+            self._vbox.update_network(
+                instance=device["instance"], index=device["index"],
+                field=constants.FIELD_NIC,
+                value=(nic_mode, physical_network))
 
-        self._vbox.update_network(
-            instance=device["instance"], index=device["index"],
-            field=constants.FIELD_NIC,
-            value=(nic_mode, physical_network))
+        if device.get(constants.IS_CONNECTED) == link_state:
+            # The cable is already in the desired state
+            return
 
         self._vbox.update_network(
             instance=device["instance"], index=device["index"],
             field=constants.FIELD_LINK_STATE,
-            value=(constants.ON,))
+            value=(link_state,))
 
-    def setup_device(self, port_id, physical_network):
-        """Connect the device to the specific interface."""
-        device = self._nic.get(port_id)
-        if not device:
-            return
+    def setup_devices(self, devices, disconnected=()):
+        """Connect the devices to the specific interfaces.
+
+        The devices are grouped by instance, in order to use a single
+        `modifyvm` command for each virtual machine which is powered off.
+
+        :param devices:      a dictionary which maps the port id to the
+                             physical network
+        :param disconnected: the ids of the ports whose cable should be
+                             disconnected (the administratively down ports)
+        :returns: a dictionary with the errors for the devices which
+                  could not be configured
+        """
+        errors = {}
+        instances = {}
+        for port_id, physical_network in devices.items():
+            device = self._devices.get(port_id)
+            if not device:
+                continue
+            connected = port_id not in disconnected
+            desired_state = self._desired_state(device, physical_network,
+                                                connected)
+            if all(device.get(field) == value
+                   for field, value in desired_state.items()):
+                LOG.debug("The device %(port_id)s is already attached to "
+                          "%(network)s", {"port_id": port_id,
+                                          "network": physical_network})
+                self._setup_stats["skipped"] += 1
+                continue
+            instances.setdefault(device["instance"], []).append(
+                (port_id, device, physical_network, connected))
+
+        for instance_name, instance_devices in instances.items():
+            # The settings of the virtual machine will be changed
+            self._vm_info.pop(instance_name, None)
+            if instance_devices[0][1]["state"] == constants.POWER_OFF:
+                try:
+                    self._modify_network(
+                        instance_name,
+                        [instance_device[1:]
+                         for instance_device in instance_devices])
+                except exception.VBoxManageError as error:
+                    # Probably the instance status was changed
+                    LOG.debug("Failed to modify network for %(instance)s: "
+                              "%(error)s",
+                              {"instance": instance_name, "error": error})
+                else:
+                    for _, device, physical_network, connected in (
+                            instance_devices):
+                        self._device_configured(device, physical_network,
+                                                connected)
+                    continue
+
+            for port_id, device, physical_network, connected in (
+                    instance_devices):
+                try:
+                    self._update_network(device, physical_network, connected)
+                except exception.VBoxManageError as error:
+                    errors[port_id] = error
+                else:
+                    self._device_configured(device, physical_network,
+                                            connected)
+
+        return errors
+
+    def _device_configured(self, device, physical_network, connected=True):
+        """Record the configuration applied on the received device."""
+        device.update(self._desired_state(device, physical_network,
+                                          connected))
+        self._setup_stats["applied"] += 1
+
+    def disconnect_device(self, port_id):
+        """Disconnect the cable of the NIC used by the received device.
+
+        Returns False if the device is unknown or already disconnected.
+        """
+        device = self._devices.get(port_id)
+        if not device or device.get(constants.IS_CONNECTED) == constants.OFF:
+            return False
 
+        # The settings of the virtual machine will be changed
+        self._vm_info.pop(device["instance"], None)
         if device["state"] == constants.POWER_OFF:
             try:
-                self._modify_network(device, physical_network)
+                self._vbox.modify_network(
+                    device["instance"], device["index"],
+                    [(constants.FIELD_CABLE_CONNECTED, constants.OFF)])
             except exception.VBoxManageError as error:
                 # Probably the instance status was changed
-                LOG.debug("Failed to modify network for %(device)s: "
+                LOG.debug("Failed to modify network for %(instance)s: "
                           "%(error)s",
-                          {"device": device, "error": error})
+                          {"instance": device["instance"], "error": error})
             else:
-                return
+                device[constants.IS_CONNECTED] = constants.OFF
+                return True
+
+        self._vbox.update_network(
+            instance=device["instance"], index=device["index"],
+            field=constants.FIELD_LINK_STATE, value=(constants.OFF,))
+        device[constants.IS_CONNECTED] = constants.OFF
+        return True
+
+    def setup_device(self, port_id, physical_network):
+        """Connect the device to the specific interface."""
+        errors = self.setup_devices({port_id: physical_network})
+        if port_id in errors:
+            raise errors[port_id]
+
+
+class VBoxEventWatcher(object):
+
+    """Watch the changes of the virtual machines using the VirtualBox
+    event source.
+
+    The following events are tracked:
+        :OnMachineRegistered:   a virtual machine was registered or
+                                unregistered
+        :OnMachineStateChanged: the state of a virtual machine was changed
+        :OnMachineDataChanged:  the settings of a virtual machine were
+                                changed (including the network adapters)
+    """
+
+    # The interval (in seconds) between two polls of the event source.
+    # getEvent is a blocking XPCOM call which would freeze every green
+    # thread while it waits, so it is only called without timeout.
+    POLL_INTERVAL = 0.05
+
+    def __init__(self):
+        self._manager = None
+        self._virtualbox = None
+        self._event_source = None
+        self._listener = None
+        self._events = {}
+
+    @property
+    def active(self):
+        """Test whether the watcher is listening for events."""
+        return self._listener is not None
+
+    def start(self):
+        """Register a passive listener for the virtual machine events."""
+        self._manager = get_vbox_manager()
+        self._virtualbox = self._manager.getVirtualBox()
+        vbox_constants = self._manager.constants
+        self._events = {
+            vbox_constants.VBoxEventType_OnMachineRegistered:
+                'IMachineRegisteredEvent',
+            vbox_constants.VBoxEventType_OnMachineStateChanged:
+                'IMachineStateChangedEvent',
+            vbox_constants.VBoxEventType_OnMachineDataChanged:
+                'IMachineDataChangedEvent',
+        }
+
+        self._event_source = self._virtualbox.eventSource
+        self._listener = self._event_source.createListener()
+        self._event_source.registerListener(self._listener,
+                                            list(self._events), False)
+
+    def stop(self):
+        """Unregister the listener."""
+        if not self.active:
+            return
+
+        try:
+            self._event_source.unregisterListener(self._listener)
+        except Exception as error:
+            LOG.debug("Failed to unregister the listener: %(error)s",
+                      {"error": error})
+        finally:
+            self._listener = None
+            self._event_source = None
+
+    def _process_event(self, event, changes):
+        """Add the name of the affected virtual machine to `changes`.
+
+        Returns True if a full scan of the virtual machines is required.
+        """
+        interface = self._events.get(event.type)
+        if not interface:
+            return False
+
+        event = self._manager.queryInterface(event, interface)
+        if interface == 'IMachineRegisteredEvent' and not event.registered:
+            # The virtual machine is gone, its name cannot be obtained.
+            return True
+
+        try:
+            machine = self._virtualbox.findMachine(event.machineId)
+            changes.add(machine.name)
+        except Exception as error:
+            LOG.debug("Failed to find machine %(machine)s: %(error)s",
+                      {"machine": event.machineId, "error": error})
+            return True
+
+        return False
+
+    def wait(self, timeout):
+        """Wait at most `timeout` seconds for changes.
+
+        The method returns as soon as the pending events are processed.
+        The return value is a tuple containing the names of the changed
+        virtual machines and a flag which shows if a full scan is required.
+        """
+        changes, full_scan = set(), False
+        deadline = time.time() + timeout
+        while True:
+            event = self._event_source.getEvent(self._listener, 0)
+            if event is None:
+                remaining = deadline - time.time()
+                if changes or full_scan or remaining <= 0:
+                    break
+                # Let the other green threads run until the next poll.
+                eventlet.sleep(min(remaining, self.POLL_INTERVAL))
+                continue
+
+            try:
+                full_scan = self._process_event(event, changes) or full_scan
+            finally:
+                self._event_source.eventProcessed(self._listener, event)
 
-        self._update_network(device, physical_network)
+        return changes, full_scan
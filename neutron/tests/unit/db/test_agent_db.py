@@ -15,6 +15,7 @@
 
 import datetime
 import mock
+import time
 
 from oslo_db import exception as exc
 from oslo_utils import timeutils
@@ -143,6 +144,179 @@ class TestAgentsDbMixin(TestAgentsDbBase):
                              "Agent entry creation hasn't been retried")
 
 
+class TestAgentsDbCache(TestAgentsDbBase):
+    def setUp(self):
+        super(TestAgentsDbCache, self).setUp()
+        self.agent_status = {
+            'agent_type': constants.AGENT_TYPE_OVS,
+            'binary': 'neutron-openvswitch-agent',
+            'host': 'compute',
+            'topic': 'N/A',
+            'configurations': {'bridge_mappings': {'physnet1': 'br-eth1'}},
+        }
+
+    def _get_host_agents(self):
+        return self.plugin.get_host_agents(
+            self.context, constants.AGENT_TYPE_OVS, 'compute')
+
+    def test_get_host_agents_from_cache(self):
+        self.plugin.create_or_update_agent(self.context, self.agent_status)
+        with mock.patch.object(self.plugin, 'get_agents') as get_agents:
+            agents = self._get_host_agents()
+
+        self.assertFalse(get_agents.called)
+        self.assertEqual(1, len(agents))
+        self.assertTrue(agents[0]['alive'])
+        self.assertEqual(self.agent_status['configurations'],
+                         agents[0]['configurations'])
+
+    def test_get_host_agents_cache_miss(self):
+        self._create_and_save_agents(['compute'], constants.AGENT_TYPE_OVS)
+        with mock.patch.object(self.plugin, 'get_agents',
+                               wraps=self.plugin.get_agents) as get_agents:
+            self._get_host_agents()
+            agents = self._get_host_agents()
+
+        self.assertEqual(1, get_agents.call_count)
+        self.assertEqual('compute', agents[0]['host'])
+
+    def test_get_host_agents_not_found(self):
+        self.assertEqual([], self._get_host_agents())
+        self.assertEqual(0, len(self.plugin.agent_cache))
+
+    def test_get_host_agents_dead_agent(self):
+        self._create_and_save_agents(['compute'], constants.AGENT_TYPE_OVS,
+                                     down_agents_count=1)
+        self._get_host_agents()
+        self.assertFalse(self._get_host_agents()[0]['alive'])
+
+    def test_get_host_agents_cache_expired(self):
+        self.plugin.create_or_update_agent(self.context, self.agent_status)
+        with mock.patch.object(agents_db, 'time') as time_mock:
+            time_mock.time.return_value = time.time() + 3600
+            self.assertIsNone(self.plugin.agent_cache.get(
+                constants.AGENT_TYPE_OVS, 'compute'))
+
+    def test_get_host_agents_cache_disabled(self):
+        self.config(agent_cache_time=0)
+        self.plugin.create_or_update_agent(self.context, self.agent_status)
+        self.assertEqual(0, len(self.plugin.agent_cache))
+        self.assertEqual(1, len(self._get_host_agents()))
+
+    def test_update_agent_invalidates_cache(self):
+        self.plugin.create_or_update_agent(self.context, self.agent_status)
+        agent = self._get_host_agents()[0]
+        self.plugin.update_agent(self.context, agent['id'],
+                                 {'agent': {'admin_state_up': False}})
+
+        self.assertFalse(self._get_host_agents()[0]['admin_state_up'])
+
+    def test_delete_agent_invalidates_cache(self):
+        self.plugin.create_or_update_agent(self.context, self.agent_status)
+        agent = self._get_host_agents()[0]
+        self.plugin.delete_agent(self.context, agent['id'])
+
+        self.assertEqual([], self._get_host_agents())
+
+
+class TestAgentsDbHeartbeats(TestAgentsDbBase):
+    def setUp(self):
+        super(TestAgentsDbHeartbeats, self).setUp()
+        self.agent_status = {
+            'agent_type': constants.AGENT_TYPE_OVS,
+            'binary': 'neutron-openvswitch-agent',
+            'host': 'compute',
+            'topic': 'N/A',
+            'configurations': {'devices': 1},
+        }
+        self.spawn_after = mock.patch.object(
+            agents_db.greenthread, 'spawn_after').start()
+        self.plugin.create_or_update_agent(self.context, self.agent_status)
+        self.heartbeat = self._get_agent_db().heartbeat_timestamp
+
+    def _get_agent_db(self):
+        self.context.session.expire_all()
+        return self.plugin._get_agent_by_type_and_host(
+            self.context, constants.AGENT_TYPE_OVS, 'compute')
+
+    def _report_state(self, **kwargs):
+        agent_status = dict(self.agent_status, **kwargs)
+        later = self.heartbeat + datetime.timedelta(seconds=30)
+        with mock.patch.object(timeutils, 'utcnow', return_value=later):
+            with mock.patch.object(
+                    self.plugin, '_create_or_update_agent',
+                    wraps=self.plugin._create_or_update_agent) as update:
+                self.plugin.create_or_update_agent(self.context,
+                                                   agent_status)
+        return later, update.called
+
+    def test_heartbeat_buffered(self):
+        heartbeat, written = self._report_state()
+
+        self.assertFalse(written)
+        self.assertEqual(1, len(self.plugin.heartbeat_buffer))
+        self.assertEqual(self.heartbeat,
+                         self._get_agent_db().heartbeat_timestamp)
+        agent = self.plugin.get_agents(self.context)[0]
+        self.assertEqual(heartbeat, agent['heartbeat_timestamp'])
+        self.spawn_after.assert_called_once_with(
+            5, self.plugin._flush_heartbeats)
+
+    def test_flush_heartbeats(self):
+        heartbeat, _ = self._report_state()
+        self.assertEqual(1, self.plugin.flush_heartbeats(self.context))
+
+        self.assertEqual(heartbeat, self._get_agent_db().heartbeat_timestamp)
+        self.assertEqual(0, len(self.plugin.heartbeat_buffer))
+        self.assertEqual(0, self.plugin.flush_heartbeats(self.context))
+
+    def test_flush_scheduled_once(self):
+        self._report_state()
+        self._report_state()
+        self.assertEqual(1, self.spawn_after.call_count)
+
+        self.plugin._flush_heartbeats()
+        self._report_state()
+        self.assertEqual(2, self.spawn_after.call_count)
+
+    def test_configurations_changed(self):
+        _, written = self._report_state(configurations={'devices': 2})
+
+        self.assertTrue(written)
+        self.assertEqual(0, len(self.plugin.heartbeat_buffer))
+        self.assertEqual({'devices': 2}, self.plugin.get_configuration_dict(
+            self._get_agent_db()))
+
+    def test_start_flag(self):
+        _, written = self._report_state(start_flag=True)
+        self.assertTrue(written)
+
+    def test_buffering_disabled(self):
+        self.config(heartbeat_flush_interval=0)
+        _, written = self._report_state()
+        self.assertTrue(written)
+
+    def test_flush_interval_limited_by_agent_down_time(self):
+        self.config(agent_down_time=8)
+        self._report_state()
+        self.spawn_after.assert_called_once_with(
+            2, self.plugin._flush_heartbeats)
+
+    def test_agent_rewritten_periodically(self):
+        with mock.patch.object(agents_db, 'time') as time_mock:
+            time_mock.time.return_value = time.time() + 3600
+            _, written = self._report_state()
+        self.assertTrue(written)
+
+    def test_delete_agent_forgets_heartbeats(self):
+        self._report_state()
+        self.plugin.delete_agent(self.context, self._get_agent_db().id)
+
+        self.assertEqual(0, len(self.plugin.heartbeat_buffer))
+        _, written = self._report_state()
+        self.assertTrue(written)
+
+
 class TestAgentsDbGetAgents(TestAgentsDbBase):
     scenarios = [
         ('Get all agents', dict(agents=5, down_agents=2,
@@ -0,0 +1,429 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import array
+import os
+import random
+
+import fixtures
+import mock
+import netaddr
+from oslo_db.sqlalchemy import session
+
+from neutron.api.v2 import attributes
+from neutron.common import constants
+from neutron.common import exceptions as n_exc
+from neutron import context
+from neutron.db import db_base_plugin_v2 as base_plugin
+from neutron.db import ip_allocator
+from neutron.db import model_base
+from neutron.db import models_v2
+from neutron.tests import base
+from neutron.tests.unit.db import ipam_benchmark
+from neutron.tests.unit import testlib_api
+
+IN_MEMORY_ALLOCATOR = 'neutron.db.ip_allocator.InMemoryIpAllocator'
+
+
+class TestFreeRanges(base.BaseTestCase):
+
+    def test_free_ranges(self):
+        pools = [(3, 10), (100, 120)]
+        allocations = [1, 3, 4, 7, 11, 78, 110, 111, 120]
+        self.assertEqual([(5, 6), (8, 10), (100, 109), (112, 119)],
+                         ip_allocator.free_ranges(pools, allocations))
+
+    def test_free_ranges_no_allocations(self):
+        self.assertEqual([(3, 10)], ip_allocator.free_ranges([(3, 10)], []))
+
+    def test_free_ranges_exhausted(self):
+        self.assertEqual([], ip_allocator.free_ranges([(3, 5)], [3, 4, 5]))
+
+    def _test_free_ranges_random(self, sort):
+        generator = random.Random(0)
+        pools = [(10, 200), (300, 300), (400, 1000)]
+        allocations = generator.sample(range(1100), 600)
+        free = sorted(set(ip for first, last in pools
+                          for ip in range(first, last + 1)) -
+                      set(allocations))
+        expected = []
+        for ip in free:
+            if expected and expected[-1][1] == ip - 1:
+                expected[-1] = (expected[-1][0], ip)
+            else:
+                expected.append((ip, ip))
+
+        self.assertEqual(expected, ip_allocator.free_ranges(
+            pools, sort([str(netaddr.IPAddress(ip))
+                         for ip in allocations])))
+
+    def test_free_ranges_array(self):
+        with mock.patch.object(ip_allocator, 'numpy', None):
+            self._test_free_ranges_random(ip_allocator.sorted_addresses)
+
+    def test_free_ranges_numpy(self):
+        if ip_allocator.numpy is None:
+            self.skipTest("numpy is not installed")
+        self._test_free_ranges_random(ip_allocator.sorted_addresses)
+
+    def test_free_ranges_list(self):
+        self._test_free_ranges_random(
+            lambda ips: sorted(map(ip_allocator.ip_to_int, ips)))
+
+
+class TestSortedAddresses(base.BaseTestCase):
+
+    def test_ip_to_int(self):
+        for ip_address in ('0.0.0.0', '10.0.0.1', '255.255.255.255',
+                           '::', '2001::ffff:ffff:ffff:fffe',
+                           '::ffff:10.0.0.1'):
+            self.assertEqual(int(netaddr.IPAddress(ip_address)),
+                             ip_allocator.ip_to_int(ip_address))
+
+    def test_sorted_addresses_array(self):
+        with mock.patch.object(ip_allocator, 'numpy', None):
+            addresses = ip_allocator.sorted_addresses(
+                ['10.0.0.3', '10.0.0.1', '255.255.255.255'])
+        self.assertIsInstance(addresses, array.array)
+        self.assertEqual([167772161, 167772163, 4294967295], list(addresses))
+
+    def test_sorted_addresses_numpy(self):
+        if ip_allocator.numpy is None:
+            self.skipTest("numpy is not installed")
+        addresses = ip_allocator.sorted_addresses(['10.0.0.3', '10.0.0.1'])
+        self.assertEqual([167772161, 167772163], addresses.tolist())
+
+    def test_sorted_addresses_ipv6(self):
+        self.assertEqual([1, 2 ** 64], ip_allocator.sorted_addresses(
+            ['::1:0:0:0:0', '::1']))
+
+
+class TestIpRangeSet(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestIpRangeSet, self).setUp()
+        self.ips = ip_allocator.IpRangeSet([(2, 4), (10, 20)])
+
+    def test_contains(self):
+        self.assertIn(2, self.ips)
+        self.assertIn(15, self.ips)
+        self.assertNotIn(1, self.ips)
+        self.assertNotIn(5, self.ips)
+        self.assertNotIn(21, self.ips)
+        self.assertEqual(14, self.ips.size)
+
+    def test_remove(self):
+        self.assertTrue(self.ips.remove(2))
+        self.assertTrue(self.ips.remove(20))
+        self.assertTrue(self.ips.remove(15))
+        self.assertFalse(self.ips.remove(15))
+        self.assertFalse(self.ips.remove(7))
+
+        self.assertEqual([(3, 4), (10, 14), (16, 19)], self.ips.ranges())
+        self.assertEqual(11, self.ips.size)
+
+    def test_remove_single_address_range(self):
+        ips = ip_allocator.IpRangeSet([(2, 2), (5, 6)])
+        self.assertTrue(ips.remove(2))
+        self.assertEqual([(5, 6)], ips.ranges())
+
+    def test_add(self):
+        self.assertTrue(self.ips.add(5))
+        self.assertTrue(self.ips.add(9))
+        self.assertTrue(self.ips.add(0))
+        self.assertTrue(self.ips.add(7))
+        self.assertFalse(self.ips.add(3))
+
+        self.assertEqual([(0, 0), (2, 5), (7, 7), (9, 20)], self.ips.ranges())
+        self.assertEqual(18, self.ips.size)
+
+    def test_add_joins_ranges(self):
+        ips = ip_allocator.IpRangeSet([(2, 4), (6, 8)])
+        self.assertTrue(ips.add(5))
+        self.assertEqual([(2, 8)], ips.ranges())
+
+    def test_first_from(self):
+        self.assertEqual(3, self.ips.first_from(3))
+        self.assertEqual(10, self.ips.first_from(5))
+        self.assertEqual(2, self.ips.first_from(21))
+        self.assertEqual(2, self.ips.first_from(0))
+        self.assertIsNone(ip_allocator.IpRangeSet().first_from(0))
+
+    def test_random(self):
+        with mock.patch.object(ip_allocator.random, 'randint',
+                               return_value=7) as randint:
+            self.assertEqual(10, self.ips.random())
+        randint.assert_called_once_with(2, 20)
+        self.assertIsNone(ip_allocator.IpRangeSet().random())
+
+    def test_ipv6_range(self):
+        first = int(netaddr.IPAddress('2001::1'))
+        last = int(netaddr.IPAddress('2001::ffff:ffff:ffff:fffe'))
+        ips = ip_allocator.IpRangeSet([(first, last)])
+        self.assertIn(ips.random(), ips)
+        self.assertEqual(last - first + 1, ips.size)
+
+
+class TestInMemoryIpAllocator(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestInMemoryIpAllocator, self).setUp()
+        self.config(ip_allocator=IN_MEMORY_ALLOCATOR)
+        mock.patch.object(ip_allocator, '_ALLOCATORS', {}).start()
+        self.context = context.get_admin_context()
+        self.plugin = base_plugin.NeutronDbPluginV2()
+        self.allocator = ip_allocator.get_allocator()
+        self.plugin.create_network(self.context, {'network': {
+            'id': 'net-id', 'tenant_id': 'tenant', 'name': 'net',
+            'admin_state_up': True, 'shared': False,
+            'status': constants.NET_STATUS_ACTIVE}})
+        self.subnet = self.plugin.create_subnet(self.context, {'subnet': {
+            'id': 'subnet-id', 'tenant_id': 'tenant', 'name': 'subnet',
+            'network_id': 'net-id', 'ip_version': 4,
+            'cidr': '10.0.0.0/29', 'gateway_ip': '10.0.0.1',
+            'enable_dhcp': False, 'shared': False,
+            'allocation_pools': attributes.ATTR_NOT_SPECIFIED,
+            'dns_nameservers': attributes.ATTR_NOT_SPECIFIED,
+            'host_routes': attributes.ATTR_NOT_SPECIFIED}})
+
+    def _create_port(self, port_id, fixed_ips=attributes.ATTR_NOT_SPECIFIED):
+        port = self.plugin.create_port(self.context, {'port': {
+            'id': port_id, 'tenant_id': 'tenant', 'name': port_id,
+            'network_id': 'net-id',
+            'mac_address': attributes.ATTR_NOT_SPECIFIED,
+            'admin_state_up': True, 'device_id': 'device',
+            'device_owner': 'compute:nova', 'fixed_ips': fixed_ips}})
+        return port['fixed_ips'][0]['ip_address']
+
+    def _get_allocations(self):
+        query = self.context.session.query(models_v2.IPAllocation)
+        return dict((allocation.ip_address, allocation.port_id)
+                    for allocation in query)
+
+    def test_get_allocator(self):
+        self.assertIsInstance(self.allocator,
+                              ip_allocator.InMemoryIpAllocator)
+        self.assertIs(self.allocator, ip_allocator.get_allocator())
+        self.config(ip_allocator=None)
+        self.assertIsNone(ip_allocator.get_allocator())
+
+    def test_generate_ip(self):
+        ip_address = self._create_port('port-1')
+
+        self.assertIn(ip_address, ['10.0.0.%d' % i for i in range(2, 7)])
+        self.assertEqual({ip_address: 'port-1'}, self._get_allocations())
+        # The availability ranges are not maintained
+        self.assertEqual(
+            [], self.context.session.query(
+                models_v2.IPAvailabilityRange).all())
+
+    def test_generate_ip_exhausted_subnet(self):
+        ip_addresses = set(self._create_port('port-%d' % i)
+                           for i in range(5))
+
+        self.assertEqual(set('10.0.0.%d' % i for i in range(2, 7)),
+                         ip_addresses)
+        self.assertRaises(n_exc.IpAddressGenerationFailure,
+                          self._create_port, 'port-6')
+
+    def test_generate_ip_reuses_released_ips(self):
+        for i in range(5):
+            self._create_port('port-%d' % i)
+        released = self._get_allocations().keys()[0]
+        self.plugin.delete_port(self.context,
+                                self._get_allocations()[released])
+
+        self.assertEqual(released, self._create_port('port-6'))
+
+    def test_generate_ip_rolled_back(self):
+        try:
+            with self.context.session.begin():
+                ip_address = self.allocator.generate_ip(
+                    self.context, [self.subnet])['ip_address']
+                raise ValueError()
+        except ValueError:
+            pass
+
+        free = self.allocator._subnets['subnet-id'][1]
+        self.assertIn(int(netaddr.IPAddress(ip_address)), free)
+        self.assertEqual(5, free.size)
+
+    def test_generate_ip_committed(self):
+        ip_address = self._create_port('port-1')
+
+        free = self.allocator._subnets['subnet-id'][1]
+        self.assertNotIn(int(netaddr.IPAddress(ip_address)), free)
+        self.assertEqual(4, free.size)
+
+    def test_delete_port_releases_ip(self):
+        ip_address = self._create_port('port-1')
+        self.plugin.delete_port(self.context, 'port-1')
+
+        free = self.allocator._subnets['subnet-id'][1]
+        self.assertIn(int(netaddr.IPAddress(ip_address)), free)
+        self.assertEqual(5, free.size)
+
+    def test_update_port_releases_ip(self):
+        first_ip = int(netaddr.IPAddress('10.0.0.2'))
+        with mock.patch.object(ip_allocator.random, 'randint',
+                               return_value=first_ip):
+            self.assertEqual('10.0.0.2', self._create_port('port-1'))
+        self.plugin.update_port(self.context, 'port-1', {'port': {
+            'fixed_ips': [{'subnet_id': 'subnet-id',
+                           'ip_address': '10.0.0.5'}]}})
+
+        free = self.allocator._subnets['subnet-id'][1]
+        self.assertIn(first_ip, free)
+        self.assertNotIn(int(netaddr.IPAddress('10.0.0.5')), free)
+        self.assertEqual(4, free.size)
+
+    def test_release_ip_rolled_back(self):
+        ip_address = self._create_port('port-1')
+        try:
+            with self.context.session.begin():
+                self.plugin.delete_port(self.context, 'port-1')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        free = self.allocator._subnets['subnet-id'][1]
+        self.assertNotIn(int(netaddr.IPAddress(ip_address)), free)
+        self.assertEqual({ip_address: 'port-1'}, self._get_allocations())
+
+    def test_initialize_drops_ranges(self):
+        self.config(ip_allocator=None)
+        self.plugin.create_subnet(self.context, {'subnet': {
+            'id': 'subnet-2', 'tenant_id': 'tenant', 'name': 'subnet',
+            'network_id': 'net-id', 'ip_version': 4,
+            'cidr': '10.0.1.0/29', 'gateway_ip': '10.0.1.1',
+            'enable_dhcp': False, 'shared': False,
+            'allocation_pools': attributes.ATTR_NOT_SPECIFIED,
+            'dns_nameservers': attributes.ATTR_NOT_SPECIFIED,
+            'host_routes': attributes.ATTR_NOT_SPECIFIED}})
+        self.config(ip_allocator=IN_MEMORY_ALLOCATOR)
+        query = self.context.session.query(models_v2.IPAvailabilityRange)
+
+        # Loading the free addresses doesn't write to the database
+        self.allocator._get_free_ips(self.context, 'subnet-2')
+        self.assertEqual(1, query.count())
+        base_plugin.NeutronDbPluginV2()
+        self.assertEqual(0, query.count())
+
+    def test_generate_ip_concurrent_allocation(self):
+        with mock.patch.object(self.allocator, '_reserve',
+                               side_effect=[False, True]) as reserve:
+            self.allocator.generate_ip(self.context, [self.subnet])
+
+        first_ip = reserve.call_args_list[0][0][2]
+        second_ip = reserve.call_args_list[1][0][2]
+        self.assertNotEqual(first_ip, second_ip)
+
+    def test_generate_ip_reloads_after_conflicts(self):
+        with self.context.session.begin():
+            self.allocator.generate_ip(self.context, [self.subnet])
+        with mock.patch.object(self.allocator, '_load',
+                               wraps=self.allocator._load) as load:
+            with mock.patch.object(self.allocator, '_reserve',
+                                   side_effect=[False] * 4 + [True]):
+                self.allocator.generate_ip(self.context, [self.subnet])
+        self.assertEqual(1, load.call_count)
+
+    def test_generate_ip_allocated_by_other_servers(self):
+        with self.context.session.begin():
+            self.allocator.generate_ip(self.context, [self.subnet])
+        with mock.patch.object(self.allocator, '_reserve',
+                               return_value=False):
+            self.assertRaises(n_exc.IpAddressGenerationFailure,
+                              self.allocator.generate_ip,
+                              self.context, [self.subnet])
+
+    def test_allocate_specific_ip(self):
+        self._create_port('port-1', [{'subnet_id': 'subnet-id',
+                                      'ip_address': '10.0.0.4'}])
+        ip_addresses = set(self._create_port('port-%d' % i)
+                           for i in range(2, 6))
+
+        self.assertNotIn('10.0.0.4', ip_addresses)
+        self.assertEqual('port-1', self._get_allocations()['10.0.0.4'])
+
+    def test_delete_subnet_drops_free_ips(self):
+        self._create_port('port-1')
+        self.plugin.delete_port(self.context, 'port-1')
+        self.plugin.delete_subnet(self.context, 'subnet-id')
+
+        self.assertNotIn('subnet-id', self.allocator._subnets)
+
+    def test_delete_subnet_rolled_back(self):
+        self._create_port('port-1')
+        self.plugin.delete_port(self.context, 'port-1')
+        try:
+            with self.context.session.begin():
+                self.plugin.delete_subnet(self.context, 'subnet-id')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertIn('subnet-id', self.allocator._subnets)
+
+    def test_pools_updated(self):
+        first_ip = int(netaddr.IPAddress('10.0.0.2'))
+        with mock.patch.object(ip_allocator.random, 'randint',
+                               return_value=first_ip):
+            self.assertEqual('10.0.0.2', self._create_port('port-1'))
+        self.plugin.update_subnet(self.context, 'subnet-id', {'subnet': {
+            'allocation_pools': [{'start': '10.0.0.5',
+                                  'end': '10.0.0.6'}]}})
+        ip_addresses = set(self._create_port('port-%d' % i)
+                           for i in range(2, 4))
+
+        self.assertEqual(set(['10.0.0.5', '10.0.0.6']), ip_addresses)
+
+
+class TestIpamBenchmark(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestIpamBenchmark, self).setUp()
+        self.config(allow_overlapping_ips=True,
+                    notify_nova_on_port_status_changes=False)
+        mock.patch.object(ip_allocator, '_ALLOCATORS', {}).start()
+        directory = self.useFixture(fixtures.TempDir()).path
+        self.facade = session.EngineFacade(
+            'sqlite:///%s' % os.path.join(directory, 'ipam.sqlite'))
+        model_base.BASEV2.metadata.create_all(self.facade.get_engine())
+
+    def test_benchmark_ip_allocation(self):
+        for allocator in ipam_benchmark.ALLOCATORS.values():
+            result = ipam_benchmark.benchmark_ip_allocation(
+                self.facade, allocator, ports=10, workers=2,
+                cidr='10.0.0.0/24')
+            self.assertEqual(10, result['ports'])
+            self.assertEqual({}, result['failures'])
+            self.assertTrue(result['unique'])
+
+    def test_benchmark_rebuild(self):
+        result = ipam_benchmark.benchmark_rebuild(self.facade, '10.0.0.0/24',
+                                                  fill=0.5)
+        self.assertEqual(253, result['addresses'])
+        self.assertEqual(126, result['allocations'])
+        self.assertTrue(result['match'])
+        ranges = self.facade.get_session().query(
+            models_v2.IPAvailabilityRange).count()
+        self.assertEqual(result['ranges'], ranges)
+
+    def test_benchmark_rebuild_ipv6(self):
+        result = ipam_benchmark.benchmark_rebuild(self.facade,
+                                                  '2001:db8::/120', fill=0.5)
+        self.assertEqual(253, result['addresses'])
+        self.assertTrue(result['match'])
@@ -0,0 +1,73 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.common import constants
+from neutron.extensions import portbindings
+from neutron.plugins.ml2.drivers import mech_vbox
+from neutron.tests.unit.ml2 import _test_mech_agent as base
+
+
+class VBoxMechanismBaseTestCase(base.AgentMechanismBaseTestCase):
+    VIF_TYPE = portbindings.VIF_TYPE_BRIDGE
+    CAP_PORT_FILTER = False
+    AGENT_TYPE = constants.AGENT_TYPE_VBOX
+
+    GOOD_MAPPINGS = {'fake_physical_.*': 'eth1'}
+    GOOD_CONFIGS = {'network_mappings': GOOD_MAPPINGS}
+
+    BAD_MAPPINGS = {'wrong_physical_network': 'eth2'}
+    BAD_CONFIGS = {'network_mappings': BAD_MAPPINGS}
+
+    AGENTS = [{'alive': True,
+               'configurations': GOOD_CONFIGS,
+               'host': 'host'}]
+    AGENTS_DEAD = [{'alive': False,
+                    'configurations': GOOD_CONFIGS,
+                    'host': 'dead_host'}]
+    AGENTS_BAD = [{'alive': False,
+                   'configurations': GOOD_CONFIGS,
+                   'host': 'bad_host_1'},
+                  {'alive': True,
+                   'configurations': BAD_CONFIGS,
+                   'host': 'bad_host_2'}]
+
+    def setUp(self):
+        super(VBoxMechanismBaseTestCase, self).setUp()
+        self.driver = mech_vbox.VBoxMechanismDriver()
+        self.driver.initialize()
+
+
+class VBoxMechanismGenericTestCase(VBoxMechanismBaseTestCase,
+                                   base.AgentMechanismGenericTestCase):
+
+    def test_physnet_in_mappings(self):
+        mappings = {'physnet.*': 'eth1', 'other': 'eth2'}
+        self.assertTrue(self.driver.physnet_in_mappings('physnet1', mappings))
+        self.assertTrue(self.driver.physnet_in_mappings('other', mappings))
+        self.assertFalse(self.driver.physnet_in_mappings('missing',
+                                                         mappings))
+        # The compiled mappings are reused for the same agent mappings
+        self.assertEqual(1, len(self.driver._mappings))
+        self.assertFalse(self.driver.physnet_in_mappings('physnet', {}))
+        self.assertEqual(2, len(self.driver._mappings))
+
+
+class VBoxMechanismLocalTestCase(VBoxMechanismBaseTestCase,
+                                 base.AgentMechanismLocalTestCase):
+    pass
+
+
+class VBoxMechanismFlatTestCase(VBoxMechanismBaseTestCase,
+                                base.AgentMechanismFlatTestCase):
+    pass
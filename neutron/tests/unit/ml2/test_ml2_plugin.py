@@ -260,6 +260,28 @@ class TestMl2PortsV2(test_plugin.TestPortsV2, Ml2PluginV2TestCase):
             host_arg={portbindings.HOST_ID: HOST},
             arg_list=(portbindings.HOST_ID,))
 
+    def test_update_port_statuses(self):
+        ctx = context.get_admin_context()
+        plugin = manager.NeutronManager.get_plugin()
+        with self.subnet() as subnet, contextlib.nested(
+            self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                      **{portbindings.HOST_ID: HOST}),
+            self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                      **{portbindings.HOST_ID: 'other_host'})
+        ) as (port1, port2):
+            port1_id = port1['port']['id']
+            port2_id = port2['port']['id']
+            found_ports = plugin.update_port_statuses(
+                ctx, [port1_id, port2_id, 'invalid-uuid'],
+                constants.PORT_STATUS_ACTIVE, HOST)
+
+            self.assertEqual({port1_id: port1_id, port2_id: None},
+                             found_ports)
+            self.assertEqual(constants.PORT_STATUS_ACTIVE,
+                             plugin.get_port(ctx, port1_id)['status'])
+            self.assertEqual(constants.PORT_STATUS_DOWN,
+                             plugin.get_port(ctx, port2_id)['status'])
+
     def test_update_non_existent_port(self):
         ctx = context.get_admin_context()
         plugin = manager.NeutronManager.get_plugin()
@@ -310,6 +332,56 @@ class TestMl2PortsV2(test_plugin.TestPortsV2, Ml2PluginV2TestCase):
                 self._validate_behavior_on_bulk_failure(
                     res, 'ports', webob.exc.HTTPServerError.code)
 
+    def test_create_ports_bulk_calls_mechanism_drivers_once(self):
+        plugin = manager.NeutronManager.get_plugin()
+        with contextlib.nested(
+            self.network(),
+            mock.patch.object(plugin.mechanism_manager,
+                              'create_ports_precommit'),
+            mock.patch.object(plugin.mechanism_manager,
+                              'create_ports_postcommit')
+        ) as (net, precommit, postcommit):
+            res = self._create_port_bulk(self.fmt, 3, net['network']['id'],
+                                         'test', True)
+            ports = self.deserialize(self.fmt, res)['ports']
+
+            contexts = precommit.call_args[0][0]
+            self.assertEqual(1, precommit.call_count)
+            self.assertEqual([port['id'] for port in ports],
+                             [mech_context.current['id']
+                              for mech_context in contexts])
+            postcommit.assert_called_once_with(contexts)
+
+    def test_create_ports_bulk_precommit_failure(self):
+        plugin = manager.NeutronManager.get_plugin()
+        with contextlib.nested(
+            self.network(),
+            mock.patch.object(plugin.mechanism_manager,
+                              'create_ports_precommit',
+                              side_effect=ml2_exc.MechanismDriverError(
+                                  method='create_ports_precommit'))
+        ) as (net, precommit):
+            res = self._create_port_bulk(self.fmt, 2, net['network']['id'],
+                                         'test', True)
+            self._validate_behavior_on_bulk_failure(
+                res, 'ports', webob.exc.HTTPServerError.code)
+            self.assertEqual([], context.get_admin_context().session.query(
+                models.PortBinding).all())
+
+    def test_create_ports_bulk_postcommit_failure(self):
+        plugin = manager.NeutronManager.get_plugin()
+        with contextlib.nested(
+            self.network(),
+            mock.patch.object(plugin.mechanism_manager,
+                              'create_ports_postcommit',
+                              side_effect=ml2_exc.MechanismDriverError(
+                                  method='create_ports_postcommit'))
+        ) as (net, postcommit):
+            res = self._create_port_bulk(self.fmt, 2, net['network']['id'],
+                                         'test', True)
+            self._validate_behavior_on_bulk_failure(
+                res, 'ports', webob.exc.HTTPServerError.code)
+
     def test_create_ports_bulk_with_sec_grp(self):
         ctx = context.get_admin_context()
         plugin = manager.NeutronManager.get_plugin()
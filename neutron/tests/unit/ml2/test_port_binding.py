@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+
 import mock
 
 from neutron import context
@@ -111,6 +113,50 @@ class PortBindingTestCase(test_plugin.NeutronDbPluginV2TestCase):
             self.assertIsNone(
                 self.plugin.get_bound_port_context(ctx, port['port']['id']))
 
+    def test_get_devices_details_list(self):
+        host_arg = {portbindings.HOST_ID: 'host-ovs-no_filter'}
+        with contextlib.nested(
+            self.subnet(),
+            mock.patch.object(self.plugin, 'get_bound_port_context',
+                              wraps=self.plugin.get_bound_port_context)
+        ) as (subnet, get_bound_port_context), contextlib.nested(
+            self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                      **host_arg),
+            self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                      **host_arg),
+            self.port(subnet=subnet)) as (port1, port2, unbound_port):
+            devices = [port1['port']['id'],
+                       'tap' + port2['port']['id'][:11],
+                       unbound_port['port']['id'],
+                       'fake_device']
+            neutron_context = context.get_admin_context()
+            callbacks = self.plugin.endpoints[0]
+            details = callbacks.get_devices_details_list(
+                neutron_context, devices=devices, agent_id="theAgentId",
+                host='host-ovs-no_filter')
+            self.assertFalse(get_bound_port_context.called)
+            expected = [callbacks.get_device_details(
+                neutron_context, device=device, agent_id="theAgentId",
+                host='host-ovs-no_filter') for device in devices]
+            self.assertEqual(expected, details)
+            self.assertEqual('local', details[1]['network_type'])
+            self.assertEqual(port2['port']['id'][:11],
+                             details[1]['port_id'])
+            self.assertEqual({'device': 'fake_device'}, details[3])
+            for port in (port1, port2):
+                port = self._show('ports', port['port']['id'])['port']
+                self.assertEqual('BUILD', port['status'])
+
+    def test_get_bound_ports_contexts_no_binding(self):
+        ctx = context.get_admin_context()
+        with self.port(name='name') as port:
+            port_id = port['port']['id']
+            (ctx.session.query(ml2_models.PortBinding).
+             filter_by(port_id=port_id).delete())
+            self.assertEqual(
+                {port_id: None},
+                self.plugin.get_bound_ports_contexts(ctx, [port_id]))
+
     def test_hierarchical_binding(self):
         self._test_port_binding("host-hierarchical",
                                 portbindings.VIF_TYPE_OVS,
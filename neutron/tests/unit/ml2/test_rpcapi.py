@@ -116,19 +116,58 @@ class RpcCallbacksTestCase(base.BaseTestCase):
                 self.assertEqual(status == new_status,
                                  not self.plugin.update_port_status.called)
 
+    def _get_port_context(self, port_id, status, admin_state_up=True,
+                          device_owner='compute:None'):
+        port_context = mock.Mock()
+        port_context.current = collections.defaultdict(
+            lambda: 'fake', status=status, admin_state_up=admin_state_up,
+            device_owner=device_owner)
+        port_context.bottom_bound_segment = {
+            'network_type': 'vlan', 'segmentation_id': 1,
+            'physical_network': 'physnet1'}
+        return port_context
+
     def test_get_devices_details_list(self):
-        devices = [1, 2, 3, 4, 5]
-        kwargs = {'host': 'fake_host', 'agent_id': 'fake_agent_id'}
-        with mock.patch.object(self.callbacks, 'get_device_details',
-                               side_effect=devices) as f:
-            res = self.callbacks.get_devices_details_list('fake_context',
-                                                          devices=devices,
-                                                          **kwargs)
-            self.assertEqual(devices, res)
-            self.assertEqual(len(devices), f.call_count)
-            calls = [mock.call('fake_context', device=i, **kwargs)
-                     for i in devices]
-            f.assert_has_calls(calls)
+        self.plugin._device_to_port_id.side_effect = lambda device: device
+        self.plugin.get_bound_ports_contexts.return_value = {
+            'port1': self._get_port_context('port1',
+                                            constants.PORT_STATUS_DOWN),
+            'port2': self._get_port_context('port2',
+                                            constants.PORT_STATUS_BUILD),
+            'port3': self._get_port_context(
+                'port3', constants.PORT_STATUS_BUILD, admin_state_up=False),
+            'port4': None}
+        res = self.callbacks.get_devices_details_list(
+            'fake_context', devices=['port1', 'port2', 'port3', 'port4'],
+            agent_id='fake_agent_id', host='fake_host')
+
+        self.plugin.get_bound_ports_contexts.assert_called_once_with(
+            'fake_context', ['port1', 'port2', 'port3', 'port4'],
+            'fake_host')
+        self.assertEqual(['port1', 'port2', 'port3', 'port4'],
+                         [entry['device'] for entry in res])
+        self.assertEqual('physnet1', res[0]['physical_network'])
+        self.assertEqual({'device': 'port4'}, res[3])
+        self.assertFalse(self.plugin.get_bound_port_context.called)
+        self.assertFalse(self.plugin.update_port_status.called)
+        self.plugin.update_port_statuses.assert_has_calls(
+            [mock.call('fake_context', ['port1'],
+                       constants.PORT_STATUS_BUILD),
+             mock.call('fake_context', ['port3'],
+                       constants.PORT_STATUS_DOWN)], any_order=True)
+
+    def test_get_devices_details_list_dvr_port(self):
+        self.plugin._device_to_port_id.side_effect = lambda device: device
+        self.plugin.get_bound_ports_contexts.return_value = {
+            'port1': self._get_port_context(
+                'port1', constants.PORT_STATUS_DOWN,
+                device_owner=constants.DEVICE_OWNER_DVR_INTERFACE)}
+        self.callbacks.get_devices_details_list(
+            'fake_context', devices=['port1'], host='fake_host')
+        self.plugin.update_port_status.assert_called_once_with(
+            'fake_context', 'port1', constants.PORT_STATUS_BUILD,
+            'fake_host')
+        self.assertFalse(self.plugin.update_port_statuses.called)
 
     def test_get_devices_details_list_with_empty_devices(self):
         with mock.patch.object(self.callbacks, 'get_device_details') as f:
@@ -173,6 +212,60 @@ class RpcCallbacksTestCase(base.BaseTestCase):
                          self.callbacks.update_device_down(
                              'fake_context', device='fake_device'))
 
+    def test_update_devices_up(self):
+        self.plugin._device_to_port_id.side_effect = lambda device: device
+        self.plugin.update_port_statuses.return_value = {
+            'fake_device1': 'fake_port_id1',
+            'fake_device2': None,
+        }
+        type(self.l3plugin).supported_extension_aliases = (
+            mock.PropertyMock(return_value=['router', 'dvr']))
+
+        self.assertIsNone(self.callbacks.update_devices_up(
+            'fake_context', devices=['fake_device1', 'fake_device2',
+                                     'fake_device3'],
+            host='fake_host'))
+
+        self.plugin.update_port_statuses.assert_called_once_with(
+            'fake_context', ['fake_device1', 'fake_device2', 'fake_device3'],
+            constants.PORT_STATUS_ACTIVE, 'fake_host')
+        self.plugin._get_port.assert_called_once_with('fake_context',
+                                                      'fake_port_id1')
+        self.assertEqual(1, self.l3plugin.dvr_vmarp_table_update.call_count)
+
+    def test_update_devices_down(self):
+        self.plugin._device_to_port_id.side_effect = lambda device: device
+        self.plugin.update_port_statuses.return_value = {
+            'fake_device1': 'fake_port_id1',
+            'fake_device2': None,
+        }
+
+        self.assertEqual(
+            [{'device': 'fake_device1', 'exists': True},
+             {'device': 'fake_device2', 'exists': True},
+             {'device': 'fake_device3', 'exists': False}],
+            self.callbacks.update_devices_down(
+                'fake_context', devices=['fake_device1', 'fake_device2',
+                                         'fake_device3'],
+                host='fake_host'))
+        self.plugin.update_port_statuses.assert_called_once_with(
+            'fake_context', mock.ANY, constants.PORT_STATUS_DOWN,
+            'fake_host')
+
+    def test_update_devices_down_stale_data(self):
+        self.plugin.update_port_statuses.side_effect = exc.StaleDataError
+        with mock.patch.object(self.callbacks,
+                               'update_device_down') as update_device_down:
+            update_device_down.return_value = mock.sentinel.result
+            self.assertEqual(
+                [mock.sentinel.result],
+                self.callbacks.update_devices_down(
+                    'fake_context', devices=['fake_device'],
+                    agent_id='fake_agent_id', host='fake_host'))
+            update_device_down.assert_called_once_with(
+                'fake_context', device='fake_device',
+                agent_id='fake_agent_id', host='fake_host')
+
 
 class RpcApiTestCase(base.BaseTestCase):
 
@@ -273,6 +366,22 @@ class RpcApiTestCase(base.BaseTestCase):
                            agent_id='fake_agent_id',
                            host='fake_host')
 
+    def test_update_devices_down(self):
+        rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
+        self._test_rpc_api(rpcapi, None,
+                           'update_devices_down', rpc_method='call',
+                           devices=['fake_device1', 'fake_device2'],
+                           agent_id='fake_agent_id', host='fake_host',
+                           version='1.5')
+
+    def test_update_devices_up(self):
+        rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
+        self._test_rpc_api(rpcapi, None,
+                           'update_devices_up', rpc_method='call',
+                           devices=['fake_device1', 'fake_device2'],
+                           agent_id='fake_agent_id', host='fake_host',
+                           version='1.5')
+
     def test_tunnel_sync(self):
         rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
         self._test_rpc_api(rpcapi, None,
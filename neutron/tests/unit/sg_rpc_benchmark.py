@@ -0,0 +1,224 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the assembly of the security_group_info_for_devices RPC
+payload for the ports of a big default security group.
+
+Usage: python -m neutron.tests.unit.sg_rpc_benchmark \\
+           --members 1000 10000 50000 --rules 200 --ports 10
+
+The rules and the member IPs are generated in memory instead of being
+selected from the database, so only the assembly of the payload is timed.
+The previous list based assembly is timed for comparison, up to
+--legacy-max-members members as it is quadratic.
+"""
+
+import argparse
+import copy
+import time
+
+import netaddr
+
+from neutron.common import constants
+from neutron.db import securitygroups_rpc_base as sg_db_rpc
+
+SECURITY_GROUP_ID = "default-security-group"
+
+
+class SecurityGroupRpcPlugin(sg_db_rpc.SecurityGroupServerRpcMixin):
+
+    """Serve generated rules and member IPs instead of the database ones."""
+
+    def __init__(self, rules, member_ips):
+        self._rules = rules
+        self._member_ips = member_ips
+
+    def _select_rules_for_ports(self, context, ports):
+        # Like the join of the port bindings and the rules, every rule of
+        # the security group is returned for every port
+        return [(port_id, rule) for port_id in ports for rule in self._rules]
+
+    def _select_ips_for_remote_group(self, context, remote_group_ids):
+        return dict((remote_group_id, set(self._member_ips))
+                    for remote_group_id in remote_group_ids)
+
+    def _apply_provider_rule(self, context, ports):
+        pass
+
+
+def generate_rules(count):
+    """Return the rules of a default security group, with count TCP rules
+    in addition to the rules allowing the traffic of the members.
+    """
+    rules = []
+    for ethertype in (constants.IPv4, constants.IPv6):
+        rules.append({"security_group_id": SECURITY_GROUP_ID,
+                      "direction": "ingress", "ethertype": ethertype,
+                      "remote_group_id": SECURITY_GROUP_ID})
+        rules.append({"security_group_id": SECURITY_GROUP_ID,
+                      "direction": "egress", "ethertype": ethertype})
+    for index in range(count):
+        rules.append({"security_group_id": SECURITY_GROUP_ID,
+                      "direction": "ingress",
+                      "ethertype": constants.IPv4, "protocol": "tcp",
+                      "port_range_min": 1000 + index,
+                      "port_range_max": 1000 + index,
+                      "remote_ip_prefix": "10.%d.0.0/16" % (index % 256)})
+    return rules
+
+
+def generate_member_ips(count):
+    """Return count member IPs, one in ten of them being IPv6."""
+    return ["2001:db8::%x" % index if index % 10 == 0 else
+            str(netaddr.IPAddress(0x0a000000 + index))
+            for index in range(count)]
+
+
+def _generate_ports(count):
+    return dict(("port-%d" % index, {"device": "port-%d" % index})
+                for index in range(count))
+
+
+def legacy_security_group_info_for_ports(plugin, context, ports):
+    """The list based assembly of the payload, before the deduplication
+    of its items with hashed sets.
+    """
+    sg_info = {'devices': ports,
+               'security_groups': {},
+               'sg_member_ips': {}}
+    rules_in_db = plugin._select_rules_for_ports(context, ports)
+    remote_security_group_info = {}
+    for (port_id, rule_in_db) in rules_in_db:
+        remote_gid = rule_in_db.get('remote_group_id')
+        security_group_id = rule_in_db.get('security_group_id')
+        ethertype = rule_in_db['ethertype']
+        if ('security_group_source_groups'
+            not in sg_info['devices'][port_id]):
+            sg_info['devices'][port_id][
+                'security_group_source_groups'] = []
+
+        if remote_gid:
+            if (remote_gid
+                not in sg_info['devices'][port_id][
+                    'security_group_source_groups']):
+                sg_info['devices'][port_id][
+                    'security_group_source_groups'].append(remote_gid)
+            if remote_gid not in remote_security_group_info:
+                remote_security_group_info[remote_gid] = {}
+            if ethertype not in remote_security_group_info[remote_gid]:
+                remote_security_group_info[remote_gid][ethertype] = []
+
+        direction = rule_in_db['direction']
+        rule_dict = {
+            'direction': direction,
+            'ethertype': ethertype}
+
+        for key in ('protocol', 'port_range_min', 'port_range_max',
+                    'remote_ip_prefix', 'remote_group_id'):
+            if rule_in_db.get(key):
+                if key == 'remote_ip_prefix':
+                    direction_ip_prefix = sg_db_rpc.DIRECTION_IP_PREFIX[
+                        direction]
+                    rule_dict[direction_ip_prefix] = rule_in_db[key]
+                    continue
+                rule_dict[key] = rule_in_db[key]
+        if security_group_id not in sg_info['security_groups']:
+            sg_info['security_groups'][security_group_id] = []
+        if rule_dict not in sg_info['security_groups'][security_group_id]:
+            sg_info['security_groups'][security_group_id].append(
+                rule_dict)
+
+    sg_info['sg_member_ips'] = remote_security_group_info
+    plugin._apply_provider_rule(context, sg_info['devices'])
+
+    ips = plugin._select_ips_for_remote_group(
+        context, sg_info['sg_member_ips'].keys())
+    for sg_id, member_ips in ips.items():
+        for ip in member_ips:
+            ethertype = 'IPv%d' % netaddr.IPNetwork(ip).version
+            if (ethertype in sg_info['sg_member_ips'][sg_id]
+                and ip not in sg_info['sg_member_ips'][sg_id][ethertype]):
+                sg_info['sg_member_ips'][sg_id][ethertype].append(ip)
+    return sg_info
+
+
+def benchmark_security_group_info(members, rules=200, ports=10,
+                                  legacy=True):
+    """Assemble the payload for ports of a security group with the
+    received numbers of members and rules.
+
+    Returns a dict with the seconds spent by the current and, if legacy
+    is set, by the previous assembly, the numbers of rules and member IPs
+    in the payload, and whether both assemblies return the same payload.
+    """
+    plugin = SecurityGroupRpcPlugin(generate_rules(rules),
+                                    generate_member_ips(members))
+    devices = _generate_ports(ports)
+
+    start = time.time()
+    sg_info = plugin.security_group_info_for_ports(None,
+                                                   copy.deepcopy(devices))
+    duration = time.time() - start
+
+    result = {
+        "members": sum(len(ips) for ips in
+                       sg_info["sg_member_ips"][SECURITY_GROUP_ID].values()),
+        "rules": len(sg_info["security_groups"][SECURITY_GROUP_ID]),
+        "seconds": duration,
+        "legacy_seconds": None,
+        "match": None,
+    }
+    if legacy:
+        start = time.time()
+        legacy_sg_info = legacy_security_group_info_for_ports(
+            plugin, None, copy.deepcopy(devices))
+        result["legacy_seconds"] = time.time() - start
+        result["match"] = legacy_sg_info == sg_info
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, nargs="+",
+                        default=[1000, 10000, 50000],
+                        help="The numbers of members of the security group.")
+    parser.add_argument("--rules", type=int, default=200,
+                        help="The number of TCP rules of the security group.")
+    parser.add_argument("--ports", type=int, default=10,
+                        help="The number of ports in the request.")
+    parser.add_argument("--legacy-max-members", type=int, default=10000,
+                        help="The biggest security group for which the "
+                             "previous assembly is timed.")
+    args = parser.parse_args()
+
+    print("%8s %6s %6s %9s %9s  %s" %
+          ("members", "rules", "ports", "seconds", "legacy", "match"))
+    for members in args.members:
+        result = benchmark_security_group_info(
+            members, args.rules, args.ports,
+            legacy=members <= args.legacy_max_members)
+        legacy_seconds = result["legacy_seconds"]
+        print("%8d %6d %6d %8.3fs %9s  %s" %
+              (result["members"], result["rules"], args.ports,
+               result["seconds"],
+               "-" if legacy_seconds is None else "%.3fs" % legacy_seconds,
+               "-" if result["match"] is None else result["match"]))
+
+
+if __name__ == "__main__":
+    main()
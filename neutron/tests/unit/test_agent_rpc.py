@@ -70,6 +70,42 @@ class AgentRPCPluginApi(base.BaseTestCase):
     def test_update_device_down(self):
         self._test_rpc_call('update_device_down')
 
+    def test_update_devices_down(self):
+        self._test_rpc_call('update_devices_down')
+
+    def test_update_devices_up(self):
+        self._test_rpc_call('update_devices_up')
+
+    def _test_update_devices_unsupported(self, method, device_method):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = oslo_context.RequestContext('fake_user', 'fake_project')
+        with contextlib.nested(
+            mock.patch.object(agent.client, 'call'),
+            mock.patch.object(agent.client, 'prepare'),
+        ) as (
+            mock_call, mock_prepare
+        ):
+            mock_prepare.return_value = agent.client
+            mock_call.side_effect = [oslo_messaging.UnsupportedVersion('1.5'),
+                                     'foo', 'bar']
+            actual_val = getattr(agent, method)(
+                ctxt, ['fake_device1', 'fake_device2'], 'fake_agent_id')
+            mock_call.assert_has_calls([
+                mock.call(ctxt, device_method, device='fake_device1',
+                          agent_id='fake_agent_id', host=None),
+                mock.call(ctxt, device_method, device='fake_device2',
+                          agent_id='fake_agent_id', host=None)])
+        return actual_val
+
+    def test_update_devices_down_unsupported(self):
+        self.assertEqual(['foo', 'bar'],
+                         self._test_update_devices_unsupported(
+                             'update_devices_down', 'update_device_down'))
+
+    def test_update_devices_up_unsupported(self):
+        self.assertIsNone(self._test_update_devices_unsupported(
+            'update_devices_up', 'update_device_up'))
+
     def test_tunnel_sync(self):
         self._test_rpc_call('tunnel_sync')
 
@@ -37,6 +37,8 @@ from neutron import context
 from neutron.db import db_base_plugin_v2
 from neutron.db import models_v2
 from neutron import manager
+from neutron.notifiers import nova
+from neutron.openstack.common import uuidutils
 from neutron.tests import base
 from neutron.tests.unit import test_extensions
 from neutron.tests.unit import testlib_api
@@ -4219,7 +4221,8 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
                                               expected):
         ip_qry = mock.Mock()
         ip_qry.with_lockmode.return_value = ip_qry
-        ip_qry.filter_by.return_value = allocations
+        ip_qry.filter_by.return_value = [(allocation['ip_address'], )
+                                         for allocation in allocations]
 
         pool_qry = mock.Mock()
         pool_qry.options.return_value = pool_qry
@@ -4227,7 +4230,7 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
         pool_qry.filter_by.return_value = pools
 
         def return_queries_side_effect(*args, **kwargs):
-            if args[0] == models_v2.IPAllocation:
+            if args[0] is models_v2.IPAllocation.ip_address:
                 return ip_qry
             if args[0] == models_v2.IPAllocationPool:
                 return pool_qry
@@ -4239,9 +4242,12 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
         db_base_plugin_v2.NeutronDbPluginV2._rebuild_availability_ranges(
             context, subnets)
 
-        actual = [[args[0].allocation_pool_id,
-                   args[0].first_ip, args[0].last_ip]
-                  for _name, args, _kwargs in context.session.add.mock_calls]
+        insert, ranges = context.session.execute.call_args[0]
+        self.assertEqual(models_v2.IPAvailabilityRange.__table__,
+                         insert.table)
+        actual = [[ip_range['allocation_pool_id'],
+                   ip_range['first_ip'], ip_range['last_ip']]
+                  for ip_range in ranges]
         self.assertEqual(expected, actual)
 
     def test_rebuild_availability_ranges(self):
@@ -4374,3 +4380,139 @@ class NeutronDbPluginV2AsMixinTestCase(testlib_api.SqlTestCase):
         self.net_data['network']['status'] = 'BUILD'
         net = self.plugin.create_network(self.context, self.net_data)
         self.assertEqual(net['status'], 'BUILD')
+
+    def _create_subnet(self, cidr='10.0.0.0/29'):
+        self.plugin.create_network(self.context, self.net_data)
+        return self.plugin.create_subnet(self.context, {'subnet': {
+            'tenant_id': 'test-tenant', 'name': 'subnet1',
+            'network_id': 'fake-id', 'ip_version': 4, 'cidr': cidr,
+            'gateway_ip': attributes.ATTR_NOT_SPECIFIED,
+            'enable_dhcp': False, 'shared': False,
+            'allocation_pools': attributes.ATTR_NOT_SPECIFIED,
+            'dns_nameservers': attributes.ATTR_NOT_SPECIFIED,
+            'host_routes': attributes.ATTR_NOT_SPECIFIED}})
+
+    def _ports_data(self, count, **kwargs):
+        ports = []
+        for i in range(count):
+            port = {'tenant_id': 'test-tenant', 'name': 'port%d' % i,
+                    'network_id': 'fake-id', 'admin_state_up': True,
+                    'device_id': 'device%d' % i, 'device_owner': '',
+                    'mac_address': attributes.ATTR_NOT_SPECIFIED,
+                    'fixed_ips': attributes.ATTR_NOT_SPECIFIED}
+            port.update(kwargs)
+            ports.append({'port': port})
+        return {'ports': ports}
+
+    def test_create_port_bulk(self):
+        self._create_subnet()
+        ports = self.plugin.create_port_bulk(self.context,
+                                             self._ports_data(5))
+
+        self.assertEqual(['10.0.0.%d' % i for i in range(2, 7)],
+                         [port['fixed_ips'][0]['ip_address']
+                          for port in ports])
+        self.assertEqual(5, len(set(port['mac_address'] for port in ports)))
+        self.assertEqual(ports, self.plugin.get_ports(
+            self.context, sorts=[('name', True)]))
+        self.assertEqual([], self.context.session.query(
+            models_v2.IPAvailabilityRange).all())
+
+    def test_create_port_bulk_notifies_nova(self):
+        cfg.CONF.set_override('notify_nova_on_port_status_changes', True)
+        self.plugin = importutils.import_object(DB_PLUGIN_KLASS)
+        self._create_subnet()
+        device_ids = [uuidutils.generate_uuid() for i in range(2)]
+        data = self._ports_data(2, device_owner='compute:nova')
+        for port, device_id in zip(data['ports'], device_ids):
+            port['port']['device_id'] = device_id
+        with mock.patch.object(nova.Notifier, 'queue_event') as queue_event:
+            ports = self.plugin.create_port_bulk(self.context, data)
+
+        events = [call[0][0] for call in queue_event.call_args_list
+                  if call[0][0]]
+        self.assertEqual(
+            [{'server_uuid': device_id, 'name': nova.VIF_PLUGGED,
+              'status': 'completed', 'tag': port['id']}
+             for device_id, port in zip(device_ids, ports)],
+            sorted(events, key=lambda event: device_ids.index(
+                event['server_uuid'])))
+
+    def test_create_port_bulk_fixed_ips(self):
+        subnet = self._create_subnet()
+        data = self._ports_data(3)
+        data['ports'][2]['port']['fixed_ips'] = [
+            {'subnet_id': subnet['id'], 'ip_address': '10.0.0.2'}]
+        ports = self.plugin.create_port_bulk(self.context, data)
+
+        self.assertEqual(['10.0.0.3', '10.0.0.4', '10.0.0.2'],
+                         [port['fixed_ips'][0]['ip_address']
+                          for port in ports])
+
+    def test_create_port_bulk_generates_macs_in_one_query(self):
+        self._create_subnet()
+        self.plugin.create_port(self.context, self._ports_data(
+            1, mac_address='fa:16:3e:00:00:01')['ports'][0])
+        macs = ['fa:16:3e:00:00:01', 'fa:16:3e:00:00:02',
+                'fa:16:3e:00:00:03', 'fa:16:3e:00:00:04']
+        with contextlib.nested(
+            mock.patch.object(self.plugin, '_generate_mac',
+                              side_effect=macs),
+            mock.patch.object(self.plugin, '_get_macs_in_use',
+                              wraps=self.plugin._get_macs_in_use)
+        ) as (generate_mac, get_macs_in_use):
+            ports = self.plugin.create_port_bulk(self.context,
+                                                 self._ports_data(3))
+
+        self.assertEqual(set(macs[1:]),
+                         set(port['mac_address'] for port in ports))
+        self.assertEqual(2, get_macs_in_use.call_count)
+
+    def test_create_port_bulk_other_tenant_network(self):
+        self._create_subnet()
+        tenant_context = context.Context('', 'other-tenant')
+        self.assertRaises(n_exc.NetworkNotFound,
+                          self.plugin.create_port_bulk, tenant_context,
+                          self._ports_data(2, tenant_id='other-tenant'))
+        self.assertEqual([], self.plugin.get_ports(self.context))
+
+    def test_create_port_bulk_shared_network(self):
+        self.net_data['network']['shared'] = True
+        self._create_subnet()
+        tenant_context = context.Context('', 'other-tenant')
+        ports = self.plugin.create_port_bulk(
+            tenant_context, self._ports_data(2, tenant_id='other-tenant'))
+        self.assertEqual(2, len(ports))
+
+    def test_create_port_bulk_mac_in_use(self):
+        self._create_subnet()
+        data = self._ports_data(2, mac_address='fa:16:3e:00:00:01')
+        self.assertRaises(n_exc.MacAddressInUse,
+                          self.plugin.create_port_bulk, self.context, data)
+        self.assertEqual([], self.plugin.get_ports(self.context))
+
+    def test_create_port_bulk_rebuilds_ranges(self):
+        self._create_subnet()
+        ports = self.plugin.create_port_bulk(self.context,
+                                             self._ports_data(3))
+        self.plugin.delete_port(self.context, ports[0]['id'])
+        ports = self.plugin.create_port_bulk(self.context,
+                                             self._ports_data(3))
+
+        self.assertEqual(['10.0.0.5', '10.0.0.6', '10.0.0.2'],
+                         [port['fixed_ips'][0]['ip_address']
+                          for port in ports])
+
+    def test_create_port_bulk_exhausted_subnet(self):
+        self._create_subnet()
+        self.assertRaises(n_exc.IpAddressGenerationFailure,
+                          self.plugin.create_port_bulk, self.context,
+                          self._ports_data(6))
+        self.assertEqual([], self.plugin.get_ports(self.context))
+        self.assertEqual([], self.context.session.query(
+            models_v2.IPAllocation).all())
+
+    def test_create_port_bulk_overridden_create_port(self):
+        with mock.patch.object(self.plugin, 'create_port') as create_port:
+            self.plugin.create_port_bulk(self.context, self._ports_data(2))
+        self.assertEqual(2, create_port.call_count)
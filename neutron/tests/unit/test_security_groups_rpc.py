@@ -16,6 +16,7 @@
 import contextlib
 
 import collections
+import copy
 import mock
 from oslo_config import cfg
 import oslo_messaging
@@ -36,6 +37,7 @@ from neutron.extensions import allowedaddresspairs as addr_pair
 from neutron.extensions import securitygroup as ext_sg
 from neutron import manager
 from neutron.tests import base
+from neutron.tests.unit import sg_rpc_benchmark
 from neutron.tests.unit import test_extension_security_group as test_sg
 
 FAKE_PREFIX = {const.IPv4: '10.0.0.0/24',
@@ -1085,6 +1087,255 @@ class SGServerRpcCallBackTestCase(test_sg.SecurityGroupDBTestCase):
                 self._delete('ports', port_id2)
 
 
+class SecurityGroupInfoForPortsTestCase(base.BaseTestCase):
+
+    def _security_group_info(self, rules, member_ips, ports=2):
+        plugin = sg_rpc_benchmark.SecurityGroupRpcPlugin(rules, member_ips)
+        devices = dict(('port-%d' % index, {}) for index in range(ports))
+        return plugin.security_group_info_for_ports(None, devices)
+
+    def test_rules_deduplicated(self):
+        rules = sg_rpc_benchmark.generate_rules(2)
+        sg_info = self._security_group_info(rules + rules, [])
+
+        sg_id = sg_rpc_benchmark.SECURITY_GROUP_ID
+        self.assertEqual(6, len(sg_info['security_groups'][sg_id]))
+        self.assertEqual({'direction': 'ingress', 'ethertype': const.IPv4,
+                          'protocol': 'tcp', 'port_range_min': 1000,
+                          'port_range_max': 1000,
+                          'source_ip_prefix': '10.0.0.0/16'},
+                         sg_info['security_groups'][sg_id][4])
+        for device in sg_info['devices'].values():
+            self.assertEqual([sg_id], device['security_group_source_groups'])
+
+    def test_member_ips_by_ethertype(self):
+        rules = sg_rpc_benchmark.generate_rules(0)
+        sg_info = self._security_group_info(
+            rules, ['10.0.0.1', '2001:db8::1', '10.0.1.0/24',
+                    '2001:db8::/64', '::ffff:10.0.0.2'])
+
+        member_ips = sg_info['sg_member_ips'][
+            sg_rpc_benchmark.SECURITY_GROUP_ID]
+        self.assertEqual(['10.0.0.1', '10.0.1.0/24'],
+                         sorted(member_ips[const.IPv4]))
+        self.assertEqual(['2001:db8::/64', '2001:db8::1', '::ffff:10.0.0.2'],
+                         sorted(member_ips[const.IPv6]))
+
+    def test_member_ips_of_ethertypes_without_rules(self):
+        rules = [rule for rule in sg_rpc_benchmark.generate_rules(0)
+                 if rule['ethertype'] == const.IPv4]
+        sg_info = self._security_group_info(rules,
+                                            ['10.0.0.1', '2001:db8::1'])
+
+        self.assertEqual(
+            {const.IPv4: ['10.0.0.1']},
+            sg_info['sg_member_ips'][sg_rpc_benchmark.SECURITY_GROUP_ID])
+
+    def test_benchmark_security_group_info(self):
+        result = sg_rpc_benchmark.benchmark_security_group_info(
+            members=100, rules=5, ports=3)
+
+        self.assertEqual(100, result['members'])
+        self.assertEqual(9, result['rules'])
+        self.assertTrue(result['match'])
+
+
+class SecurityGroupCacheTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(SecurityGroupCacheTestCase, self).setUp()
+        self.cache = sg_db_rpc.SecurityGroupCache()
+        self.time = mock.patch('time.time', return_value=1000).start()
+
+    def test_get_with_generation(self):
+        self.cache.set(self.cache.RULES, 'sg1', 3, ('rule',))
+
+        self.assertEqual(('rule',), self.cache.get(self.cache.RULES, 'sg1', 3))
+        self.assertIsNone(self.cache.get(self.cache.MEMBER_IPS, 'sg1', 3))
+        self.assertIsNone(self.cache.get(self.cache.RULES, 'sg1', 4))
+        self.assertEqual(0, len(self.cache))
+
+    def test_expired_entries(self):
+        cfg.CONF.set_override('security_group_cache_time', 60)
+        self.cache.set(self.cache.RULES, 'sg1', 0, ('rule',))
+        self.time.return_value = 1060
+        self.cache.set(self.cache.RULES, 'sg2', 0, ('rule',))
+
+        self.assertEqual(1, len(self.cache))
+        self.assertIsNone(self.cache.get(self.cache.RULES, 'sg1', 0))
+
+    def test_set_without_generation_or_cache_time(self):
+        self.cache.set(self.cache.RULES, 'sg1', None, ('rule',))
+        cfg.CONF.set_override('security_group_cache_time', 0)
+        self.cache.set(self.cache.RULES, 'sg2', 0, ('rule',))
+
+        self.assertEqual(0, len(self.cache))
+
+    def test_invalidate(self):
+        self.cache.set(self.cache.RULES, 'sg1', 0, ('rule',))
+        self.cache.set(self.cache.MEMBER_IPS, 'sg1', 0, frozenset())
+        self.cache.set(self.cache.RULES, 'sg2', 0, ('rule',))
+        self.cache.invalidate(['sg1'])
+
+        self.assertEqual(1, len(self.cache))
+
+
+class SGServerRpcCacheTestCase(test_sg.SecurityGroupDBTestCase):
+
+    def setUp(self):
+        set_firewall_driver(FIREWALL_NOOP_DRIVER)
+        super(SGServerRpcCacheTestCase, self).setUp(TEST_PLUGIN_CLASS)
+        self.plugin = manager.NeutronManager.get_plugin()
+        self.rpc = securitygroups_rpc.SecurityGroupServerRpcCallback()
+        self.ctx = context.get_admin_context()
+        self.load_rules = mock.patch.object(
+            self.plugin, '_select_rules_for_security_groups',
+            wraps=self.plugin._select_rules_for_security_groups).start()
+        self.load_ips = mock.patch.object(
+            self.plugin, '_select_ips_for_security_groups',
+            wraps=self.plugin._select_ips_for_security_groups).start()
+
+    def _create_ports(self, network_id, sg_id, count=1):
+        ports = []
+        for _ in range(count):
+            res = self._create_port(self.fmt, network_id,
+                                    security_groups=[sg_id])
+            ports.append(self.deserialize(self.fmt, res)['port'])
+        return ports
+
+    def _add_rule(self, sg_id, port, remote_group_id=None):
+        rule = self._build_security_group_rule(
+            sg_id, 'ingress', const.PROTO_NAME_TCP, port, port,
+            remote_group_id=remote_group_id)
+        res = self._create_security_group_rule(
+            self.fmt, {'security_group_rules': [rule['security_group_rule']]})
+        return self.deserialize(self.fmt, res)['security_group_rules'][0]
+
+    def _security_group_info(self, port):
+        # The test plugin converts the fixed IPs of the devices it returns
+        self.plugin.devices[port['id']] = copy.deepcopy(port)
+        return self.rpc.security_group_info_for_devices(
+            self.ctx, devices=[port['id']])
+
+    def _tcp_ports(self, info, sg_id):
+        return sorted(rule['port_range_min']
+                      for rule in info['security_groups'][sg_id]
+                      if rule.get('protocol') == const.PROTO_NAME_TCP)
+
+    def test_cached_rules_and_member_ips(self):
+        with contextlib.nested(self.network(), self.security_group()) as (
+                n, sg):
+            with self.subnet(n):
+                sg_id = sg['security_group']['id']
+                self._add_rule(sg_id, '22', remote_group_id=sg_id)
+                port, = self._create_ports(n['network']['id'], sg_id)
+                info = self._security_group_info(port)
+                self.assertEqual(info, self._security_group_info(port))
+
+                self.assertEqual(1, self.load_rules.call_count)
+                self.assertEqual(1, self.load_ips.call_count)
+                self.assertEqual(
+                    [port['fixed_ips'][0]['ip_address']],
+                    info['sg_member_ips'][sg_id][const.IPv4])
+
+    def test_rule_changes_invalidate_rules(self):
+        with contextlib.nested(self.network(), self.security_group()) as (
+                n, sg):
+            with self.subnet(n):
+                sg_id = sg['security_group']['id']
+                port, = self._create_ports(n['network']['id'], sg_id)
+                self._security_group_info(port)
+                rule = self._add_rule(sg_id, '22')
+                self.assertEqual([22], self._tcp_ports(
+                    self._security_group_info(port), sg_id))
+
+                self._delete('security-group-rules', rule['id'])
+                self.assertEqual([], self._tcp_ports(
+                    self._security_group_info(port), sg_id))
+                self.assertEqual(3, self.load_rules.call_count)
+
+    def test_member_changes_invalidate_member_ips(self):
+        with contextlib.nested(self.network(), self.security_group()) as (
+                n, sg):
+            with self.subnet(n):
+                sg_id = sg['security_group']['id']
+                self._add_rule(sg_id, '22', remote_group_id=sg_id)
+                port1, = self._create_ports(n['network']['id'], sg_id)
+                self._security_group_info(port1)
+                port2, = self._create_ports(n['network']['id'], sg_id)
+                info = self._security_group_info(port1)
+                self.assertEqual(
+                    sorted([port1['fixed_ips'][0]['ip_address'],
+                            port2['fixed_ips'][0]['ip_address']]),
+                    sorted(info['sg_member_ips'][sg_id][const.IPv4]))
+
+                self._delete('ports', port2['id'])
+                info = self._security_group_info(port1)
+                self.assertEqual([port1['fixed_ips'][0]['ip_address']],
+                                 info['sg_member_ips'][sg_id][const.IPv4])
+                self.assertEqual(3, self.load_ips.call_count)
+
+    def test_ip_change_bumps_generations(self):
+        with contextlib.nested(self.network(), self.security_group()) as (
+                n, sg):
+            with self.subnet(n):
+                sg_id = sg['security_group']['id']
+                port, = self._create_ports(n['network']['id'], sg_id)
+                original = self.plugin.get_port(self.ctx, port['id'])
+                updated = dict(original, fixed_ips=[
+                    dict(original['fixed_ips'][0], ip_address='10.0.0.100')])
+                generation = self.plugin._get_security_group_generations(
+                    self.ctx, [sg_id])[sg_id]
+
+                self.plugin.is_security_group_member_updated(
+                    self.ctx, original, updated)
+                self.assertEqual(
+                    {sg_id: generation + 1},
+                    self.plugin._get_security_group_generations(
+                        self.ctx, [sg_id]))
+
+    def test_generation_bumped_by_other_process(self):
+        with contextlib.nested(self.network(), self.security_group()) as (
+                n, sg):
+            with self.subnet(n):
+                sg_id = sg['security_group']['id']
+                port, = self._create_ports(n['network']['id'], sg_id)
+                self._security_group_info(port)
+                # Only the generation in the database is changed, like
+                # the other server processes do
+                with mock.patch.object(self.plugin.security_group_cache,
+                                       'invalidate'):
+                    self.plugin._bump_security_group_generations(
+                        self.ctx, [sg_id])
+                self._security_group_info(port)
+                self.assertEqual(2, self.load_rules.call_count)
+
+    def test_expired_entries_reloaded(self):
+        with contextlib.nested(self.network(), self.security_group()) as (
+                n, sg):
+            with self.subnet(n):
+                sg_id = sg['security_group']['id']
+                port, = self._create_ports(n['network']['id'], sg_id)
+                with mock.patch('time.time', return_value=1000) as time:
+                    self._security_group_info(port)
+                    time.return_value = 1000 + (
+                        cfg.CONF.security_group_cache_time)
+                    self._security_group_info(port)
+                self.assertEqual(2, self.load_rules.call_count)
+
+    def test_cache_disabled(self):
+        cfg.CONF.set_override('security_group_cache_time', 0)
+        with contextlib.nested(self.network(), self.security_group()) as (
+                n, sg):
+            with self.subnet(n):
+                sg_id = sg['security_group']['id']
+                port, = self._create_ports(n['network']['id'], sg_id)
+                self._security_group_info(port)
+                self._security_group_info(port)
+                self.assertEqual(2, self.load_rules.call_count)
+                self.assertEqual(0, len(self.plugin.security_group_cache))
+
+
 class SGAgentRpcCallBackMixinTestCase(base.BaseTestCase):
     def setUp(self):
         super(SGAgentRpcCallBackMixinTestCase, self).setUp()
@@ -0,0 +1,25 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'etc')
+
+# Recorded `VBoxManage showvminfo --machinereadable` outputs
+SHOWVMINFO_FIXTURES = ('showvminfo_running.txt', 'showvminfo_poweroff.txt')
+
+
+def get_fixture(filename):
+    with open(os.path.join(FIXTURES_PATH, filename)) as fixture:
+        return fixture.read()
@@ -0,0 +1,242 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmarks for the VirtualBox agent.
+
+Usage: python -m neutron.tests.unit.virtualbox.benchmark [--number N]
+       python -m neutron.tests.unit.virtualbox.benchmark --ports 50 500
+"""
+
+import argparse
+import collections
+import shutil
+import subprocess
+import tempfile
+import time
+import timeit
+
+import mock
+from oslo_config import cfg
+
+from neutron.plugins.common import constants as p_const
+from neutron.plugins.virtualbox.agent import vbox_neutron_agent
+from neutron.plugins.virtualbox.common import constants
+from neutron.plugins.virtualbox.common import metrics
+from neutron.plugins.virtualbox.common import vboxapi
+from neutron.tests.unit import virtualbox
+from neutron.tests.unit.virtualbox import fake_vboxmanage
+
+PHYSICAL_NETWORK = "physnet1"
+INTERFACE = "eth1"
+
+
+def benchmark_parse_vm_info(number, repeat=3):
+    """Measure the cost of parsing the recorded `showvminfo` outputs.
+
+    Returns a list of (fixture, lines, microseconds per VM) tuples.
+    """
+    results = []
+    for fixture in virtualbox.SHOWVMINFO_FIXTURES:
+        output = virtualbox.get_fixture(fixture)
+        timer = timeit.Timer(lambda: vboxapi.parse_vm_info(output))
+        best = min(timer.repeat(repeat=repeat, number=number))
+        results.append((fixture, output.count("\n"),
+                        best / number * 1000000))
+    return results
+
+
+class FakePluginApi(object):
+
+    """The RPC API of a neutron server which knows all the simulated
+    ports, all of them on the same flat network.
+    """
+
+    def __init__(self, ports, latency=0):
+        self._ports = set(ports)
+        self._latency = latency
+        self.status = {}
+        self.calls = collections.Counter()
+
+    def _call(self, method):
+        self.calls[method] += 1
+        if self._latency:
+            time.sleep(self._latency)
+
+    def get_devices_details_list(self, context, devices, agent_id,
+                                 host=None):
+        self._call("get_devices_details_list")
+        details = []
+        for device in devices:
+            if device not in self._ports:
+                details.append({"device": device})
+                continue
+            details.append({
+                "device": device, "port_id": device,
+                "network_id": "network-1", "admin_state_up": True,
+                "network_type": p_const.TYPE_FLAT,
+                "physical_network": PHYSICAL_NETWORK,
+            })
+        return details
+
+    def update_devices_up(self, context, devices, agent_id, host=None):
+        self._call("update_devices_up")
+        self.status.update((device, "ACTIVE") for device in devices)
+
+    def update_devices_down(self, context, devices, agent_id, host=None):
+        self._call("update_devices_down")
+        self.status.update((device, "DOWN") for device in devices)
+
+
+def _converged(host, plugin_api):
+    """Test whether all the ports are active and attached to the
+    physical network.
+    """
+    for port_id, nic in host.ports().items():
+        if (plugin_api.status.get(port_id) != "ACTIVE" or
+                nic.get(constants.NIC_MODE) != constants.NIC_MODE_BRIDGED or
+                nic.get(constants.BRIDGE_ADAPTER) != INTERFACE or
+                nic.get(constants.IS_CONNECTED) != constants.ON):
+            return False
+    return True
+
+
+def benchmark_agent(ports, nics_per_vm=2, latency=0, access_denied_rate=0,
+                    rpc_latency=0, idle_scans=3, max_iterations=50):
+    """Measure the agent against a simulated host where all the virtual
+    machines were booted at once.
+
+    The iterations of the agent loop are run back to back, without
+    waiting for the polling interval. Returns a dictionary with the time
+    of the first scan, the number of iterations and the time until all the
+    ports are attached and active, the VBoxManage commands per converged
+    port and the average time of the scans which find no changes.
+    """
+    directory = tempfile.mkdtemp()
+    overrides = [("retry_interval", 0, "virtualbox"),
+                 ("backend", "vboxmanage", "virtualbox"),
+                 ("retry_interval", 0, "AGENT"),
+                 ("report_interval", 0, "AGENT"),
+                 ("physical_network_mappings",
+                  ["%s:%s" % (PHYSICAL_NETWORK, INTERFACE)], "AGENT")]
+    for name, value, group in overrides:
+        cfg.CONF.set_override(name, value, group)
+    metrics.METRICS.reset()
+
+    try:
+        host = fake_vboxmanage.FakeVBoxHost(
+            directory, latency=latency,
+            access_denied_rate=access_denied_rate)
+        port_ids = ["port-%05d" % index for index in range(ports)]
+        for index in range(0, ports, nics_per_vm):
+            host.add_machine("instance-%05d" % index,
+                             port_ids[index:index + nics_per_vm],
+                             state=constants.RUNNING)
+        plugin_api = FakePluginApi(port_ids, latency=rpc_latency)
+
+        with mock.patch.object(subprocess, "Popen", host.popen), \
+                mock.patch.object(vboxapi, "_CIRCUIT_BREAKER", None):
+            with mock.patch.object(vbox_neutron_agent.VBoxNeutronAgent,
+                                   "_setup_rpc"):
+                agent = vbox_neutron_agent.VBoxNeutronAgent()
+            agent.plugin_rpc = plugin_api
+            agent.context = None
+            agent.agent_id = "vbox_benchmark"
+
+            device_info, sync = None, True
+            start = time.time()
+            iterations, first_scan = 0, None
+            while iterations < max_iterations:
+                iterations += 1
+                iteration_start = time.time()
+                device_info, sync = agent._process_iteration(device_info,
+                                                             sync)
+                if first_scan is None:
+                    first_scan = time.time() - iteration_start
+                if _converged(host, plugin_api):
+                    break
+            convergence = time.time() - start
+            converged = _converged(host, plugin_api)
+            converge_calls = sum(host.calls.values())
+
+            idle_start = time.time()
+            for _ in range(idle_scans):
+                device_info, sync = agent._process_iteration(device_info,
+                                                             sync)
+            idle_scan = (time.time() - idle_start) / max(idle_scans, 1)
+            idle_calls = sum(host.calls.values()) - converge_calls
+
+        return {
+            "ports": ports,
+            "vms": len(host.machines),
+            "converged": converged,
+            "iterations": iterations,
+            "first_scan": first_scan,
+            "convergence_time": convergence,
+            "vboxmanage_calls": converge_calls,
+            "calls_per_port": converge_calls / float(max(ports, 1)),
+            "idle_scan": idle_scan,
+            "idle_calls_per_scan": idle_calls / float(max(idle_scans, 1)),
+            "retries": metrics.METRICS.counter("vbox.retries"),
+            "rpc_calls": dict(plugin_api.calls),
+        }
+    finally:
+        for name, _, group in overrides:
+            cfg.CONF.clear_override(name, group)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--number", type=int, default=10000,
+                        help="The number of parsed outputs per measurement.")
+    parser.add_argument("--ports", type=int, nargs="+",
+                        help="Benchmark the agent loop against simulated "
+                             "hosts with the received numbers of ports.")
+    parser.add_argument("--nics-per-vm", type=int, default=2,
+                        help="The number of ports of every virtual machine.")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="The duration of every VBoxManage command, in "
+                             "seconds.")
+    parser.add_argument("--rpc-latency", type=float, default=0,
+                        help="The duration of every RPC call, in seconds.")
+    parser.add_argument("--access-denied-rate", type=float, default=0,
+                        help="The probability of a VBoxManage command to "
+                             "fail with E_ACCESSDENIED.")
+    args = parser.parse_args()
+
+    if not args.ports:
+        for fixture, lines, cost in benchmark_parse_vm_info(args.number):
+            print("parse_vm_info %-28s %4d lines %8.2f us/VM" %
+                  (fixture, lines, cost))
+        return
+
+    print("%6s %5s %5s %10s %12s %10s %10s %10s %8s" %
+          ("ports", "vms", "iters", "first_scan", "convergence",
+           "calls/port", "idle_scan", "idle_calls", "retries"))
+    for ports in args.ports:
+        result = benchmark_agent(
+            ports, nics_per_vm=args.nics_per_vm, latency=args.latency,
+            access_denied_rate=args.access_denied_rate,
+            rpc_latency=args.rpc_latency)
+        print("%6d %5d %5d %9.3fs %11.3fs%s %10.2f %9.3fs %10.1f %8d" %
+              (result["ports"], result["vms"], result["iterations"],
+               result["first_scan"], result["convergence_time"],
+               "" if result["converged"] else "!",
+               result["calls_per_port"], result["idle_scan"],
+               result["idle_calls_per_scan"], result["retries"]))
+
+
+if __name__ == "__main__":
+    main()
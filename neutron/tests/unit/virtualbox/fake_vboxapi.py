@@ -0,0 +1,146 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Fake implementation of the VirtualBox Python API (the `vboxapi` module
+shipped with the VirtualBox SDK), used for testing without VirtualBox.
+"""
+
+import uuid
+
+
+class FakeConstants(object):
+
+    _ENUMS = {
+        'MachineState': ['Null', 'PoweredOff', 'Saved', 'Teleported',
+                         'Aborted', 'Running', 'Paused', 'Stuck'],
+        'NetworkAttachmentType': ['Null', 'NAT', 'Bridged', 'Internal',
+                                  'HostOnly', 'Generic', 'NATNetwork'],
+        'NetworkAdapterType': ['Null', 'Am79C970A', 'Am79C973', 'I82540EM',
+                               'I82543GC', 'I82545EM', 'Virtio'],
+        'LockType': ['Null', 'Shared', 'Write', 'VM'],
+        'VBoxEventType': ['Invalid', 'Any', 'OnMachineStateChanged',
+                          'OnMachineDataChanged', 'OnMachineRegistered'],
+    }
+
+    def __init__(self):
+        for enum, names in self._ENUMS.items():
+            for value, name in enumerate(names):
+                setattr(self, '%s_%s' % (enum, name), value)
+
+    def all_values(self, enum):
+        return dict((name, value)
+                    for value, name in enumerate(self._ENUMS[enum]))
+
+
+class FakeNetworkAdapter(object):
+
+    def __init__(self, slot, enabled=False):
+        self.slot = slot
+        self.enabled = enabled
+        self.attachmentType = 1     # NAT
+        self.adapterType = 3        # I82540EM
+        self.MACAddress = '080027%06X' % slot
+        self.cableConnected = True
+        self.lineSpeed = 0
+        self.bridgedInterface = ''
+        self.hostOnlyInterface = ''
+
+
+class FakeMachine(object):
+
+    MAX_ADAPTERS = 8
+
+    def __init__(self, name, description=None, state=1, adapters=1):
+        self.name = name
+        self.id = str(uuid.uuid4())
+        self.description = description or ''
+        self.state = state
+        self.chipsetType = 1
+        self.settingsFilePath = '/fake/%s/%s.vbox' % (name, name)
+        self.adapters = [FakeNetworkAdapter(slot, slot < adapters)
+                         for slot in range(self.MAX_ADAPTERS)]
+        self.locked = False
+        self.saved = 0
+
+    def getNetworkAdapter(self, slot):
+        return self.adapters[slot]
+
+    def lockMachine(self, session, lock_type):
+        if self.locked:
+            raise Exception("The machine is already locked")
+        # Running machines can only be locked for shared access
+        if lock_type == 2 and self.state == 5:
+            raise Exception("VBOX_E_INVALID_OBJECT_STATE")
+        self.locked = True
+        session.machine = self
+
+    def saveSettings(self):
+        self.saved += 1
+
+
+class FakeSession(object):
+
+    def __init__(self):
+        self.machine = None
+
+    def unlockMachine(self):
+        self.machine.locked = False
+        self.machine = None
+
+
+class FakeSystemProperties(object):
+
+    def getMaxNetworkAdapters(self, chipset):
+        return FakeMachine.MAX_ADAPTERS
+
+
+class FakeVirtualBox(object):
+
+    def __init__(self):
+        self.machines = []
+        self.systemProperties = FakeSystemProperties()
+
+    def findMachine(self, name_or_id):
+        for machine in self.machines:
+            if name_or_id in (machine.name, machine.id):
+                return machine
+        raise Exception("VBOX_E_OBJECT_NOT_FOUND")
+
+    def register(self, machine):
+        self.machines.append(machine)
+        return machine
+
+
+class FakeVirtualBoxManager(object):
+
+    def __init__(self, style=None, params=None):
+        self.constants = FakeConstants()
+        self.vbox = FakeVirtualBox()
+
+    def getVirtualBox(self):
+        return self.vbox
+
+    def getArray(self, obj, field):
+        return list(getattr(obj, field))
+
+    def getSessionObject(self, vbox=None):
+        return FakeSession()
+
+    def queryInterface(self, obj, interface):
+        return obj
+
+
+# The name used by the `vboxapi` module
+VirtualBoxManager = FakeVirtualBoxManager
@@ -0,0 +1,234 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process simulator of a VirtualBox host driven through the `VBoxManage`
+command line, used for testing and benchmarking the agent without
+VirtualBox.
+
+The simulator replaces `subprocess.Popen`, so the commands built by
+:class:`neutron.plugins.virtualbox.common.vboxapi.VBoxManage` are
+executed against the simulated virtual machines:
+
+    host = FakeVBoxHost(directory)
+    host.add_machine("instance-1", ["port-1"])
+    with mock.patch.object(subprocess, "Popen", host.popen):
+        ...
+"""
+
+import collections
+import os
+import random
+import time
+import uuid
+
+from oslo_serialization import jsonutils
+
+from neutron.plugins.virtualbox.common import constants
+
+MAX_ADAPTERS = 8
+
+
+class FakeMachine(object):
+
+    def __init__(self, name, settings_file, description=None,
+                 state=constants.POWER_OFF):
+        self.name = name
+        self.uuid = str(uuid.uuid4())
+        self.settings_file = settings_file
+        self.description = description
+        self.state = state
+        self.nics = {}
+
+    def machine_readable(self):
+        """Return the output of `showvminfo --machinereadable`."""
+        lines = [
+            'name="%s"' % self.name,
+            'UUID="%s"' % self.uuid,
+            'CfgFile="%s"' % self.settings_file,
+            'memory=512',
+            'VMState="%s"' % self.state,
+        ]
+        for index in range(1, MAX_ADAPTERS + 1):
+            nic = self.nics.get(index)
+            if not nic:
+                lines.append('nic%d="none"' % index)
+                continue
+            for field in (constants.NIC_MODE, constants.NIC_TYPE,
+                          constants.MAC_ADDRESS, constants.IS_CONNECTED,
+                          constants.BRIDGE_ADAPTER,
+                          constants.HOSTONLY_ADAPTER):
+                if nic.get(field) is not None:
+                    lines.append('%s%d="%s"' % (field, index, nic[field]))
+        lines.append('description="%s"' % (self.description or "none"))
+        return "\n".join(lines) + "\n"
+
+
+class FakeProcess(object):
+
+    def __init__(self, stdout, stderr):
+        self._output = (stdout, stderr)
+
+    def communicate(self):
+        return self._output
+
+
+class FakeVBoxHost(object):
+
+    """The virtual machines registered on a simulated VirtualBox host.
+
+    :param directory:          where the settings files are created
+    :param latency:            the duration, in seconds, of every command
+    :param access_denied_rate: the probability of a command to fail with
+                               E_ACCESSDENIED, like a busy VBoxSVC
+    :param seed:               the seed used for the simulated failures
+    """
+
+    def __init__(self, directory, latency=0, access_denied_rate=0, seed=0):
+        self._directory = directory
+        self._latency = latency
+        self._access_denied_rate = access_denied_rate
+        self._random = random.Random(seed)
+        self._revision = int(time.time())
+        self._mac_addresses = 0
+        self.machines = collections.OrderedDict()
+        self.calls = collections.Counter()
+
+    def _save_settings(self, machine):
+        """Change the modification time of the settings file, like
+        VirtualBox does when the configuration is saved.
+        """
+        self._revision += 1
+        with open(machine.settings_file, "w") as settings_file:
+            settings_file.write(machine.uuid)
+        os.utime(machine.settings_file, (self._revision, self._revision))
+
+    def add_machine(self, name, ports, state=constants.POWER_OFF):
+        """Register a virtual machine with a NAT adapter for every port."""
+        machine = FakeMachine(
+            name, os.path.join(self._directory, "%s.vbox" % name),
+            state=state)
+        network = {}
+        for index, port_id in enumerate(ports, 1):
+            self._mac_addresses += 1
+            mac_address = "080027%06X" % self._mac_addresses
+            network[mac_address] = port_id
+            machine.nics[index] = {
+                constants.NIC_MODE: constants.NIC_MODE_NAT,
+                constants.NIC_TYPE: constants.NIC_TYPE_AM79C973,
+                constants.MAC_ADDRESS: mac_address,
+                constants.IS_CONNECTED: constants.ON,
+            }
+        machine.description = jsonutils.dumps({"network": network})
+        self.machines[name] = machine
+        self._save_settings(machine)
+        return machine
+
+    def set_state(self, name, state):
+        """Change the state of a virtual machine.
+
+        As on a real host, the settings file is not changed.
+        """
+        self.machines[name].state = state
+
+    def unregister(self, name):
+        machine = self.machines.pop(name)
+        os.unlink(machine.settings_file)
+
+    def ports(self):
+        """Return the NIC used by every port."""
+        ports = {}
+        for machine in self.machines.values():
+            network = jsonutils.loads(machine.description)["network"]
+            for nic in machine.nics.values():
+                port_id = network.get(nic[constants.MAC_ADDRESS])
+                if port_id:
+                    ports[port_id] = nic
+        return ports
+
+    def popen(self, command, **kwargs):
+        """Replacement for `subprocess.Popen`."""
+        # Skip the path of the executable and the `--nologo` flag
+        return FakeProcess(*self.execute(*command[2:]))
+
+    def execute(self, command, *args):
+        """Execute a VBoxManage command and return (stdout, stderr)."""
+        self.calls[command] += 1
+        if self._latency:
+            time.sleep(self._latency)
+        if self._random.random() < self._access_denied_rate:
+            return "", ("VBoxManage: error: The object functionality is "
+                        "limited (%s)" % constants.VBOX_E_ACCESSDENIED)
+
+        handler = getattr(self, "_%s" % command, None)
+        if handler is None:
+            return "", "VBoxManage: error: Unknown command %s" % command
+
+        if command != "list":
+            machine = self.machines.get(args[0])
+            if not machine:
+                return "", ("VBoxManage: error: %s '%s'" %
+                            (constants.VBOX_E_INSTANCE_NOT_FOUND, args[0]))
+            args = (machine, ) + args[1:]
+        return handler(*args)
+
+    def _list(self, information):
+        if information == constants.VMS_INFO:
+            machines = self.machines.values()
+        elif information == constants.RUNNINGVMS_INFO:
+            machines = [machine for machine in self.machines.values()
+                        if machine.state == constants.RUNNING]
+        else:
+            return "", "VBoxManage: error: Unsupported %s" % information
+        return "".join('"%s" {%s}\n' % (machine.name, machine.uuid)
+                       for machine in machines), ""
+
+    def _showvminfo(self, machine, *args):
+        return machine.machine_readable(), ""
+
+    def _modifyvm(self, machine, *args):
+        if machine.state != constants.POWER_OFF:
+            return "", ("VBoxManage: error: The machine '%s' is already "
+                        "locked for a session (%s)" %
+                        (machine.name, constants.VBOX_E_INVALID_OBJECT_STATE))
+
+        fields = {"nic": constants.NIC_MODE, "nictype": constants.NIC_TYPE,
+                  "cableconnected": constants.IS_CONNECTED,
+                  "bridgeadapter": constants.BRIDGE_ADAPTER,
+                  "hostonlyadapter": constants.HOSTONLY_ADAPTER}
+        for option, value in zip(args[::2], args[1::2]):
+            name = option.lstrip("-").rstrip("0123456789")
+            index = int(option[len(name) + 2:])
+            nic = machine.nics.setdefault(index, {})
+            nic[fields[name]] = value
+        self._save_settings(machine)
+        return "", ""
+
+    def _controlvm(self, machine, option, *values):
+        if machine.state != constants.RUNNING:
+            return "", ("VBoxManage: error: Machine '%s' is not currently "
+                        "running" % machine.name)
+
+        name = option.rstrip("0123456789")
+        nic = machine.nics.setdefault(int(option[len(name):]), {})
+        if name == "nic":
+            nic[constants.NIC_MODE] = values[0]
+            if values[0] == constants.NIC_MODE_BRIDGED:
+                nic[constants.BRIDGE_ADAPTER] = values[1]
+            elif values[0] == constants.NIC_MODE_HOSTONLY:
+                nic[constants.HOSTONLY_ADAPTER] = values[1]
+        elif name == "setlinkstate":
+            nic[constants.IS_CONNECTED] = values[0]
+        self._save_settings(machine)
+        return "", ""
@@ -0,0 +1,127 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the simulated VirtualBox host and the agent benchmark
+"""
+
+import shutil
+import subprocess
+import tempfile
+
+import mock
+from oslo_config import cfg
+
+from neutron.plugins.virtualbox.common import constants
+from neutron.plugins.virtualbox.common import exception as vbox_exc
+from neutron.plugins.virtualbox.common import vboxapi
+from neutron.tests import base
+from neutron.tests.unit.virtualbox import benchmark
+from neutron.tests.unit.virtualbox import fake_vboxmanage
+
+
+class TestFakeVBoxHost(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestFakeVBoxHost, self).setUp()
+        cfg.CONF.set_override('retry_interval', 0, 'virtualbox')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self._host = fake_vboxmanage.FakeVBoxHost(directory)
+        self._machine = self._host.add_machine("instance", ["port-1"])
+        mock.patch.object(subprocess, "Popen", self._host.popen).start()
+
+    def test_show_vm_info(self):
+        info = vboxapi.VBoxManage.show_vm_info("instance")
+
+        self.assertEqual(constants.POWER_OFF, info[constants.VM_STATE])
+        self.assertEqual(self._machine.settings_file,
+                         info[constants.VM_CFG_FILE])
+        self.assertEqual(["1"], list(info[constants.VM_NICS]))
+        nic = info[constants.VM_NICS]["1"]
+        self.assertEqual(constants.NIC_MODE_NAT, nic.nic)
+        self.assertEqual({nic.macaddress: "port-1"},
+                         vboxapi.VBoxNetworkManage()._process_description(
+                             info[constants.VM_DESCRIPTION]))
+        self.assertRaises(vbox_exc.InstanceNotFound,
+                          vboxapi.VBoxManage.show_vm_info, "missing")
+
+    def test_modify_network(self):
+        vboxapi.VBoxManage.modify_network(
+            "instance", "1",
+            [(constants.FIELD_NIC_MODE, constants.NIC_MODE_BRIDGED),
+             (constants.FIELD_BRIDGE_ADAPTER, "eth1")])
+
+        self.assertEqual({"port-1": {
+            constants.NIC_MODE: constants.NIC_MODE_BRIDGED,
+            constants.NIC_TYPE: constants.NIC_TYPE_AM79C973,
+            constants.MAC_ADDRESS: "080027000001",
+            constants.IS_CONNECTED: constants.ON,
+            constants.BRIDGE_ADAPTER: "eth1"}}, self._host.ports())
+
+        # The network hardware of a running machine cannot be changed
+        self._host.set_state("instance", constants.RUNNING)
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          vboxapi.VBoxManage.modify_network, "instance", "1",
+                          [(constants.FIELD_NIC_MODE,
+                            constants.NIC_MODE_NAT)])
+
+    def test_update_network(self):
+        self._host.set_state("instance", constants.RUNNING)
+
+        vboxapi.VBoxManage.update_network(
+            "instance", "1", constants.FIELD_LINK_STATE, (constants.OFF,))
+
+        self.assertEqual(constants.OFF, self._host.ports()["port-1"][
+            constants.IS_CONNECTED])
+        self.assertEqual({"controlvm": 1}, dict(self._host.calls))
+
+    def test_refresh_power_state(self):
+        network = vboxapi.VBoxNetworkManage()
+        network.refresh()
+        self._host.set_state("instance", constants.RUNNING)
+        network.refresh()
+
+        self.assertEqual(constants.RUNNING,
+                         network.get_device("port-1")["state"])
+        self.assertEqual({"list": 3, "showvminfo": 2},
+                         dict(self._host.calls))
+
+    def test_access_denied(self):
+        host = fake_vboxmanage.FakeVBoxHost(None, access_denied_rate=1)
+
+        _, error = host.execute("list", constants.VMS_INFO)
+
+        self.assertIn(constants.VBOX_E_ACCESSDENIED, error)
+
+
+class TestBenchmarkAgent(base.BaseTestCase):
+
+    def test_mass_boot(self):
+        result = benchmark.benchmark_agent(20, nics_per_vm=2)
+
+        self.assertTrue(result["converged"])
+        self.assertEqual(10, result["vms"])
+        self.assertEqual(1, result["iterations"])
+        # `list vms`, then a `showvminfo` for every virtual machine and a
+        # `controlvm` for every port
+        self.assertEqual(31, result["vboxmanage_calls"])
+        self.assertEqual({"get_devices_details_list": 1,
+                          "update_devices_up": 1}, result["rpc_calls"])
+
+    def test_mass_boot_access_denied(self):
+        result = benchmark.benchmark_agent(20, access_denied_rate=0.2)
+
+        self.assertTrue(result["converged"])
+        self.assertTrue(result["retries"])
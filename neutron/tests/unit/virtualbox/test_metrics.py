@@ -0,0 +1,124 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the VirtualBox agent metrics
+"""
+
+import os
+import shutil
+import tempfile
+
+import mock
+from oslo_serialization import jsonutils
+
+from neutron.plugins.virtualbox.common import metrics
+from neutron.tests import base
+
+
+class TestHistogram(base.BaseTestCase):
+
+    def test_summary(self):
+        histogram = metrics.Histogram()
+        for seconds in (0.0005, 0.002, 0.004, 20):
+            histogram.observe(seconds)
+
+        self.assertEqual({"count": 4, "total": 20006.5, "avg": 5001.625,
+                          "max": 20000.0,
+                          "buckets": {"le_1": 1, "le_5": 2, "inf": 1}},
+                         histogram.summary())
+
+    def test_summary_empty(self):
+        self.assertEqual({"count": 0, "total": 0, "avg": 0, "max": 0,
+                          "buckets": {}},
+                         metrics.Histogram().summary())
+
+
+class TestMetrics(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self._metrics = metrics.Metrics()
+
+    def test_counters_gauges(self):
+        self._metrics.increment("calls")
+        self._metrics.increment("calls", 2)
+        self._metrics.set_gauge("size", 1)
+        self._metrics.set_gauge("size", 5)
+
+        self.assertEqual(3, self._metrics.counter("calls"))
+        self.assertEqual(0, self._metrics.counter("missing"))
+        self.assertEqual({"counters": {"calls": 3}, "gauges": {"size": 5},
+                          "latency": {}},
+                         self._metrics.summary())
+
+        self._metrics.reset()
+        self.assertEqual({"counters": {}, "gauges": {}, "latency": {}},
+                         self._metrics.summary())
+
+    def test_average(self):
+        self._metrics.observe("command", 0.002)
+        self._metrics.observe("command", 0.004)
+
+        self.assertEqual(3, self._metrics.average("command"))
+        self.assertEqual(0, self._metrics.average("missing"))
+
+    @mock.patch('time.time')
+    def test_timer(self, mock_time):
+        mock_time.side_effect = [10, 10.002, 20, 20.5]
+
+        def fail():
+            with self._metrics.timer("command"):
+                raise ValueError()
+
+        with self._metrics.timer("command"):
+            pass
+        self.assertRaises(ValueError, fail)
+
+        latency = self._metrics.summary()["latency"]["command"]
+        self.assertEqual(2, latency["count"])
+        self.assertEqual({"le_5": 1, "le_500": 1}, latency["buckets"])
+
+    def test_timed(self):
+        @self._metrics.timed("function")
+        def function(value):
+            return value
+
+        self.assertEqual(mock.sentinel.value, function(mock.sentinel.value))
+        self.assertEqual(
+            1, self._metrics.summary()["latency"]["function"]["count"])
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "metrics.json")
+        self._metrics.increment("calls")
+
+        self._metrics.dump(path)
+
+        with open(path) as stats_file:
+            self.assertEqual(self._metrics.summary(),
+                             jsonutils.loads(stats_file.read()))
+        self.assertEqual(["metrics.json"], os.listdir(directory))
+
+    def test_dump_extra(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "metrics.json")
+
+        self._metrics.dump(path, {"retry_queue": {"device": 2}})
+
+        with open(path) as stats_file:
+            self.assertEqual({"device": 2},
+                             jsonutils.loads(stats_file.read())["retry_queue"])
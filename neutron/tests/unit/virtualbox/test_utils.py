@@ -0,0 +1,168 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the VirtualBox utilities
+"""
+
+import mock
+
+from neutron.plugins.virtualbox.common import utils
+from neutron.tests import base
+
+
+class TestLRUCache(base.BaseTestCase):
+
+    def test_get_set(self):
+        cache = utils.LRUCache(2)
+        cache.set(mock.sentinel.key1, mock.sentinel.value1)
+        cache.set(mock.sentinel.key2, mock.sentinel.value2)
+        # The first key becomes the most recently used one
+        self.assertEqual(mock.sentinel.value1,
+                         cache.get(mock.sentinel.key1))
+        cache.set(mock.sentinel.key3, mock.sentinel.value3)
+
+        self.assertEqual(2, len(cache))
+        self.assertIn(mock.sentinel.key1, cache)
+        self.assertNotIn(mock.sentinel.key2, cache)
+        self.assertIsNone(cache.get(mock.sentinel.key2))
+        self.assertEqual(mock.sentinel.value3,
+                         cache.get(mock.sentinel.key3))
+
+
+class TestPhysicalNetworkMappings(base.BaseTestCase):
+
+    def _get_mappings(self, mappings):
+        return utils.PhysicalNetworkMappings(
+            [(utils.PhysicalNetworkMappings.pattern(physical_network),
+              interface) for physical_network, interface in mappings])
+
+    def test_pattern(self):
+        self.assertEqual('phys\\.net.*',
+                         utils.PhysicalNetworkMappings.pattern('phys.net*'))
+
+    def test_lookup(self):
+        mappings = self._get_mappings([('physnet1', 'eth1'),
+                                       ('phys*', 'eth2'),
+                                       ('*', 'eth3')])
+
+        self.assertEqual('eth1', mappings.lookup('physnet1'))
+        self.assertEqual('eth2', mappings.lookup('physnet2'))
+        self.assertEqual('eth2', mappings.lookup('phys.net'))
+        self.assertEqual('eth3', mappings.lookup('other'))
+        self.assertEqual('eth3', mappings.lookup(None))
+
+    def test_lookup_first_match_wins(self):
+        mappings = self._get_mappings([('*', 'eth3'),
+                                       ('physnet1', 'eth1')])
+        self.assertEqual('eth3', mappings.lookup('physnet1'))
+
+    def test_lookup_missing(self):
+        mappings = self._get_mappings([('physnet*', 'eth1')])
+        self.assertIsNone(mappings.lookup('other'))
+        self.assertNotIn('other', mappings)
+        self.assertIn('physnet1', mappings)
+        self.assertIsNone(self._get_mappings([]).lookup('physnet1'))
+
+    def test_lookup_cached(self):
+        mappings = self._get_mappings([('physnet*', 'eth1')])
+        self.assertEqual('eth1', mappings.lookup('physnet1'))
+
+        with mock.patch.object(mappings, '_regex') as mock_regex:
+            self.assertEqual('eth1', mappings.lookup('physnet1'))
+            self.assertIn('physnet1', mappings)
+            self.assertFalse(mock_regex.match.called)
+
+
+class TestAdaptivePollingInterval(base.BaseTestCase):
+
+    def test_backoff(self):
+        polling = utils.AdaptivePollingInterval(2, 10)
+
+        waits = [polling.next_wait(index, 0.5, False) for index in range(9)]
+
+        # The interval is doubled after every three scans without changes
+        self.assertEqual([1.5, 1.5, 3.5, 3.5, 3.5, 7.5, 7.5, 7.5, 9.5],
+                         waits)
+        self.assertEqual(10, polling.interval)
+
+        # A change resets the interval
+        self.assertEqual(1.5, polling.next_wait(10, 0.5, True))
+        self.assertEqual(2, polling.interval)
+
+    def test_reset(self):
+        polling = utils.AdaptivePollingInterval(1, 10)
+        for index in range(3):
+            polling.next_wait(index, 0, False)
+        self.assertEqual(2, polling.interval)
+
+        polling.reset()
+
+        self.assertEqual(1, polling.interval)
+        self.assertEqual(1, polling.next_wait(3, 0, False))
+
+    def test_duty_cycle(self):
+        polling = utils.AdaptivePollingInterval(2, 10, max_duty_cycle=25)
+
+        # The scan took 3 seconds, at most 25% of the wall time
+        self.assertEqual(9, polling.next_wait(0, 3, True))
+        self.assertEqual(1.75, polling.next_wait(12, 0.25, True))
+
+    def test_statistics(self):
+        polling = utils.AdaptivePollingInterval(2, 10)
+        polling.next_wait(100, 3, True)
+        polling.next_wait(103, 1, False)
+
+        self.assertEqual({"interval": 2, "loop_duration": 3,
+                          "scan_duration": 1, "scans": 2, "overruns": 1},
+                         polling.statistics())
+
+
+class TestCircuitBreaker(base.BaseTestCase):
+
+    @mock.patch('random.uniform', side_effect=lambda low, high: high)
+    def test_backoff_delay(self, mock_uniform):
+        self.assertEqual([1, 2, 4, 5, 5],
+                         [utils.backoff_delay(attempt, 1, 5)
+                          for attempt in range(5)])
+        mock_uniform.assert_called_with(0, 2.5)
+
+    @mock.patch('time.time')
+    def test_circuit_breaker(self, mock_time):
+        mock_time.return_value = 100
+        breaker = utils.CircuitBreaker(threshold=2, timeout=10)
+
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow())
+
+        # A single probe is allowed after the timeout
+        mock_time.return_value = 110
+        self.assertEqual(utils.CircuitBreaker.HALF_OPEN, breaker.state)
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # The failed probe opens the circuit again
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+
+        mock_time.return_value = 120
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual({"state": "closed", "failures": 0, "trips": 1},
+                         breaker.statistics())
+        self.assertTrue(breaker.allow())
@@ -16,13 +16,18 @@
 Unit tests for VirtualBox Neutron agent
 """
 
+import copy
+import time
+
 import mock
 from oslo.config import cfg
+from oslo_serialization import jsonutils
 
 from neutron.common import constants as n_const
 from neutron.plugins.common import constants as p_const
 from neutron.plugins.virtualbox.common import exception as vbox_exc
 from neutron.plugins.virtualbox.agent import vbox_neutron_agent
+from neutron.plugins.virtualbox.common import metrics
 from neutron.tests import base
 
 
@@ -69,6 +74,174 @@ class TestVBoxNeutronAgent(base.BaseTestCase):
         self.agent.agent_id = mock.Mock()
         self.agent.agent_state = fake_agent_state
 
+    def test_get_interface(self):
+        cfg.CONF.set_override('physical_network_mappings',
+                              ['physnet1:eth1', 'phys*:eth2', 'invalid',
+                               'physnet1:eth3'], 'AGENT')
+        self.agent._physical_network_mappings.clear()
+        self.agent._load_physical_network_mappings()
+
+        self.assertEqual(['physnet1', 'phys.*'],
+                         list(self.agent._physical_network_mappings))
+        self.assertEqual('eth1', self.agent._get_interface('physnet1'))
+        self.assertEqual('eth2', self.agent._get_interface('physnet2'))
+        self.assertEqual('other', self.agent._get_interface('other'))
+        self.assertEqual('', self.agent._get_interface(None))
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.cache_statistics')
+    def test_report_state(self, mock_cache_statistics):
+        mock_cache_statistics.return_value = mock.sentinel.statistics
+        self.agent.state_rpc = mock.Mock()
+        self.agent._failed_devices = {
+            mock.sentinel.device: {'action': 'added', 'attempts': 2,
+                                   'retry_at': 0}}
+
+        self.agent._report_state()
+
+        self.agent.state_rpc.report_state.assert_called_once_with(
+            self.agent.context, self.agent.agent_state)
+        self.assertEqual(
+            mock.sentinel.statistics,
+            self.agent.agent_state['configurations']['vm_info_cache'])
+        self.assertEqual(
+            {'applied': 0, 'skipped': 0},
+            self.agent.agent_state['configurations']['nic_setup'])
+        self.assertEqual(
+            {'devices': 0, 'instances': 0, 'collisions': 0},
+            self.agent.agent_state['configurations']['device_index'])
+        self.assertEqual(
+            {'interval': cfg.CONF.AGENT.polling_interval, 'scans': 0,
+             'overruns': 0, 'loop_duration': 0, 'scan_duration': 0},
+            self.agent.agent_state['configurations']['polling'])
+        self.assertEqual(
+            ['loop_avg', 'rpc_errors', 'vbox_calls', 'vbox_errors',
+             'vbox_retries'],
+            sorted(self.agent.agent_state['configurations']['metrics']))
+        self.assertIn('state',
+                      self.agent.agent_state['configurations']['vbox_health'])
+        self.assertEqual(
+            {'size': 1, 'max_size': cfg.CONF.AGENT.max_failed_devices,
+             'sample': [mock.sentinel.device]},
+            self.agent.agent_state['configurations']['retry_queue'])
+        self.assertNotIn('start_flag', self.agent.agent_state)
+
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent.scan_devices')
+    def test_process_iteration_vbox_unavailable(self, mock_scan_devices):
+        breaker = mock.Mock()
+        breaker.is_open.side_effect = [True, False]
+        mock_scan_devices.side_effect = vbox_exc.VBoxUnavailable(
+            method=None, reason=None)
+
+        with mock.patch('neutron.plugins.virtualbox.common.vboxapi'
+                        '.get_circuit_breaker', return_value=breaker):
+            for _ in range(2):
+                self.assertEqual(
+                    (mock.sentinel.device_info, mock.sentinel.sync),
+                    self.agent._process_iteration(mock.sentinel.device_info,
+                                                  mock.sentinel.sync))
+
+        # The scan was paused while the circuit was open
+        mock_scan_devices.assert_called_once_with(
+            previous=mock.sentinel.device_info, sync=mock.sentinel.sync)
+
+    @mock.patch('neutron.plugins.virtualbox.common.metrics.Metrics.dump')
+    def test_export_metrics(self, mock_dump):
+        self.agent._export_metrics()
+        self.assertFalse(mock_dump.called)
+
+        cfg.CONF.set_override('metrics_file', mock.sentinel.path, 'AGENT')
+        mock_dump.side_effect = [None, IOError]
+        for _ in range(2):
+            self.agent._export_metrics()
+
+        mock_dump.assert_called_with(mock.sentinel.path, {'retry_queue': {}})
+        self.assertEqual(2, mock_dump.call_count)
+
+    def test_report_state_retry_queue_sample(self):
+        self.agent.state_rpc = mock.Mock()
+        self.agent._failed_devices = dict(
+            ('device-%03d' % index, {'action': 'added', 'attempts': 1,
+                                     'retry_at': 0})
+            for index in range(cfg.CONF.AGENT.max_failed_devices))
+
+        self.agent._report_state()
+
+        retry_queue = self.agent.agent_state['configurations']['retry_queue']
+        self.assertEqual(cfg.CONF.AGENT.max_failed_devices,
+                         retry_queue['size'])
+        self.assertEqual(['device-%03d' % index for index in range(
+            self.agent.RETRY_QUEUE_SAMPLE)], retry_queue['sample'])
+        self.assertLess(
+            len(jsonutils.dumps(self.agent.agent_state['configurations'])),
+            4095)
+
+    @mock.patch('time.time')
+    def test_report_state_statistics_interval(self, mock_time):
+        self.addCleanup(metrics.METRICS.reset)
+        cfg.CONF.set_override('statistics_report_interval', 300, 'AGENT')
+        self.agent.state_rpc = mock.Mock()
+        mock_time.return_value = 1000
+        self.agent._report_state()
+        configurations = copy.deepcopy(
+            self.agent.agent_state['configurations'])
+
+        metrics.METRICS.increment('vbox.calls')
+        mock_time.return_value = 1299
+        self.agent._report_state()
+        self.assertEqual(configurations,
+                         self.agent.agent_state['configurations'])
+
+        mock_time.return_value = 1300
+        self.agent._report_state()
+        self.assertEqual(
+            configurations['metrics']['vbox_calls'] + 1,
+            self.agent.agent_state['configurations']['metrics']['vbox_calls'])
+        self.assertEqual(3, self.agent.state_rpc.report_state.call_count)
+
+    def test_report_state_metrics_bounded(self):
+        self.addCleanup(metrics.METRICS.reset)
+        self.agent.state_rpc = mock.Mock()
+        for index in range(100):
+            metrics.METRICS.observe('vbox.command%d' % index, 0.1)
+
+        self.agent._report_state()
+
+        self.assertEqual(
+            5, len(self.agent.agent_state['configurations']['metrics']))
+
+    @mock.patch('neutron.plugins.virtualbox.common.metrics.Metrics.dump')
+    def test_export_metrics_retry_queue(self, mock_dump):
+        cfg.CONF.set_override('metrics_file', mock.sentinel.path, 'AGENT')
+        self.agent._failed_devices = {
+            mock.sentinel.device: {'action': 'added', 'attempts': 3,
+                                   'retry_at': 0}}
+
+        self.agent._export_metrics()
+
+        mock_dump.assert_called_once_with(
+            mock.sentinel.path, {'retry_queue': {mock.sentinel.device: 3}})
+
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent._add_devices')
+    def test_treat_devices_added_metrics(self, mock_add_devices):
+        self.addCleanup(metrics.METRICS.reset)
+        metrics.METRICS.reset()
+        mock_add_devices.return_value = {}
+        self.agent.plugin_rpc.get_devices_details_list.side_effect = [
+            [{"device": mock.sentinel.device}], Exception]
+
+        for _ in range(2):
+            self.agent.treat_devices_added([mock.sentinel.device])
+
+        summary = metrics.METRICS.summary()
+        self.assertEqual({'rpc.errors': 1}, summary['counters'])
+        for name, count in (('agent.treat_devices_added', 2),
+                            ('rpc.get_devices_details_list', 2),
+                            ('rpc.update_devices_up', 1)):
+            self.assertEqual(count, summary['latency'][name]['count'])
+
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '.devices')
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
@@ -83,32 +256,87 @@ class TestVBoxNeutronAgent(base.BaseTestCase):
         self.assertEqual(mock.sentinel.devices, devices)
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
-                '.setup_device')
-    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
-                '.VBoxNeutronAgent._get_interface_name')
+                '.devices')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.refresh')
+    def test_get_current_devices_watcher(self, mock_network_refresh,
+                                         mock_network_devices):
+        cfg.CONF.set_override('full_scan_interval', 60, 'AGENT')
+        self.agent._watcher = mock.Mock()
+        self.agent._full_scan_required = False
+        self.agent._last_full_scan = time.time()
+
+        # 1. Nothing changed
+        self.agent._get_current_devices()
+        self.assertEqual(0, mock_network_refresh.call_count)
+
+        # 2. Only the changed instances are inspected
+        self.agent._changed_instances = {mock.sentinel.instance}
+        self.agent._get_current_devices()
+        mock_network_refresh.assert_called_once_with(
+            {mock.sentinel.instance})
+        self.assertEqual(set(), self.agent._changed_instances)
+
+        # 3. The full scan was requested
+        mock_network_refresh.reset_mock()
+        self.agent._get_current_devices(full_scan=True)
+        mock_network_refresh.assert_called_once_with()
+
+    def test_wait_for_changes(self):
+        watcher = self.agent._watcher = mock.Mock()
+        watcher.wait.return_value = ({mock.sentinel.instance}, False)
+        self.agent._full_scan_required = False
+
+        self.agent._wait_for_changes(mock.sentinel.timeout)
+
+        watcher.wait.assert_called_once_with(mock.sentinel.timeout)
+        self.assertEqual({mock.sentinel.instance},
+                         self.agent._changed_instances)
+        self.assertFalse(self.agent._full_scan_required)
+
+    @mock.patch('time.sleep')
+    def test_wait_for_changes_fail(self, mock_sleep):
+        watcher = self.agent._watcher = mock.Mock()
+        watcher.wait.side_effect = [Exception]
+        self.agent._full_scan_required = False
+
+        self.agent._wait_for_changes(mock.sentinel.timeout)
+        watcher.stop.assert_called_once_with()
+        self.assertIsNone(self.agent._watcher)
+        self.assertTrue(self.agent._full_scan_required)
+
+        self.agent._wait_for_changes(1)
+        mock_sleep.assert_called_once_with(1)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxEventWatcher'
+                '.start')
+    def test_setup_watcher(self, mock_start):
+        cfg.CONF.set_override('watch_events', True, 'AGENT')
+        mock_start.side_effect = [None, vbox_exc.VBoxException(msg=None)]
+
+        self.agent._setup_watcher()
+        self.assertIsNotNone(self.agent._watcher)
+
+        self.agent._watcher = None
+        self.agent._setup_watcher()
+        self.assertIsNone(self.agent._watcher)
+
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '.device_exists')
-    def test_add_device(self, mock_device_exists, mock_if_name,
-                        mock_setup_device):
+    def test_check_device(self, mock_device_exists):
         mock_device_exists.return_value = True
-        mock_if_name.return_value = mock.sentinel.if_name
         device_info = {
             "port_id": mock.sentinel.port_id,
             "network_type": p_const.TYPE_FLAT,
             "physical_network": mock.sentinel.network
         }
-        status = self.agent._add_device(device_info)
 
+        self.assertTrue(self.agent._check_device(device_info))
         mock_device_exists.assert_called_once_with(mock.sentinel.port_id)
-        mock_if_name.assert_called_once_with(p_const.TYPE_FLAT,
-                                             mock.sentinel.network)
-        mock_setup_device.assert_called_once_with(mock.sentinel.port_id,
-                                                  mock.sentinel.if_name)
-        self.assertTrue(status)
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '.device_exists')
-    def test_add_device_fail(self, mock_device_exists):
+    def test_check_device_fail(self, mock_device_exists):
         mock_device_exists.return_value = False
         device_details = [
             # 1. Missing port id
@@ -126,77 +354,188 @@ class TestVBoxNeutronAgent(base.BaseTestCase):
         ]
 
         for device in device_details:
-            self.assertFalse(self.agent._add_device(device))
+            self.assertFalse(self.agent._check_device(device))
         mock_device_exists.assert_called_once_with(mock.sentinel.port_id)
 
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.setup_devices')
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent._get_interface_name')
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent._check_device')
+    def test_add_devices(self, mock_check_device, mock_if_name,
+                         mock_setup_devices):
+        mock_check_device.side_effect = [True, False]
+        mock_if_name.return_value = mock.sentinel.if_name
+        mock_setup_devices.return_value = {}
+        devices = [
+            {
+                "device": mock.sentinel.device,
+                "port_id": mock.sentinel.port_id,
+                "network_type": p_const.TYPE_FLAT,
+                "physical_network": mock.sentinel.network
+            },
+            {
+                "device": mock.sentinel.device2,
+                "port_id": mock.sentinel.port_id2,
+            },
+        ]
+
+        self.assertEqual({}, self.agent._add_devices(devices))
+        mock_if_name.assert_called_once_with(p_const.TYPE_FLAT,
+                                             mock.sentinel.network)
+        mock_setup_devices.assert_called_once_with(
+            {mock.sentinel.port_id: mock.sentinel.if_name}, set())
+
     @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
-                '.VBoxNeutronAgent._add_device')
-    def test_treat_devices_added(self, mock_add_device):
+                '.VBoxNeutronAgent._add_devices')
+    def test_treat_devices_added(self, mock_add_devices):
         devices = [{"device": mock.sentinel.device}]
         attrs = {'get_devices_details_list.return_value': devices}
         self.agent.plugin_rpc.configure_mock(**attrs)
+        mock_add_devices.return_value = {}
 
         with mock.patch.object(self.agent.plugin_rpc,
-                               "update_device_up") as mock_device_up:
-            sync_required = self.agent.treat_devices_added(
+                               "update_devices_up") as mock_devices_up:
+            failed_devices = self.agent.treat_devices_added(
                 mock.sentinel.devices)
 
-            mock_add_device.assert_called_once_with(devices[0])
-            self.assertFalse(sync_required)
-            self.assertTrue(mock_device_up.called)
+            mock_add_devices.assert_called_once_with(devices)
+            self.assertEqual(set(), failed_devices)
+            mock_devices_up.assert_called_once_with(
+                self.agent.context, [mock.sentinel.device],
+                self.agent.agent_id, cfg.CONF.host)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.setup_devices')
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent._check_device')
+    def test_treat_devices_added_admin_down(self, mock_check_device,
+                                            mock_setup_devices):
+        mock_check_device.return_value = True
+        mock_setup_devices.return_value = {}
+        devices = [
+            {"device": mock.sentinel.device, "port_id": mock.sentinel.port_id,
+             "admin_state_up": True, "network_type": p_const.TYPE_FLAT,
+             "physical_network": "eth1"},
+            {"device": mock.sentinel.device2,
+             "port_id": mock.sentinel.port_id2, "admin_state_up": False,
+             "network_type": p_const.TYPE_FLAT, "physical_network": "eth1"},
+        ]
+        self.agent.plugin_rpc.get_devices_details_list.return_value = devices
+
+        self.assertEqual(set(), self.agent.treat_devices_added(
+            [mock.sentinel.device, mock.sentinel.device2]))
+
+        mock_setup_devices.assert_called_once_with(
+            {mock.sentinel.port_id: "eth1", mock.sentinel.port_id2: "eth1"},
+            {mock.sentinel.port_id2})
+        self.agent.plugin_rpc.update_devices_up.assert_called_once_with(
+            self.agent.context, [mock.sentinel.device], self.agent.agent_id,
+            cfg.CONF.host)
+        self.agent.plugin_rpc.update_devices_down.assert_called_once_with(
+            self.agent.context, [mock.sentinel.device2], self.agent.agent_id,
+            cfg.CONF.host)
+
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent._add_devices')
+    def test_treat_devices_added_update_failed(self, mock_add_devices):
+        devices = [{"device": mock.sentinel.device}]
+        attrs = {'get_devices_details_list.return_value': devices,
+                 'update_devices_up.side_effect': Exception}
+        self.agent.plugin_rpc.configure_mock(**attrs)
+        mock_add_devices.return_value = {}
+
+        self.assertEqual({mock.sentinel.device},
+                         self.agent.treat_devices_added(
+                             mock.sentinel.devices))
 
     @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
-                '.VBoxNeutronAgent._add_device')
-    def test_treat_devices_added_binding_failed(self, mock_add_device):
+                '.VBoxNeutronAgent._add_devices')
+    def test_treat_devices_added_binding_failed(self, mock_add_devices):
         devices = [{"device": mock.sentinel.device,
                     "port_id": mock.sentinel.port_id}]
         attrs = {'get_devices_details_list.return_value': devices}
         self.agent.plugin_rpc.configure_mock(**attrs)
-        mock_add_device.side_effect = [
-            vbox_exc.VBoxManageError(method=None, reason=None)
-        ]
+        mock_add_devices.return_value = {
+            mock.sentinel.port_id: vbox_exc.VBoxManageError(method=None,
+                                                            reason=None)
+        }
 
         with mock.patch.object(self.agent.plugin_rpc,
-                               "update_device_up") as mock_device_up:
-            sync_required = self.agent.treat_devices_added(
+                               "update_devices_up") as mock_devices_up:
+            failed_devices = self.agent.treat_devices_added(
                 mock.sentinel.devices)
 
-            mock_add_device.assert_called_once_with(devices[0])
-            self.assertTrue(sync_required)
-            self.assertFalse(mock_device_up.called)
+            mock_add_devices.assert_called_once_with(devices)
+            self.assertEqual({mock.sentinel.device}, failed_devices)
+            self.assertFalse(mock_devices_up.called)
 
-    def test_treat_devices_added_returns_true_for_missing_device(self):
+    def test_treat_devices_added_details_failed(self):
         attrs = {'get_devices_details_list.side_effect': Exception()}
         self.agent.plugin_rpc.configure_mock(**attrs)
-        self.assertTrue(self.agent.treat_devices_added(mock.sentinel.devices))
+        self.assertEqual({mock.sentinel.device},
+                         self.agent.treat_devices_added(
+                             [mock.sentinel.device]))
 
     def test_treat_devices_removed(self):
-        sync = self.agent.treat_devices_removed([mock.sentinel.device])
+        failed_devices = self.agent.treat_devices_removed(
+            [mock.sentinel.device])
 
-        self.agent.plugin_rpc.update_device_down.assert_called_once_with(
-            self.agent.context, mock.sentinel.device, self.agent.agent_id,
+        self.agent.plugin_rpc.update_devices_down.assert_called_once_with(
+            self.agent.context, [mock.sentinel.device], self.agent.agent_id,
             cfg.CONF.host
         )
-        self.assertFalse(sync)
+        self.assertEqual(set(), failed_devices)
 
     def test_treat_devices_removed_fail(self):
-        self.agent.plugin_rpc.update_device_down.side_effect = [Exception]
-        sync = self.agent.treat_devices_removed([mock.sentinel.device])
+        self.agent.plugin_rpc.update_devices_down.side_effect = [Exception]
+        failed_devices = self.agent.treat_devices_removed(
+            [mock.sentinel.device])
 
-        self.agent.plugin_rpc.update_device_down.assert_called_once_with(
-            self.agent.context, mock.sentinel.device, self.agent.agent_id,
+        self.agent.plugin_rpc.update_devices_down.assert_called_once_with(
+            self.agent.context, [mock.sentinel.device], self.agent.agent_id,
             cfg.CONF.host
         )
-        self.assertTrue(sync)
+        self.assertEqual({mock.sentinel.device}, failed_devices)
 
+    @mock.patch('time.time', return_value=100)
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent.treat_devices_removed')
     @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
                 '.VBoxNeutronAgent.treat_devices_added')
+    def test_process_network_devices_backoff(self, mock_devices_added,
+                                             mock_devices_removed,
+                                             mock_time):
+        cfg.CONF.set_override('retry_interval', 2, 'AGENT')
+        cfg.CONF.set_override('max_retry_interval', 5, 'AGENT')
+        mock_devices_added.return_value = {mock.sentinel.device1}
+        mock_devices_removed.return_value = set()
+        device_info = {'added': {mock.sentinel.device1,
+                                 mock.sentinel.device2},
+                       'removed': {mock.sentinel.device3}}
+
+        for attempts, retry_at in ((1, 102), (2, 104), (3, 105)):
+            self.assertFalse(self.agent.process_network_devices(device_info))
+            self.assertEqual(
+                {mock.sentinel.device1: {'action': 'added',
+                                         'retry_at': retry_at,
+                                         'attempts': attempts}},
+                self.agent._failed_devices)
+
+        mock_devices_added.return_value = set()
+        self.agent.process_network_devices(device_info)
+        self.assertEqual({}, self.agent._failed_devices)
+
     @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
                 '.VBoxNeutronAgent.treat_devices_removed')
-    def process_network_devices(self, mock_devices_added,
-                                mock_devices_removed):
-        mock_devices_added.side_effect = [True, True, False]
-        mock_devices_removed.side_effect = [True, False, False]
+    def test_process_network_devices_too_many_failures(
+            self, mock_devices_removed):
+        cfg.CONF.set_override('max_failed_devices', 1, 'AGENT')
+        devices = {mock.sentinel.device1, mock.sentinel.device2}
+        mock_devices_removed.return_value = devices
+        self.assertTrue(
+            self.agent.process_network_devices({'removed': devices}))
 
     def _test_scan_devices(self, previous, fake_current,
                            expected, sync):
@@ -263,3 +602,156 @@ class TestVBoxNeutronAgent(base.BaseTestCase):
         }
         self._test_scan_devices(previous, fake_current, expected,
                                 sync=True)
+
+    @mock.patch('time.time', return_value=100)
+    def test_scan_devices_retries_failed_devices(self, mock_time):
+        self.agent._failed_devices = {
+            mock.sentinel.device1: {'action': 'added', 'attempts': 1,
+                                    'retry_at': 100},
+            mock.sentinel.device2: {'action': 'added', 'attempts': 1,
+                                    'retry_at': 101},
+            mock.sentinel.device3: {'action': 'removed', 'attempts': 1,
+                                    'retry_at': 99},
+            mock.sentinel.device4: {'action': 'added', 'attempts': 1,
+                                    'retry_at': 99},
+        }
+        previous = {
+            'current': {mock.sentinel.device1, mock.sentinel.device2,
+                        mock.sentinel.device4},
+            'added': set(),
+            'removed': {mock.sentinel.device3}
+        }
+        # mock.sentinel.device4 disappeared.
+        fake_current = {mock.sentinel.device1, mock.sentinel.device2}
+        expected = {
+            'current': {mock.sentinel.device1, mock.sentinel.device2},
+            'added': {mock.sentinel.device1},
+            'removed': {mock.sentinel.device3, mock.sentinel.device4}
+        }
+        self._test_scan_devices(previous, fake_current, expected,
+                                sync=False)
+        self.assertEqual(
+            {mock.sentinel.device1, mock.sentinel.device2,
+             mock.sentinel.device3},
+            set(self.agent._failed_devices))
+
+    def test_scan_devices_sync_clears_failed_devices(self):
+        self.agent._failed_devices = {
+            mock.sentinel.device1: {'action': 'added', 'attempts': 1,
+                                    'retry_at': 0}}
+        previous = {'current': set(), 'added': set(), 'removed': set()}
+        self._test_scan_devices(
+            previous, {mock.sentinel.device1},
+            {'current': {mock.sentinel.device1},
+             'added': {mock.sentinel.device1},
+             'removed': set()},
+            sync=True)
+        self.assertEqual({}, self.agent._failed_devices)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.device_exists')
+    def test_port_update(self, mock_device_exists):
+        mock_device_exists.side_effect = lambda port_id: (
+            port_id != mock.sentinel.unknown_port)
+
+        self.agent._polling.interval = mock.sentinel.interval
+
+        for port_id in (mock.sentinel.port_id, mock.sentinel.unknown_port,
+                        mock.sentinel.port_id2, mock.sentinel.port_id):
+            self.agent.port_update(mock.sentinel.context,
+                                   port={'id': port_id})
+        self.agent.port_delete(mock.sentinel.context,
+                               port_id=mock.sentinel.port_id2)
+
+        # The notifications reset the polling interval
+        self.assertEqual(cfg.CONF.AGENT.polling_interval,
+                         self.agent._polling.interval)
+        # Every port is queued once, with its last action
+        self.assertEqual(2, self.agent._work_queue.qsize())
+        self.assertEqual(mock.sentinel.port_id, self.agent._work_queue.get())
+        self.assertEqual(mock.sentinel.port_id2, self.agent._work_queue.get())
+        self.assertEqual({mock.sentinel.port_id: 'update',
+                          mock.sentinel.port_id2: 'delete'},
+                         self.agent._pending_work)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.device_exists')
+    def test_network_delete(self, mock_device_exists):
+        mock_device_exists.return_value = True
+        self.agent._network_map = {
+            mock.sentinel.network_id: {mock.sentinel.port_id},
+            mock.sentinel.network_id2: {mock.sentinel.port_id2},
+        }
+
+        self.agent.network_delete(mock.sentinel.context,
+                                  network_id=mock.sentinel.network_id)
+        self.agent.network_delete(mock.sentinel.context,
+                                  network_id=mock.sentinel.unknown_network)
+
+        self.assertEqual({mock.sentinel.port_id: 'delete'},
+                         self.agent._pending_work)
+        self.assertEqual({mock.sentinel.network_id2: {mock.sentinel.port_id2}},
+                         self.agent._network_map)
+
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent.treat_devices_added')
+    def test_process_work_update(self, mock_devices_added):
+        mock_devices_added.return_value = {mock.sentinel.port_id}
+        self.agent._pending_work[mock.sentinel.port_id] = 'update'
+
+        self.agent._process_work(mock.sentinel.port_id)
+
+        mock_devices_added.assert_called_once_with([mock.sentinel.port_id])
+        self.assertEqual({}, self.agent._pending_work)
+        # The failed port is retried by the agent loop
+        self.assertEqual('added', self.agent._failed_devices[
+            mock.sentinel.port_id]['action'])
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.disconnect_device')
+    def test_process_work_delete(self, mock_disconnect):
+        mock_disconnect.side_effect = [
+            True, vbox_exc.VBoxManageError(method=None, reason=None)]
+        self.agent._network_map = {
+            mock.sentinel.network_id: {mock.sentinel.port_id}}
+
+        for _ in range(2):
+            self.agent._pending_work[mock.sentinel.port_id] = 'delete'
+            self.agent._process_work(mock.sentinel.port_id)
+
+        mock_disconnect.assert_called_with(mock.sentinel.port_id)
+        self.assertEqual(2, mock_disconnect.call_count)
+        self.assertEqual({}, self.agent._network_map)
+
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent.treat_devices_added')
+    def test_process_work_processed(self, mock_devices_added):
+        # The action was already processed for a previous notification
+        self.agent._process_work(mock.sentinel.port_id)
+
+        self.assertFalse(mock_devices_added.called)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.setup_devices')
+    @mock.patch('neutron.plugins.virtualbox.agent.vbox_neutron_agent'
+                '.VBoxNeutronAgent._check_device')
+    def test_add_devices_network_map(self, mock_check_device,
+                                     mock_setup_devices):
+        mock_check_device.return_value = True
+        mock_setup_devices.return_value = {mock.sentinel.port_id2: None}
+        devices = [
+            {"device": mock.sentinel.port_id, "port_id": mock.sentinel.port_id,
+             "network_id": mock.sentinel.network_id,
+             "network_type": p_const.TYPE_FLAT, "physical_network": None},
+            {"device": mock.sentinel.port_id2,
+             "port_id": mock.sentinel.port_id2,
+             "network_id": mock.sentinel.network_id,
+             "network_type": p_const.TYPE_FLAT, "physical_network": None},
+        ]
+
+        self.agent._add_devices(devices)
+        self.assertEqual({mock.sentinel.network_id: {mock.sentinel.port_id}},
+                         self.agent._network_map)
+
+        self.agent.treat_devices_removed([mock.sentinel.port_id])
+        self.assertEqual({}, self.agent._network_map)
@@ -18,13 +18,81 @@ Unit tests for the VirtualBox API.
 
 import subprocess
 
+import eventlet
 import mock
 from oslo.config import cfg
+from oslo_serialization import jsonutils
 
 from neutron.plugins.virtualbox.common import constants
 from neutron.plugins.virtualbox.common import exception as vbox_exc
+from neutron.plugins.virtualbox.common import metrics
 from neutron.plugins.virtualbox.common import vboxapi
 from neutron.tests import base
+from neutron.tests.unit import virtualbox
+from neutron.tests.unit.virtualbox import fake_vboxapi
+
+
+class TestParseVMInfo(base.BaseTestCase):
+
+    def test_parse_vm_info(self):
+        information = vboxapi.parse_vm_info(
+            virtualbox.get_fixture('showvminfo_running.txt'))
+
+        self.assertEqual(
+            set([constants.VM_DESCRIPTION, constants.VM_STATE,
+                 constants.VM_CFG_FILE, constants.VM_NICS]),
+            set(information))
+        self.assertEqual(constants.RUNNING, information[constants.VM_STATE])
+        self.assertEqual(
+            "/var/lib/nova/instances/instance-00000001/"
+            "instance-00000001.vbox", information[constants.VM_CFG_FILE])
+        self.assertEqual(
+            {"network": {
+                "080027C1E5A1": "8d5a6b9e-3c2f-4a1d-9e8b-7f6a5c4d3b2a",
+                "080027C1E5A2": "1f2e3d4c-5b6a-4978-8695-a4b3c2d1e0f9"}},
+            jsonutils.loads(information[constants.VM_DESCRIPTION]))
+
+        nics = information[constants.VM_NICS]
+        self.assertEqual(["1", "2", "3"], sorted(nics))
+        self.assertEqual(
+            vboxapi.NetworkAdapter(
+                "1", nic=constants.NIC_MODE_BRIDGED, bridgeadapter="eth1",
+                nictype=constants.NIC_TYPE_82540EM, nicspeed="0",
+                macaddress="080027C1E5A1", cableconnected=constants.ON),
+            nics["1"])
+        self.assertEqual("vboxnet0", nics["2"].hostonlyadapter)
+        self.assertEqual(constants.OFF, nics["3"].cableconnected)
+
+    def test_parse_vm_info_fixtures(self):
+        for fixture in virtualbox.SHOWVMINFO_FIXTURES:
+            information = vboxapi.parse_vm_info(
+                virtualbox.get_fixture(fixture))
+            self.assertEqual(3, len(information[constants.VM_NICS]))
+
+    def test_parse_vm_info_index(self):
+        information = vboxapi.parse_vm_info(
+            'nic1="nat"\r\nnic12="bridged"\r\nmacaddress12="0800271"\r\n'
+            'nic13="none"\r\nmacaddress13="0800272"\r\nnicname="x"')
+
+        nics = information[constants.VM_NICS]
+        self.assertEqual(["1", "12"], sorted(nics))
+        self.assertEqual(constants.NIC_MODE_BRIDGED, nics["12"].nic)
+        self.assertEqual("0800271", nics["12"].macaddress)
+
+    def test_network_adapter(self):
+        nic = vboxapi.NetworkAdapter("1", nic=constants.NIC_MODE_NAT)
+
+        self.assertEqual(constants.NIC_MODE_NAT, nic[constants.NIC_MODE])
+        self.assertEqual(mock.sentinel.default,
+                         nic.get(constants.MAC_ADDRESS,
+                                 mock.sentinel.default))
+        nic.update({"instance": mock.sentinel.instance,
+                    constants.IS_CONNECTED: constants.ON})
+        self.assertEqual(mock.sentinel.instance, nic["instance"])
+        self.assertEqual(constants.ON, nic.cableconnected)
+        self.assertRaises(KeyError, nic.__getitem__, "missing")
+        self.assertRaises(KeyError, nic.__setitem__, "missing", None)
+        self.assertNotEqual(vboxapi.NetworkAdapter("1"), nic)
 
 
 class TestVBoxManage(base.BaseTestCase):
@@ -40,6 +108,7 @@ class TestVBoxManage(base.BaseTestCase):
 
         self._instance = "fake-instance"
         self._vbox_manage = vboxapi.VBoxManage()
+        mock.patch.object(vboxapi, '_CIRCUIT_BREAKER', None).start()
 
     @mock.patch('subprocess.Popen')
     def test_execute(self, mock_popen):
@@ -70,6 +139,66 @@ class TestVBoxManage(base.BaseTestCase):
         self.assertEqual(self._RETRY_COUNT, mock_popen.call_count)
         self.assertEqual(self._RETRY_COUNT, mock_communicate.call_count)
 
+    @mock.patch('time.sleep')
+    @mock.patch('subprocess.Popen')
+    def test_execute_transient_error(self, mock_popen, mock_sleep):
+        cfg.CONF.set_override('retry_interval', 1, 'virtualbox')
+        cfg.CONF.set_override('max_retry_interval', 2, 'virtualbox')
+        mock_process = mock_popen.return_value
+        mock_process.communicate.side_effect = [
+            (None, "NS_ERROR_CALL_FAILED"), (None, "NS_ERROR_CALL_FAILED"),
+            (mock.sentinel.stdout, None),
+            (None, self._FAKE_STDERR)]
+
+        self.assertEqual((mock.sentinel.stdout, None),
+                         self._vbox_manage._execute('command'))
+        # The permanent errors are not retried
+        self.assertEqual((None, self._FAKE_STDERR),
+                         self._vbox_manage._execute('command'))
+
+        self.assertEqual(4, mock_popen.call_count)
+        delays = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertEqual(2, len(delays))
+        self.assertTrue(0.5 <= delays[0] <= 1)
+        self.assertTrue(1 <= delays[1] <= 2)
+
+    @mock.patch('subprocess.Popen')
+    def test_execute_circuit_breaker(self, mock_popen):
+        cfg.CONF.set_override('breaker_threshold', 2, 'virtualbox')
+        mock_process = mock_popen.return_value
+        mock_process.communicate.return_value = (
+            None, constants.VBOX_E_ACCESSDENIED)
+
+        for _ in range(2):
+            self._vbox_manage._execute('command')
+        self.assertRaises(vbox_exc.VBoxUnavailable,
+                          self._vbox_manage._execute, 'command')
+
+        self.assertEqual(2 * self._RETRY_COUNT, mock_popen.call_count)
+        self.assertEqual({"state": "open", "failures": 2, "trips": 1},
+                         vboxapi.get_circuit_breaker().statistics())
+
+    def test_check_stderr_transient(self):
+        self.assertRaises(vbox_exc.VBoxUnavailable,
+                          self._vbox_manage._check_stderr,
+                          constants.VBOX_E_ACCESSDENIED)
+
+    @mock.patch('subprocess.Popen')
+    def test_execute_metrics(self, mock_popen):
+        self.addCleanup(metrics.METRICS.reset)
+        metrics.METRICS.reset()
+        mock_process = mock.Mock()
+        mock_popen.return_value = mock_process
+        mock_process.communicate.side_effect = [
+            (None, constants.VBOX_E_ACCESSDENIED), (None, None)]
+
+        self._vbox_manage._execute('showvminfo', self._instance)
+
+        summary = metrics.METRICS.summary()
+        self.assertEqual({"vbox.calls": 1, "vbox.retries": 1},
+                         summary["counters"])
+        self.assertEqual(1, summary["latency"]["vbox.showvminfo"]["count"])
+
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
                 '._execute')
     def test_list(self, mock_execute):
@@ -83,16 +212,17 @@ class TestVBoxManage(base.BaseTestCase):
                 '._execute')
     def test_show_vm_info(self, mock_execute):
         mock_execute.side_effect = [
-            ('"a"="b"', None), ('\n"a"="b"\n', None), ('"a" = "b"', None),
-            ('"none"="none"', None)
+            ('"VMState"="running"', None), ('\nVMState="running"\n', None),
+            ('"VMState" = "running"', None), ('description="none"', None)
         ]
 
         for _ in range(3):
             response = self._vbox_manage.show_vm_info(self._instance)
-            self.assertEqual({'a': 'b'}, response)
+            self.assertEqual({constants.VM_STATE: constants.RUNNING,
+                              constants.VM_NICS: {}}, response)
 
         response = self._vbox_manage.show_vm_info(self._instance)
-        self.assertIsNone(response["none"])
+        self.assertIsNone(response[constants.VM_DESCRIPTION])
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
                 '._execute')
@@ -103,7 +233,8 @@ class TestVBoxManage(base.BaseTestCase):
         self.assertRaises(vbox_exc.VBoxManageError,
                           self._vbox_manage.show_vm_info,
                           self._instance)
-        self.assertEqual({}, self._vbox_manage.show_vm_info(self._instance))
+        self.assertEqual({constants.VM_NICS: {}},
+                         self._vbox_manage.show_vm_info(self._instance))
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
                 '._execute')
@@ -117,6 +248,28 @@ class TestVBoxManage(base.BaseTestCase):
             constants.FIELD_NIC % {"index": 1},
             mock.sentinel.value)
 
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
+                '._execute')
+    def test_modify_networks(self, mock_execute):
+        mock_execute.return_value = [None, None]
+        self._vbox_manage.modify_networks(
+            self._instance,
+            [(1, [(constants.FIELD_NIC_MODE, mock.sentinel.value)]),
+             (2, [(constants.FIELD_NIC_MODE, mock.sentinel.value2)])])
+
+        mock_execute.assert_called_once_with(
+            self._vbox_manage.MODIFY_VM, self._instance,
+            constants.FIELD_NIC_MODE % {"index": 1}, mock.sentinel.value,
+            constants.FIELD_NIC_MODE % {"index": 2}, mock.sentinel.value2)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
+                '._execute')
+    def test_modify_networks_fail(self, mock_execute):
+        mock_execute.return_value = [None, self._FAKE_STDERR]
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._vbox_manage.modify_networks,
+                          self._instance, [])
+
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
                 '._execute')
     def test_update_network(self, mock_execute):
@@ -130,6 +283,176 @@ class TestVBoxManage(base.BaseTestCase):
             mock.sentinel.value)
 
 
+class TestVBoxAPI(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestVBoxAPI, self).setUp()
+        mock.patch('neutron.plugins.virtualbox.common.vboxapi.vbox_sdk',
+                   fake_vboxapi).start()
+        mock.patch('neutron.plugins.virtualbox.common.vboxapi._VBOX_MANAGER',
+                   None).start()
+
+        self._vbox_api = vboxapi.VBoxAPI()
+        self._virtualbox = self._vbox_api._virtualbox
+        self._machine = self._virtualbox.register(
+            fake_vboxapi.FakeMachine("fake-instance", "fake-description"))
+        self._adapter = self._machine.getNetworkAdapter(0)
+
+    def test_list(self):
+        running = self._virtualbox.register(
+            fake_vboxapi.FakeMachine("running-instance", state=5))
+
+        self.assertEqual(
+            '"fake-instance" {%s}\n"running-instance" {%s}' % (
+                self._machine.id, running.id),
+            self._vbox_api.list(constants.VMS_INFO))
+        self.assertEqual('"running-instance" {%s}' % running.id,
+                         self._vbox_api.list(constants.RUNNINGVMS_INFO))
+        self.assertRaises(vbox_exc.VBoxManageError, self._vbox_api.list,
+                          mock.sentinel.info)
+
+    def test_show_vm_info(self):
+        self._adapter.attachmentType = 2    # Bridged
+        self._adapter.bridgedInterface = "eth0"
+
+        information = self._vbox_api.show_vm_info("fake-instance")
+
+        self.assertEqual("fake-description",
+                         information[constants.VM_DESCRIPTION])
+        self.assertEqual(constants.POWER_OFF, information[constants.VM_STATE])
+        self.assertEqual(self._machine.settingsFilePath,
+                         information[constants.VM_CFG_FILE])
+        self.assertEqual(["1"], list(information[constants.VM_NICS]))
+        nic = information[constants.VM_NICS]["1"]
+        self.assertEqual(constants.NIC_MODE_BRIDGED, nic.nic)
+        self.assertEqual(constants.NIC_TYPE_82540EM, nic.nictype)
+        self.assertEqual(constants.ON, nic.cableconnected)
+        self.assertEqual("eth0", nic.bridgeadapter)
+        self.assertEqual(self._adapter.MACAddress, nic.macaddress)
+        self.assertIsNone(nic.hostonlyadapter)
+
+    def test_show_vm_info_fail(self):
+        self.assertRaises(vbox_exc.InstanceNotFound,
+                          self._vbox_api.show_vm_info, "missing-instance")
+
+    def test_modify_network(self):
+        self._vbox_api.modify_network(
+            "fake-instance", "1",
+            [
+                (constants.FIELD_NIC_TYPE, constants.NIC_TYPE_VIRTIO),
+                (constants.FIELD_NIC_MODE, constants.NIC_MODE_HOSTONLY),
+                (constants.FIELD_HOSTONLY_ADAPTER, "vboxnet0"),
+                (constants.FIELD_CABLE_CONNECTED, constants.OFF)
+            ])
+
+        self.assertEqual(6, self._adapter.adapterType)
+        self.assertEqual(4, self._adapter.attachmentType)
+        self.assertEqual("vboxnet0", self._adapter.hostOnlyInterface)
+        self.assertFalse(self._adapter.cableConnected)
+        self.assertEqual(1, self._machine.saved)
+        self.assertFalse(self._machine.locked)
+
+    def test_modify_networks(self):
+        adapter2 = self._machine.getNetworkAdapter(1)
+
+        self._vbox_api.modify_networks(
+            "fake-instance",
+            [("1", [(constants.FIELD_NIC_MODE, constants.NIC_MODE_BRIDGED)]),
+             ("2", [(constants.FIELD_NIC_MODE, constants.NIC_MODE_BRIDGED)])])
+
+        self.assertEqual(2, self._adapter.attachmentType)
+        self.assertEqual(2, adapter2.attachmentType)
+        self.assertTrue(adapter2.enabled)
+        self.assertEqual(1, self._machine.saved)
+
+    def test_modify_network_running(self):
+        self._machine.state = 5
+
+        self.assertRaises(vbox_exc.InstanceInvalidState,
+                          self._vbox_api.modify_network, "fake-instance", "1",
+                          [(constants.FIELD_NIC_MODE,
+                            constants.NIC_MODE_BRIDGED)])
+        self.assertEqual(0, self._machine.saved)
+
+    def test_update_network(self):
+        self._machine.state = 5
+        self._adapter.cableConnected = False
+
+        self._vbox_api.update_network(
+            "fake-instance", "1", constants.FIELD_NIC,
+            (constants.NIC_MODE_BRIDGED, "eth1"))
+        self._vbox_api.update_network(
+            "fake-instance", "1", constants.FIELD_LINK_STATE,
+            (constants.ON, ))
+
+        self.assertEqual(2, self._adapter.attachmentType)
+        self.assertEqual("eth1", self._adapter.bridgedInterface)
+        self.assertTrue(self._adapter.cableConnected)
+        self.assertFalse(self._machine.locked)
+
+    def test_get_backend(self):
+        cfg.CONF.set_override('backend', 'api', 'virtualbox')
+        self.assertIsInstance(vboxapi.get_backend(), vboxapi.VBoxAPI)
+
+        with mock.patch('neutron.plugins.virtualbox.common.vboxapi'
+                        '.vbox_sdk', None):
+            self.assertIsInstance(vboxapi.get_backend(), vboxapi.VBoxManage)
+
+        cfg.CONF.set_override('backend', 'vboxmanage', 'virtualbox')
+        self.assertIsInstance(vboxapi.get_backend(), vboxapi.VBoxManage)
+
+
+class TestDeviceIndex(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestDeviceIndex, self).setUp()
+        self._index = vboxapi.DeviceIndex()
+        self._nic = vboxapi.NetworkAdapter("1", macaddress="0800270000A1")
+        self._nic2 = vboxapi.NetworkAdapter("2", macaddress="0800270000A2")
+
+    def test_update_instance(self):
+        self.assertEqual(set(), self._index.update_instance(
+            "instance", {"port": self._nic, "port2": self._nic2}))
+
+        self.assertEqual(2, len(self._index))
+        self.assertIn("port", self._index)
+        self.assertIs(self._nic, self._index.get("port"))
+        self.assertEqual("port2", self._index.port_by_mac("0800270000A2"))
+        self.assertEqual({"port", "port2"}, self._index.ports())
+        self.assertEqual({"instance"}, self._index.instances())
+        self.assertEqual({"port", "port2"},
+                         self._index.instance_ports("instance"))
+
+        # The ports of the instance are replaced
+        self._index.update_instance("instance", {"port2": self._nic2})
+        self.assertEqual({"port2"}, self._index.ports())
+        self.assertIsNone(self._index.port_by_mac("0800270000A1"))
+
+    def test_update_instance_collision(self):
+        self._nic.instance = "instance"
+        self._index.update_instance("instance", {"port": self._nic})
+        clone = vboxapi.NetworkAdapter("1", macaddress="0800270000A1")
+
+        self.assertEqual({"port", "port2"}, self._index.update_instance(
+            "clone", {"port": self._nic2, "port2": clone}))
+
+        self.assertEqual({"port"}, self._index.ports())
+        self.assertIs(self._nic, self._index.get("port"))
+        self.assertEqual({"instance"}, self._index.instances())
+        self.assertEqual(2, self._index.collisions)
+
+    def test_remove_instance(self):
+        self._index.update_instance("instance", {"port": self._nic})
+        self._index.update_instance("instance2", {"port2": self._nic2})
+
+        self._index.remove_instance("instance")
+        self._index.remove_instance("missing")
+
+        self.assertEqual({"port2"}, self._index.ports())
+        self.assertEqual(set(), self._index.instance_ports("instance"))
+        self.assertIsNone(self._index.port_by_mac("0800270000A1"))
+
+
 class TestVBoxNetworkManage(base.BaseTestCase):
 
     def setUp(self):
@@ -152,87 +475,320 @@ class TestVBoxNetworkManage(base.BaseTestCase):
     @mock.patch('oslo_serialization.jsonutils.loads')
     def test_process_description(self, mock_loads):
         mock_loads.return_value = {
-            'network': {mock.sentinel.device: mock.sentinel.mac_address}
+            'network': {mock.sentinel.mac_address: mock.sentinel.device}
         }
-        self._network._process_description(mock.sentinel.description)
+        response = self._network._process_description(
+            mock.sentinel.description)
 
         mock_loads.assert_called_once_with(mock.sentinel.description)
-        self.assertTrue(mock.sentinel.device in
-                        self._network._device_map)
-        self.assertEqual(mock.sentinel.mac_address,
-                         self._network._device_map[mock.sentinel.device])
+        self.assertEqual({mock.sentinel.mac_address: mock.sentinel.device},
+                         response)
+        self.assertEqual(set(), self._network.devices())
 
     @mock.patch('oslo_serialization.jsonutils.loads')
     def test_process_description_fail(self, mock_loads):
-        mock_loads.side_effect = [{}, ValueError()]
+        mock_loads.side_effect = [{}, ValueError(), {"network": []}]
 
-        for _ in range(2):
-            self.assertFalse(self._network._process_description(
+        for _ in range(3):
+            self.assertIsNone(self._network._process_description(
                 mock.sentinel.description))
-        self.assertFalse(self._network._process_description(None))
+        self.assertIsNone(self._network._process_description(None))
 
-    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
-                '._process_description')
+    @mock.patch('os.stat')
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
                 '.show_vm_info')
-    def test_inspect_instance(self, mock_vm_info, mock_process_desc):
-        index = "1"
-        expected_nic = {
-            mock.sentinel.device: {
-                "index": index,
-                "instance": self._instance,
-                "state": mock.sentinel.power_state,
-                constants.MAC_ADDRESS: mock.sentinel.address,
-                constants.NIC_MODE: mock.sentinel.nic_mode,
-            }
-        }
+    def test_get_vm_info(self, mock_vm_info, mock_stat):
+        mock_vm_info.return_value = {
+            constants.VM_CFG_FILE: mock.sentinel.cfg_file}
+        mock_stat.return_value = mock.Mock(st_mtime=1, st_size=1)
+
+        for _ in range(2):
+            self.assertEqual(mock_vm_info.return_value,
+                             self._network._get_vm_info(self._instance))
+
+        # The settings file was changed
+        mock_stat.return_value = mock.Mock(st_mtime=2, st_size=1)
+        self._network._get_vm_info(self._instance)
+
+        self.assertEqual(2, mock_vm_info.call_count)
+        mock_stat.assert_called_with(mock.sentinel.cfg_file)
+        self.assertEqual({"hits": 1, "misses": 2, "size": 1},
+                         self._network.cache_statistics())
+
+    @mock.patch('os.stat')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
+                '.show_vm_info')
+    def test_get_vm_info_state_changed(self, mock_vm_info, mock_stat):
         mock_vm_info.return_value = {
+            constants.VM_CFG_FILE: mock.sentinel.cfg_file,
+            constants.VM_STATE: constants.POWER_OFF}
+        mock_stat.return_value = mock.Mock(st_mtime=1, st_size=1)
+        self._network._get_vm_info(self._instance)
+
+        # Still stopped during a full scan
+        self._network._running_instances = set()
+        self._network._get_vm_info(self._instance)
+        # Started, without changing the settings file
+        self._network._running_instances = {self._instance}
+        self._network._get_vm_info(self._instance)
+
+        self.assertEqual(2, mock_vm_info.call_count)
+        self.assertEqual({"hits": 1, "misses": 2, "size": 1},
+                         self._network.cache_statistics())
+
+    @mock.patch('os.stat')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
+                '.show_vm_info')
+    def test_get_vm_info_no_cache(self, mock_vm_info, mock_stat):
+        mock_vm_info.return_value = {
+            constants.VM_CFG_FILE: mock.sentinel.cfg_file}
+        mock_stat.side_effect = OSError
+
+        for _ in range(2):
+            self._network._get_vm_info(self._instance)
+
+        self.assertEqual(2, mock_vm_info.call_count)
+        self.assertEqual({"hits": 0, "misses": 2, "size": 0},
+                         self._network.cache_statistics())
+
+    def _instance_info(self, ports, state=constants.RUNNING):
+        """Return the information for a virtual machine which uses a NIC
+        for each received (port id, MAC address) pair.
+        """
+        nics = {}
+        for index, (_, mac_address) in enumerate(ports):
+            nics[str(index + 1)] = vboxapi.NetworkAdapter(
+                str(index + 1), nic=constants.NIC_MODE_BRIDGED,
+                macaddress=mac_address)
+        description = jsonutils.dumps({"network": dict(
+            (mac_address, port_id) for port_id, mac_address in ports)})
+        return {
+            constants.VM_STATE: state,
+            constants.VM_DESCRIPTION: description,
+            constants.VM_NICS: nics,
+        }
+
+    def _add_instance(self, instance_name, port_id, mac_address):
+        """Add an already inspected instance to the device index."""
+        nic = vboxapi.NetworkAdapter("1", macaddress=mac_address)
+        nic.instance = instance_name
+        self._network._devices.update_instance(instance_name, {port_id: nic})
+        self._network._inspected[instance_name] = (
+            {}, None, {mac_address: port_id})
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._process_description')
+    def test_inspect_instance(self, mock_process_desc):
+        nic = vboxapi.NetworkAdapter("1", nic=mock.sentinel.nic_mode,
+                                     macaddress=mock.sentinel.address)
+        other_nic = vboxapi.NetworkAdapter(
+            "2", nic=mock.sentinel.nic_mode,
+            macaddress=mock.sentinel.other_address)
+        instance_info = {
             constants.VM_STATE: mock.sentinel.power_state,
             constants.VM_DESCRIPTION: mock.sentinel.description,
-            constants.NIC_MODE + index: mock.sentinel.nic_mode,
-            constants.MAC_ADDRESS + index: mock.sentinel.address,
+            constants.VM_NICS: {"1": nic, "2": other_nic},
         }
-        self._network._device_map[mock.sentinel.address] = mock.sentinel.device
+        mock_process_desc.return_value = {
+            mock.sentinel.address: mock.sentinel.device}
 
-        self._network._inspect_instance(self._instance)
+        for _ in range(2):
+            self._network._inspect_instance(self._instance, instance_info)
 
-        mock_vm_info.assert_called_once_with(self._instance)
+        # The unchanged instance was not inspected again
         mock_process_desc.assert_called_once_with(mock.sentinel.description)
-        self.assertTrue(mock.sentinel.device in self._network._nic)
-        self.assertEqual(expected_nic, self._network._nic)
+        self.assertEqual({mock.sentinel.device}, self._network.devices())
+        self.assertIs(nic, self._network.get_device(mock.sentinel.device))
+        self.assertEqual({mock.sentinel.device},
+                         self._network.instance_devices(self._instance))
+        self.assertEqual("1", nic["index"])
+        self.assertEqual(self._instance, nic["instance"])
+        self.assertEqual(mock.sentinel.power_state, nic["state"])
+
+        # The description is decoded only if it was changed
+        self._network._inspect_instance(self._instance, dict(instance_info))
+        self.assertEqual(1, mock_process_desc.call_count)
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._process_description')
+    def test_inspect_instance_fail(self, mock_process_desc):
+        self._network._inspect_instance(
+            self._instance, self._instance_info([("port", "0800270000A1")]))
+        mock_process_desc.return_value = None
+
+        self.assertIsNone(self._network._inspect_instance(self._instance, {}))
+        self.assertEqual(set(), self._network.devices())
+        self.assertEqual({}, self._network._inspected)
+
+    def test_inspect_instance_updates_only_instance(self):
+        self._network._inspect_instance(
+            "instance-1", self._instance_info([("port-1", "0800270000A1"),
+                                               ("port-2", "0800270000A2")]))
+        self._network._inspect_instance(
+            "instance-2", self._instance_info([("port-3", "0800270000B1")]))
+
+        # A stale description does not shadow the other instances
+        self._network._inspect_instance(
+            "instance-1", self._instance_info([("port-1", "0800270000A1")]))
+
+        self.assertEqual({"port-1", "port-3"}, self._network.devices())
+        self.assertEqual({"port-1"},
+                         self._network.instance_devices("instance-1"))
+        self.assertEqual("instance-2",
+                         self._network.get_device("port-3")["instance"])
+
+    def test_inspect_instance_collision(self):
+        self._network._inspect_instance(
+            "instance-1", self._instance_info([("port-1", "0800270000A1")]))
+        clone_info = self._instance_info([("port-1", "0800270000A1"),
+                                          ("port-2", "0800270000A2")])
+        self._network._inspect_instance("instance-2", clone_info)
+
+        self.assertEqual("instance-1",
+                         self._network.get_device("port-1")["instance"])
+        self.assertEqual({"port-2"},
+                         self._network.instance_devices("instance-2"))
+        self.assertEqual({"devices": 2, "instances": 2, "collisions": 1},
+                         self._network.index_statistics())
+
+        # The instance is inspected again after the conflict is solved
+        self._network._forget_instance("instance-1")
+        self._network._inspect_instance("instance-2", clone_info)
+        self.assertEqual({"port-1", "port-2"},
+                         self._network.instance_devices("instance-2"))
+
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
-            '.show_vm_info')
-    def test_inspect_instance_fail(self, mock_vm_info, mock_process_desc):
+                '.show_vm_info')
+    def test_fetch_instance(self, mock_vm_info):
+        instance_info = {constants.VM_STATE: constants.RUNNING}
         mock_vm_info.side_effect = [
+            instance_info,
             vbox_exc.InstanceNotFound(instance=self._instance),
-            {}
+            vbox_exc.VBoxManageError(method=None, reason=None),
         ]
-        mock_process_desc.return_value = False
 
-        for _ in range(2):
-            self.assertIsNone(self._network._inspect_instance(self._instance))
+        self.assertEqual((self._instance, instance_info),
+                         self._network._fetch_instance(self._instance))
+        self.assertEqual((self._instance, {}),
+                         self._network._fetch_instance(self._instance))
+        self.assertEqual((self._instance, None),
+                         self._network._fetch_instance(self._instance))
+
+    def test_fetch_instances(self):
+        instances = ["instance-%d" % index for index in range(10)]
+
+        for workers in (1, 4):
+            cfg.CONF.set_override('inspect_workers', workers, 'virtualbox')
+            with mock.patch.object(self._network, '_fetch_instance') as fetch:
+                fetch.side_effect = lambda name: (name, {})
+                response = list(self._network._fetch_instances(instances))
+
+            self.assertEqual([(name, {}) for name in instances], response)
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._inspect_instance')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._fetch_instance')
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._instances')
-    def test_refresh(self, mock_instances, mock_inspect):
+    def test_refresh(self, mock_instances, mock_fetch, mock_inspect):
         mock_instances.return_value = iter([mock.sentinel.instance])
+        mock_fetch.return_value = (mock.sentinel.instance,
+                                   mock.sentinel.instance_info)
+        self._network.refresh()
+
+        mock_fetch.assert_called_once_with(mock.sentinel.instance)
+        mock_inspect.assert_called_once_with(mock.sentinel.instance,
+                                             mock.sentinel.instance_info)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._inspect_instance')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._fetch_instance')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._instances')
+    def test_refresh_keeps_failed_instances(self, mock_instances, mock_fetch,
+                                            mock_inspect):
+        self._add_instance(self._instance, "port", "0800270000A1")
+        self._add_instance(mock.sentinel.instance2, "port2", "0800270000A2")
+        mock_instances.return_value = iter([self._instance])
+        mock_fetch.return_value = (self._instance, None)
+
+        self._network.refresh()
+
+        self.assertEqual(0, mock_inspect.call_count)
+        self.assertEqual({"port"}, self._network.devices())
+        self.assertEqual({self._instance}, set(self._network._inspected))
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._inspect_instance')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._fetch_instance')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._instances')
+    def test_refresh_instances(self, mock_instances, mock_fetch,
+                               mock_inspect):
+        self._add_instance(self._instance, "port", "0800270000A1")
+        self._add_instance(mock.sentinel.instance2, "port2", "0800270000A2")
+        mock_fetch.return_value = (self._instance, {})
+
+        self._network.refresh([self._instance])
+
+        self.assertEqual(0, mock_instances.call_count)
+        mock_fetch.assert_called_once_with(self._instance)
+        self.assertEqual(0, mock_inspect.call_count)
+        self.assertEqual({"port2"}, self._network.devices())
+        self.assertIsNone(self._network._devices.port_by_mac("0800270000A1"))
+        self.assertEqual("port2",
+                         self._network._devices.port_by_mac("0800270000A2"))
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._list_instances')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._fetch_instance')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._instances')
+    def test_refresh_evicts_cache(self, mock_instances, mock_fetch,
+                                  mock_list_instances):
+        self._network._vm_info = {
+            self._instance: mock.sentinel.cached,
+            mock.sentinel.instance2: mock.sentinel.cached2,
+        }
+        mock_instances.return_value = iter([self._instance])
+        mock_fetch.return_value = (self._instance, None)
+        mock_list_instances.return_value = iter([])
+
+        self._network.refresh()
+
+        self.assertEqual({self._instance: mock.sentinel.cached},
+                         self._network._vm_info)
+        mock_list_instances.assert_called_once_with(
+            constants.RUNNINGVMS_INFO)
+        self.assertIsNone(self._network._running_instances)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._list_instances')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._fetch_instance')
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '._instances')
+    def test_refresh_empty_cache(self, mock_instances, mock_fetch,
+                                 mock_list_instances):
+        mock_instances.return_value = iter([self._instance])
+        mock_fetch.return_value = (self._instance, None)
+
         self._network.refresh()
 
-        mock_inspect.assert_called_once_with(mock.sentinel.instance)
+        self.assertFalse(mock_list_instances.called)
 
     def test_device_exists(self):
-        self._network._nic[mock.sentinel.device_id] = None
+        self._network._devices._ports[mock.sentinel.device_id] = None
 
         self.assertTrue(self._network.device_exists(mock.sentinel.device_id))
         self.assertFalse(self._network.device_exists(mock.sentinel.device_id2))
 
     def test_devices(self):
-        self._network._nic = {
+        self._network._devices._ports = {
             mock.sentinel.device_id: None,
             mock.sentinel.device_id2: None
         }
@@ -240,51 +796,49 @@ class TestVBoxNetworkManage(base.BaseTestCase):
         self.assertEqual({mock.sentinel.device_id, mock.sentinel.device_id2},
                          self._network.devices())
 
-    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
-                '.modify_network')
-    def test_modify_network(self, mock_modify_network):
-        self._network._local_network = False
-        device = {
-            "instance": self._instance,
-            "index": mock.sentinel.index
-        }
+    def _test_modify_network(self, local_network, adapter, nic_mode):
+        self._network._local_network = local_network
+        devices = [
+            ({"index": mock.sentinel.index}, mock.sentinel.network, True),
+            ({"index": mock.sentinel.index2}, mock.sentinel.network2, False),
+        ]
 
-        self._network._modify_network(device, mock.sentinel.network)
-        mock_modify_network.assert_called_once_with(
-            self._instance, mock.sentinel.index,
+        with mock.patch.object(self._network._vbox,
+                               'modify_networks') as mock_modify_networks:
+            self._network._modify_network(self._instance, devices)
+
+        mock_modify_networks.assert_called_once_with(
+            self._instance,
             [
-                (constants.FIELD_NIC_TYPE, mock.sentinel.nic_type),
-                (constants.FIELD_NIC_MODE, constants.NIC_MODE_BRIDGED),
-                (constants.FIELD_BRIDGE_ADAPTER, mock.sentinel.network),
-                (constants.FIELD_CABLE_CONNECTED, constants.ON)
+                (mock.sentinel.index, [
+                    (constants.FIELD_NIC_TYPE, mock.sentinel.nic_type),
+                    (constants.FIELD_NIC_MODE, nic_mode),
+                    (adapter, mock.sentinel.network),
+                    (constants.FIELD_CABLE_CONNECTED, constants.ON)
+                ]),
+                (mock.sentinel.index2, [
+                    (constants.FIELD_NIC_TYPE, mock.sentinel.nic_type),
+                    (constants.FIELD_NIC_MODE, nic_mode),
+                    (adapter, mock.sentinel.network2),
+                    (constants.FIELD_CABLE_CONNECTED, constants.OFF)
+                ]),
             ]
         )
 
-    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
-                '.modify_network')
-    def test_modify_network_local(self, mock_modify_network):
-        self._network._local_network = True
-        device = {
-            "instance": self._instance,
-            "index": mock.sentinel.index
-        }
+    def test_modify_network(self):
+        self._test_modify_network(False, constants.FIELD_BRIDGE_ADAPTER,
+                                  constants.NIC_MODE_BRIDGED)
 
-        self._network._modify_network(device, mock.sentinel.network)
-        mock_modify_network.assert_called_once_with(
-            self._instance, mock.sentinel.index,
-            [
-                (constants.FIELD_NIC_TYPE, mock.sentinel.nic_type),
-                (constants.FIELD_NIC_MODE, constants.NIC_MODE_HOSTONLY),
-                (constants.FIELD_HOSTONLY_ADAPTER, mock.sentinel.network),
-                (constants.FIELD_CABLE_CONNECTED, constants.ON)
-            ]
-        )
+    def test_modify_network_local(self):
+        self._test_modify_network(True, constants.FIELD_HOSTONLY_ADAPTER,
+                                  constants.NIC_MODE_HOSTONLY)
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
                 '.update_network')
     def test_update_network(self, mock_update_network):
         self._network._local_network = False
         device = {
+            "state": constants.RUNNING,
             "instance": self._instance,
             "index": mock.sentinel.index
         }
@@ -309,6 +863,7 @@ class TestVBoxNetworkManage(base.BaseTestCase):
     def test_update_network_local(self, mock_update_network):
         self._network._local_network = True
         device = {
+            "state": constants.RUNNING,
             "instance": self._instance,
             "index": mock.sentinel.index
         }
@@ -328,48 +883,312 @@ class TestVBoxNetworkManage(base.BaseTestCase):
             )
         ])
 
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
+                '.update_network')
+    def test_update_network_connected(self, mock_update_network):
+        self._network._local_network = False
+        device = {
+            "state": constants.RUNNING,
+            "instance": self._instance,
+            "index": mock.sentinel.index,
+            constants.IS_CONNECTED: constants.ON,
+        }
+
+        self._network._update_network(device, mock.sentinel.network)
+
+        mock_update_network.assert_called_once_with(
+            instance=self._instance, index=mock.sentinel.index,
+            field=constants.FIELD_NIC,
+            value=(constants.NIC_MODE_BRIDGED, mock.sentinel.network))
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
+                '.update_network')
+    def test_update_network_admin_down(self, mock_update_network):
+        self._network._local_network = False
+        device = {
+            "state": constants.RUNNING,
+            "instance": self._instance,
+            "index": mock.sentinel.index,
+            constants.NIC_MODE: constants.NIC_MODE_BRIDGED,
+            constants.BRIDGE_ADAPTER: mock.sentinel.network,
+            constants.IS_CONNECTED: constants.ON,
+        }
+
+        self._network._update_network(device, mock.sentinel.network,
+                                      connected=False)
+
+        # Only the link state is changed
+        mock_update_network.assert_called_once_with(
+            instance=self._instance, index=mock.sentinel.index,
+            field=constants.FIELD_LINK_STATE, value=(constants.OFF,))
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxManage'
+                '.update_network')
+    def test_setup_devices_admin_state(self, mock_update_network):
+        self._network._local_network = False
+        device = {
+            "state": constants.RUNNING,
+            "instance": self._instance,
+            "index": mock.sentinel.index,
+            constants.NIC_MODE: constants.NIC_MODE_BRIDGED,
+            constants.BRIDGE_ADAPTER: mock.sentinel.network,
+            constants.IS_CONNECTED: constants.ON,
+        }
+        self._network._devices._ports[mock.sentinel.device] = device
+        devices = {mock.sentinel.device: mock.sentinel.network}
+
+        # Only the transitions of the admin state change the cable
+        for disconnected, link_state in (({mock.sentinel.device}, "off"),
+                                         ({mock.sentinel.device}, None),
+                                         ((), "on"), ((), None)):
+            mock_update_network.reset_mock()
+            self.assertEqual({}, self._network.setup_devices(
+                devices, disconnected))
+
+            if link_state is None:
+                self.assertFalse(mock_update_network.called)
+            else:
+                mock_update_network.assert_called_once_with(
+                    instance=self._instance, index=mock.sentinel.index,
+                    field=constants.FIELD_LINK_STATE, value=(link_state,))
+                self.assertEqual(link_state,
+                                 device[constants.IS_CONNECTED])
+        self.assertEqual({"applied": 2, "skipped": 2},
+                         self._network.setup_statistics())
+
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._modify_network')
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._update_network')
-    def test_setup_device(self, mock_update_network, mock_modify_network):
-        device = {"state": constants.POWER_OFF}
-        self._network._nic[mock.sentinel.device] = device
+    def test_setup_devices(self, mock_update_network, mock_modify_network):
+        device = {"state": constants.POWER_OFF, "instance": self._instance}
+        device2 = {"state": constants.POWER_OFF, "instance": self._instance}
+        device3 = {"state": constants.RUNNING,
+                   "instance": mock.sentinel.instance}
+        self._network._devices._ports = {
+            mock.sentinel.device: device,
+            mock.sentinel.device2: device2,
+            mock.sentinel.device3: device3,
+        }
 
-        self._network.setup_device(mock.sentinel.device,
-                                   mock.sentinel.network)
+        errors = self._network.setup_devices({
+            mock.sentinel.device: mock.sentinel.network,
+            mock.sentinel.device2: mock.sentinel.network,
+            mock.sentinel.device3: mock.sentinel.network,
+            mock.sentinel.missing_device: mock.sentinel.network,
+        })
 
-        mock_modify_network.assert_called_once_with(
-            device, mock.sentinel.network)
-        self.assertEqual(0, mock_update_network.call_count)
+        self.assertEqual({}, errors)
+        mock_modify_network.assert_called_once_with(self._instance, mock.ANY)
+        self.assertEqual(
+            sorted([(device, mock.sentinel.network, True),
+                    (device2, mock.sentinel.network, True)]),
+            sorted(mock_modify_network.call_args[0][1]))
+        mock_update_network.assert_called_once_with(
+            device3, mock.sentinel.network, True)
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._modify_network')
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._update_network')
-    def test_setup_device_update(self, mock_update_network,
-                                 mock_modify_network):
-        device = {"state": constants.POWER_OFF}
-        mock_modify_network.side_effect = [
-            vbox_exc.VBoxManageError(method=None, reason="error")]
-        self._network._nic[mock.sentinel.device] = device
+    def test_setup_devices_update(self, mock_update_network,
+                                  mock_modify_network):
+        device = {"state": constants.POWER_OFF, "instance": self._instance}
+        error = vbox_exc.VBoxManageError(method=None, reason="error")
+        mock_modify_network.side_effect = [error]
+        mock_update_network.side_effect = [error]
+        self._network._devices._ports[mock.sentinel.device] = device
 
-        self._network.setup_device(mock.sentinel.device,
-                                   mock.sentinel.network)
+        errors = self._network.setup_devices(
+            {mock.sentinel.device: mock.sentinel.network})
 
         mock_modify_network.assert_called_once_with(
-            device, mock.sentinel.network)
+            self._instance, [(device, mock.sentinel.network, True)])
         mock_update_network.assert_called_once_with(
-            device, mock.sentinel.network)
+            device, mock.sentinel.network, True)
+        self.assertEqual({mock.sentinel.device: error}, errors)
 
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._modify_network')
     @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
                 '._update_network')
-    def test_setup_device_fail(self, mock_update_network,
-                               mock_modify_network):
+    def test_setup_devices_configured(self, mock_update_network,
+                                      mock_modify_network):
+        configured = {
+            "state": constants.POWER_OFF, "instance": self._instance,
+            constants.NIC_MODE: constants.NIC_MODE_BRIDGED,
+            constants.NIC_TYPE: cfg.CONF.virtualbox.nic_type,
+            constants.BRIDGE_ADAPTER: mock.sentinel.network,
+            constants.IS_CONNECTED: constants.ON,
+        }
+        running = dict(configured, state=constants.RUNNING,
+                       instance=mock.sentinel.instance)
+        running[constants.NIC_TYPE] = constants.NIC_TYPE_VIRTIO
+        wrong_type = dict(configured)
+        wrong_type[constants.NIC_TYPE] = constants.NIC_TYPE_VIRTIO
+        self._network._devices._ports = {
+            mock.sentinel.device: configured,
+            mock.sentinel.device2: running,
+            mock.sentinel.device3: wrong_type,
+        }
+        devices = {
+            mock.sentinel.device: mock.sentinel.network,
+            mock.sentinel.device2: mock.sentinel.network,
+            mock.sentinel.device3: mock.sentinel.network,
+        }
+
+        self.assertEqual({}, self._network.setup_devices(devices))
+
+        mock_modify_network.assert_called_once_with(
+            self._instance, [(wrong_type, mock.sentinel.network, True)])
+        self.assertFalse(mock_update_network.called)
+        self.assertEqual(cfg.CONF.virtualbox.nic_type,
+                         wrong_type[constants.NIC_TYPE])
+        self.assertEqual({"applied": 1, "skipped": 2},
+                         self._network.setup_statistics())
+
+        # The device is now known to be configured
+        mock_modify_network.reset_mock()
+        self.assertEqual({}, self._network.setup_devices(devices))
+        self.assertFalse(mock_modify_network.called)
+        self.assertEqual({"applied": 1, "skipped": 5},
+                         self._network.setup_statistics())
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.VBoxNetworkManage'
+                '.setup_devices')
+    def test_setup_device(self, mock_setup_devices):
+        error = vbox_exc.VBoxManageError(method=None, reason="error")
+        mock_setup_devices.side_effect = [{}, {mock.sentinel.device: error}]
+
         self._network.setup_device(mock.sentinel.device,
                                    mock.sentinel.network)
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._network.setup_device,
+                          mock.sentinel.device, mock.sentinel.network)
+        mock_setup_devices.assert_called_with(
+            {mock.sentinel.device: mock.sentinel.network})
+
+    def test_disconnect_device(self):
+        running = {"state": constants.RUNNING, "instance": self._instance,
+                   "index": mock.sentinel.index,
+                   constants.IS_CONNECTED: constants.ON}
+        powered_off = dict(running, state=constants.POWER_OFF)
+        self._network._devices._ports = {
+            mock.sentinel.device: running,
+            mock.sentinel.device2: powered_off,
+        }
+
+        with mock.patch.object(self._network, '_vbox') as mock_vbox:
+            self.assertTrue(
+                self._network.disconnect_device(mock.sentinel.device))
+            self.assertTrue(
+                self._network.disconnect_device(mock.sentinel.device2))
+            # The devices are already disconnected
+            self.assertFalse(
+                self._network.disconnect_device(mock.sentinel.device))
+            self.assertFalse(
+                self._network.disconnect_device(mock.sentinel.missing))
+
+        mock_vbox.update_network.assert_called_once_with(
+            instance=self._instance, index=mock.sentinel.index,
+            field=constants.FIELD_LINK_STATE, value=(constants.OFF,))
+        mock_vbox.modify_network.assert_called_once_with(
+            self._instance, mock.sentinel.index,
+            [(constants.FIELD_CABLE_CONNECTED, constants.OFF)])
+        self.assertEqual(constants.OFF, running[constants.IS_CONNECTED])
+        self.assertEqual(constants.OFF, powered_off[constants.IS_CONNECTED])
+
+
+class TestVBoxEventWatcher(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestVBoxEventWatcher, self).setUp()
+        self._vbox_sdk = mock.patch('neutron.plugins.virtualbox.common.'
+                                    'vboxapi.vbox_sdk').start()
+        mock.patch('neutron.plugins.virtualbox.common.vboxapi._VBOX_MANAGER',
+                   None).start()
+        self._manager = self._vbox_sdk.VirtualBoxManager.return_value
+        self._manager.constants.VBoxEventType_OnMachineRegistered = 1
+        self._manager.constants.VBoxEventType_OnMachineStateChanged = 2
+        self._manager.constants.VBoxEventType_OnMachineDataChanged = 3
+        self._manager.queryInterface.side_effect = lambda event, _: event
+        self._virtualbox = self._manager.getVirtualBox.return_value
+        self._event_source = self._virtualbox.eventSource
+
+        self._watcher = vboxapi.VBoxEventWatcher()
+        self._watcher.start()
+
+    def _get_event(self, event_type, machine_id, registered=True):
+        return mock.Mock(type=event_type, machineId=machine_id,
+                         registered=registered)
+
+    def test_start(self):
+        self.assertTrue(self._watcher.active)
+        self._event_source.registerListener.assert_called_once_with(
+            self._event_source.createListener.return_value,
+            mock.ANY, False)
+
+    @mock.patch('neutron.plugins.virtualbox.common.vboxapi.vbox_sdk', None)
+    def test_start_fail(self):
+        watcher = vboxapi.VBoxEventWatcher()
+        self.assertRaises(vbox_exc.VBoxException, watcher.start)
+        self.assertFalse(watcher.active)
+
+    def test_stop(self):
+        self._watcher.stop()
+
+        self.assertEqual(1, self._event_source.unregisterListener.call_count)
+        self.assertFalse(self._watcher.active)
+
+    def test_wait(self):
+        events = [self._get_event(2, mock.sentinel.machine),
+                  self._get_event(4, mock.sentinel.machine2),
+                  None]
+        self._event_source.getEvent.side_effect = events
+        self._virtualbox.findMachine.return_value.name = mock.sentinel.name
+
+        changes, full_scan = self._watcher.wait(10)
+
+        self.assertEqual({mock.sentinel.name}, changes)
+        self.assertFalse(full_scan)
+        self._virtualbox.findMachine.assert_called_once_with(
+            mock.sentinel.machine)
+        self.assertEqual(2, self._event_source.eventProcessed.call_count)
+
+    def test_wait_unregistered(self):
+        self._event_source.getEvent.side_effect = [
+            self._get_event(1, mock.sentinel.machine, registered=False),
+            None]
+
+        changes, full_scan = self._watcher.wait(10)
+
+        self.assertEqual(set(), changes)
+        self.assertTrue(full_scan)
+        self.assertEqual(0, self._virtualbox.findMachine.call_count)
+
+    def test_wait_timeout(self):
+        self._event_source.getEvent.return_value = None
+
+        self.assertEqual((set(), False), self._watcher.wait(0))
+
+    def test_wait_yields(self):
+        def get_event(listener, timeout):
+            # Like the XPCOM call, block the whole process while waiting.
+            eventlet.patcher.original('time').sleep(timeout / 1000.0)
+
+        def count():
+            while True:
+                steps.append(None)
+                eventlet.sleep(0.01)
+
+        steps = []
+        self._event_source.getEvent.side_effect = get_event
+        counter = eventlet.spawn(count)
+        try:
+            self.assertEqual((set(), False), self._watcher.wait(0.3))
+        finally:
+            counter.kill()
 
-        self.assertEqual(0, mock_modify_network.call_count)
-        self.assertEqual(0, mock_update_network.call_count)
+        self.assertGreater(len(steps), 10)
+        for call in self._event_source.getEvent.call_args_list:
+            self.assertEqual(mock.call(mock.ANY, 0), call)